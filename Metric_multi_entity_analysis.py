@@ -5,80 +5,4634 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import altair as alt
+import argparse
+import array
+import bisect
+import bz2
+import collections
+import contextlib
+import cProfile
+import csv
+import fnmatch
+import functools
+import gzip
+import hashlib
+import heapq
+import http.server
 import io
+import itertools
+import json
+import lzma
+import marshal
+import math
+import mmap
+import os
+import queue
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
 
-def process_data(data):
+def _parse_row(row):
+    """
+    Parse a single input row into its entity names and volume.
+
+    Applies the process_data grammar to one row: entities are separated by
+    pipes and the last whitespace-separated token of the row is taken as the
+    volume when it is made of digits. Blank entities are dropped.
+
+    Args:
+        row (str): One line of input, without its trailing newline.
+
+    Returns:
+        tuple: (names, volume) where names is a list of non-blank entity
+               names (empty for blank rows) and volume is an int.
+    """
+    # Skip empty rows
+    if not row.strip():
+        return [], 1
+
+    # Split the row into entities
+    metrics = row.split('|')
+
+    # Check if the last part of the row contains a volume number
+    # Input validation to prevent crashes on malformed data
+    try:
+        last_part = metrics[-1].strip().split()
+        if len(last_part) > 1 and last_part[-1].isdigit():
+            volume = int(last_part[-1])
+            metrics[-1] = ' '.join(last_part[:-1])
+        else:
+            volume = 1
+    except (IndexError, ValueError):
+        # If parsing fails, default to volume of 1
+        volume = 1
+
+    # Keep the entities whose name is not blank
+    names = [name for name in (metric.strip() for metric in metrics) if name]
+    return names, volume
+
+
+# Input grammar: how rows, entities and volumes are delimited
+Grammar = collections.namedtuple(
+    'Grammar',
+    ['row_separator', 'entity_separator', 'volume', 'volume_prefix', 'numbers', 'filters'],
+    defaults=['\n', '|', 'last', '', 'integer', None],
+)
+Grammar.__doc__ = """
+Input grammar for process_data and the other parsing entry points.
+
+Fields:
+    row_separator (str): Separates rows (default newline).
+    entity_separator (str): Separates entities within a row (default '|').
+    volume (str): Where a row's volume is written: 'last' (the last
+                  whitespace-separated token of the row, the default), 'first'
+                  (the first token of the row) or 'none' (every row counts 1).
+    volume_prefix (str): Marker written directly before the volume digits,
+                         e.g. 'x' for rows like "Entity A|Entity B x5".
+    numbers (str): Which volumes are recognised: 'integer' (digits only, the
+                   default) or 'decimal', which also accepts decimal and
+                   exponent notation such as 2.5 or 1e3 and sums without
+                   silent int64 overflow (see _volume_dtype).
+    filters (EntityFilter): Include/exclude rules applied to entity names
+                            while parsing, so filtered entities are never
+                            aggregated. None (the default) keeps every entity.
+"""
+
+DEFAULT_GRAMMAR = Grammar()
+
+
+# Compiled parsers kept by compile_parser; filter rules make grammars free-form
+_PARSER_CACHE_SIZE = 64
+
+
+@functools.lru_cache(maxsize=_PARSER_CACHE_SIZE)
+def compile_parser(grammar=DEFAULT_GRAMMAR):
+    """
+    Compile a grammar into a specialized row parser.
+
+    The default grammar returns the reference parser used by process_data.
+    Other grammars are compiled once into a closure around a precompiled
+    regular expression, with the volume handling chosen up front so parsing a
+    row involves no per-line option checks. The most recently used
+    _PARSER_CACHE_SIZE parsers are cached, so repeated calls with the same
+    grammar reuse the same parser without the cache growing with every set
+    of filter rules.
+
+    Args:
+        grammar (Grammar): Grammar to compile.
+
+    Returns:
+        callable: Function mapping a row to (names, volume) like _parse_row.
+
+    Raises:
+        ValueError: If the grammar or one of its filter rules is invalid.
+    """
+    if grammar.volume not in ('last', 'first', 'none'):
+        raise ValueError(f'Unknown volume position: {grammar.volume!r}')
+    if grammar.numbers not in ('integer', 'decimal'):
+        raise ValueError(f'Unknown number format: {grammar.numbers!r}')
+    if not grammar.row_separator or not grammar.entity_separator:
+        raise ValueError('Row and entity separators must not be empty')
+    if grammar.filters is not None:
+        # Filter the names found by the parser of the same grammar without rules
+        parse_names = compile_parser(grammar._replace(filters=None))
+        filter_names = _name_filter(grammar.filters)
+        if filter_names is None:
+            return parse_names
+
+        def parse_row(row):
+            names, volume = parse_names(row)
+            return filter_names(names), volume
+
+        return parse_row
+    if grammar == DEFAULT_GRAMMAR:
+        return _parse_row
+
+    separator = grammar.entity_separator
+    prefix = re.escape(grammar.volume_prefix)
+    if grammar.numbers == 'integer':
+        number = r'(\d+)'
+        to_volume = int
+    else:
+        number = f'({_DECIMAL_TOKEN})'
+        to_volume = _decimal_volume
+
+    def split_names(parts):
+        return [name for name in (part.strip() for part in parts) if name]
+
+    if grammar.volume == 'none':
+        def parse_row(row):
+            return split_names(row.split(separator)), 1
+
+    elif grammar.volume == 'last':
+        # The volume must follow whitespace and another token of the last entity
+        volume_re = re.compile(rf'(?<=\S)\s+{prefix}{number}\s*$')
+
+        def parse_row(row):
+            parts = row.split(separator)
+            match = volume_re.search(parts[-1])
+            volume = None if match is None else to_volume(match.group(1))
+            if volume is None:
+                return split_names(parts), 1
+            # Like the reference parser, whitespace runs in the entity before
+            # the volume collapse to single spaces
+            parts[-1] = ' '.join(parts[-1][:match.start()].split())
+            return split_names(parts), volume
+
+    else:
+        # The volume must be followed by whitespace and a token of the first entity
+        volume_re = re.compile(rf'^\s*{prefix}{number}\s+(?=\S)')
+
+        def parse_row(row):
+            parts = row.split(separator)
+            match = volume_re.match(parts[0])
+            volume = None if match is None else to_volume(match.group(1))
+            if volume is None:
+                return split_names(parts), 1
+            parts[0] = ' '.join(parts[0][match.end():].split())
+            return split_names(parts), volume
+
+    return parse_row
+
+
+# A volume in decimal mode: digits with an optional fraction and exponent
+_DECIMAL_TOKEN = r'\d+(?:\.\d+)?(?:[eE][+-]?\d+)?'
+_DECIMAL_TOKEN_RE = re.compile(_DECIMAL_TOKEN)
+
+
+def _decimal_volume(token):
+    """Convert a decimal-mode volume token, keeping whole numbers as exact ints."""
+    if token.isdigit():
+        return int(token)
+    volume = float(token)
+    # Exponents beyond the float range are not volumes
+    return volume if math.isfinite(volume) else None
+
+
+def _line_parser(grammar):
+    """
+    Compile a grammar for the line-oriented file readers.
+
+    Raises:
+        ValueError: If the grammar uses a row separator other than newline.
+    """
+    if grammar.row_separator != '\n':
+        raise ValueError('File inputs are read line by line; the row separator must be a newline')
+    return compile_parser(grammar)
+
+
+# Kinds of entity filter rules, written as "<kind>:<pattern>"
+_FILTER_KINDS = ('exact', 'prefix', 'contains', 're')
+
+# Distinct names whose filter decision is remembered per compiled parser
+_FILTER_MEMO_SIZE = 1 << 18
+
+
+class EntityFilter(collections.namedtuple('EntityFilter', ['include', 'exclude'])):
+    """
+    Include and exclude rules for entity names, used as Grammar.filters.
+
+    A name is kept if it matches any include rule (or there are none) and no
+    exclude rule. Each rule is one of:
+
+    - 'exact:NAME' or a bare NAME: the whole name
+    - 'prefix:TEXT': names starting with TEXT
+    - 'contains:TEXT': names containing TEXT
+    - 're:PATTERN': names in which the regular expression PATTERN is found
+
+    Matching is case-sensitive (use 're:(?i)...' otherwise). Rules are
+    compiled once per grammar into an EntityMatcher.
+
+    Args:
+        include (iterable): Rules selecting the entities to keep.
+        exclude (iterable): Rules selecting the entities to drop.
+
+    Examples:
+        >>> filters = EntityFilter(include=['prefix:acct-'],
+        ...                        exclude=['contains:test', 're:-bot\\d+$'])
+        >>> process_data(data, Grammar(filters=filters))
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, include=(), exclude=()):
+        # Tuples keep the filter hashable, so grammars stay usable as cache keys
+        include = (include,) if isinstance(include, str) else tuple(include)
+        exclude = (exclude,) if isinstance(exclude, str) else tuple(exclude)
+        return super().__new__(cls, include, exclude)
+
+
+def parse_filter_rules(text):
+    """
+    Read filter rules written one per line, skipping blank lines.
+
+    Args:
+        text (str): Rules, for example the contents of a rules file.
+
+    Returns:
+        tuple: The rules, stripped of surrounding whitespace.
+    """
+    return tuple(line.strip() for line in text.splitlines() if line.strip())
+
+
+class _SubstringAutomaton:
+    """
+    Aho-Corasick automaton telling whether a text contains any of many words.
+
+    States are trie nodes with a dict of transitions; failure links point to
+    the longest proper suffix that is also a trie prefix, so a text is
+    scanned once regardless of the number of words.
+    """
+
+    def __init__(self, words):
+        goto = [{}]
+        accept = [False]
+        for word in words:
+            state = 0
+            for char in word:
+                following = goto[state].get(char)
+                if following is None:
+                    following = len(goto)
+                    goto[state][char] = following
+                    goto.append({})
+                    accept.append(False)
+                state = following
+            accept[state] = True
+
+        # Breadth-first, so the failure state of a node is always complete
+        fail = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in goto[state].items():
+                queue.append(following)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[following] = goto[fallback].get(char, 0)
+                accept[following] = accept[following] or accept[fail[following]]
+        self._goto, self._fail, self._accept = goto, fail, accept
+
+    def search(self, text):
+        """Return whether any word occurs in text."""
+        goto, fail, accept = self._goto, self._fail, self._accept
+        if accept[0]:
+            return True
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if accept[state]:
+                return True
+        return False
+
+
+class EntityMatcher:
+    """
+    Multi-pattern matcher compiled from entity filter rules.
+
+    Exact names are kept in a hash set, prefixes in one hash set per prefix
+    length, substrings in an Aho-Corasick automaton and regular expressions
+    in a single alternation, so the cost of a match grows with the length of
+    the name rather than the number of rules. Expressions with inline flags
+    such as '(?i)' are compiled on their own, so the flags stay scoped to
+    their rule.
+
+    Args:
+        rules (iterable): Rules in the EntityFilter syntax.
+
+    Raises:
+        ValueError: If a regular expression rule is invalid.
+
+    Examples:
+        >>> matcher = EntityMatcher(['Entity A', 'prefix:tmp-', 'contains:test'])
+        >>> matcher.matches('tmp-42'), matcher.matches('Entity B')
+        (True, False)
+    """
+
+    def __init__(self, rules):
+        self._exact = set()
+        self._prefixes = {}
+        substrings = set()
+        patterns = []
+        flagged = []
+        for rule in rules:
+            kind, separator, pattern = rule.partition(':')
+            if not separator or kind not in _FILTER_KINDS:
+                kind, pattern = 'exact', rule
+            if kind == 'exact':
+                self._exact.add(pattern)
+            elif kind == 'prefix':
+                self._prefixes.setdefault(len(pattern), set()).add(pattern)
+            elif kind == 'contains':
+                substrings.add(pattern)
+            else:
+                try:
+                    regex = re.compile(pattern)
+                except re.error as e:
+                    raise ValueError(f'Invalid regular expression in filter rule {rule!r}: {e}') from e
+                # Inline flags such as (?i) apply to the whole expression they
+                # are in, so an alternation would pass them on to other rules
+                if regex.flags != re.UNICODE:
+                    flagged.append(regex)
+                else:
+                    patterns.append(pattern)
+
+        self._substrings = _SubstringAutomaton(substrings) if substrings else None
+        self._regexes = flagged
+        if patterns:
+            try:
+                self._regexes.append(re.compile('|'.join(f'(?:{pattern})' for pattern in patterns)))
+            except re.error:
+                # Patterns that cannot share one expression, e.g. reusing a group name
+                self._regexes.extend(re.compile(pattern) for pattern in patterns)
+
+    def matches(self, name):
+        """
+        Tell whether a name matches any rule.
+
+        Args:
+            name (str): Entity name.
+
+        Returns:
+            bool: True if at least one rule matches.
+        """
+        if name in self._exact:
+            return True
+        for length, prefixes in self._prefixes.items():
+            if name[:length] in prefixes:
+                return True
+        if self._substrings is not None and self._substrings.search(name):
+            return True
+        return any(regex.search(name) for regex in self._regexes)
+
+
+def _name_filter(filters):
+    """
+    Compile filter rules into a function dropping filtered names from a list.
+
+    Decisions are remembered per distinct name, since the same entities recur
+    on many rows.
+
+    Returns:
+        callable or None: The function, or None if there are no rules.
+    """
+    if not filters.include and not filters.exclude:
+        return None
+    include = EntityMatcher(filters.include) if filters.include else None
+    exclude = EntityMatcher(filters.exclude)
+    decisions = {}
+
+    def filter_names(names):
+        kept = []
+        for name in names:
+            keep = decisions.get(name)
+            if keep is None:
+                keep = (include is None or include.matches(name)) and not exclude.matches(name)
+                if len(decisions) >= _FILTER_MEMO_SIZE:
+                    decisions.clear()
+                decisions[name] = keep
+            if keep:
+                kept.append(name)
+        return kept
+
+    return filter_names
+
+
+def _filter_records(records, grammar):
+    """Apply the filter rules of a grammar to (names, volume) records of structured files."""
+    filter_names = _name_filter(grammar.filters) if grammar.filters is not None else None
+    if filter_names is None:
+        return records
+    return ((filter_names(names), volume) for names, volume in records)
+
+
+def _aggregate_rows(rows, totals, parse_row=_parse_row):
+    """
+    Add the entities of each row to a running per-entity total.
+
+    Args:
+        rows (iterable): Input rows without trailing newlines.
+        totals (dict): Mapping of entity name to summed volume, updated in place.
+        parse_row (callable): Row parser, as returned by compile_parser.
+
+    Returns:
+        dict: The updated totals.
+    """
+    get = totals.get
+    for row in rows:
+        names, volume = parse_row(row)
+        for name in names:
+            totals[name] = get(name, 0) + volume
+    return totals
+
+
+# Largest value of the native int64 volume column
+_INT64_MAX = int(np.iinfo(np.int64).max)
+
+
+def _volume_dtype(volumes):
+    """
+    Choose the Volume column type so that summing never overflows silently.
+
+    Any fractional volume makes the column float64. Integer volumes stay on
+    the native int64 fast path whenever no sum of them can leave the int64
+    range, and only escalate to exact Python integers (object) otherwise.
+
+    Args:
+        volumes (list): Non-negative int or float volumes.
+
+    Returns:
+        The dtype to use, or None for an empty list.
+    """
+    if not volumes:
+        return None
+    if any(isinstance(volume, float) for volume in volumes):
+        return np.float64
+    # Volumes are non-negative, so the grand total bounds every entity's sum;
+    # the cheap bound is tried before summing exactly
+    if int(max(volumes)) * len(volumes) <= _INT64_MAX:
+        return np.int64
+    if sum(int(volume) for volume in volumes) <= _INT64_MAX:
+        return np.int64
+    return object
+
+
+def _group_volumes(pairs):
+    """
+    Sum (entity, volume) pairs per entity into a process_data style result.
+
+    The Volume column type is chosen by _volume_dtype. When integer sums had
+    to escalate to exact Python integers, df.attrs['volume_overflow'] is set
+    so callers can report it.
+
+    Args:
+        pairs (list): (entity, volume) tuples.
+
+    Returns:
+        pd.DataFrame: DataFrame with columns ['Entity', 'Volume'], sorted by
+                     volume in descending order exactly as process_data sorts.
+    """
+    volumes = [volume for _, volume in pairs]
+    dtype = _volume_dtype(volumes)
+    if dtype is None:
+        df = pd.DataFrame(pairs, columns=['Entity', 'Volume'])
+    else:
+        if dtype is object:
+            volumes = [int(volume) for volume in volumes]
+        df = pd.DataFrame({'Entity': [name for name, _ in pairs],
+                           'Volume': pd.Series(volumes, dtype=dtype)})
+    df = df.groupby('Entity').sum().reset_index()
+    df = df.sort_values('Volume', ascending=False)
+    if dtype is object:
+        df.attrs['volume_overflow'] = True
+    return df
+
+
+def _totals_to_frame(totals):
+    """
+    Build a process_data style result from per-entity totals.
+
+    Args:
+        totals (dict): Mapping of entity name to summed volume.
+
+    Returns:
+        pd.DataFrame: DataFrame with columns ['Entity', 'Volume'], sorted by
+                     volume in descending order exactly as process_data sorts.
+    """
+    return _group_volumes(list(totals.items()))
+
+
+class _Metric:
+    """A named metric whose samples are kept per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames, lock):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = lock
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Counter(_Metric):
+    """Monotonically increasing total, exposed as <name>_total."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Add a non-negative amount to the counter."""
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return the current total for the given label values."""
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f'{self.name}_total{self._labels(key)} {value}'
+
+
+class _Histogram(_Metric):
+    """Distribution of observed values over fixed cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, lock, buckets):
+        super().__init__(name, documentation, labelnames, lock)
+        self.buckets = sorted(float(bound) for bound in buckets)
+
+    def observe(self, value, **labels):
+        """Record one observation."""
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        """Return the number of observations for the given label values."""
+        counts, _ = self._values.get(self._key(labels)) or ([0], 0)
+        return sum(counts)
+
+    def _samples(self):
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield f'{self.name}_bucket{self._labels(key, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_count{self._labels(key)} {cumulative}'
+            yield f'{self.name}_sum{self._labels(key)} {total!r}'
+
+
+# Media type of the OpenMetrics text exposition format
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms exported in the OpenMetrics text format.
+
+    Metrics are updated under one lock, once per processing run rather than
+    per line, so recording them costs nothing measurable next to parsing.
+    The text can be scraped from serve_metrics() or written to a file for a
+    node exporter's textfile collector.
+
+    Examples:
+        >>> registry = MetricsRegistry()
+        >>> runs = registry.counter('jobs', 'Jobs run.', ['source'])
+        >>> runs.inc(source='cli')
+        >>> print(registry.render())
+        # TYPE jobs counter ... jobs_total{source="cli"} 1 ... # EOF
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Create and register a counter."""
+        return self._register(_Counter(name, documentation, labelnames, self._lock))
+
+    def histogram(self, name, documentation, buckets, labelnames=()):
+        """Create and register a histogram with the given upper bucket bounds."""
+        return self._register(_Histogram(name, documentation, labelnames, self._lock, buckets))
+
+    def render(self):
+        """
+        Render every metric in the OpenMetrics text format.
+
+        Returns:
+            str: The exposition, terminated by '# EOF'.
+        """
+        lines = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+                lines.append(f'# HELP {metric.name} {metric.documentation}')
+                lines.extend(metric._samples())
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the exposition to a file so readers never see a partial file."""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+# Process-wide registry and the metrics recorded by the processing paths
+METRICS = MetricsRegistry()
+_RUNS = METRICS.counter('metric_analysis_runs', 'Completed processing runs.', ['source'])
+_LINES = METRICS.counter('metric_analysis_lines', 'Input lines processed.', ['source'])
+_BYTES = METRICS.counter('metric_analysis_bytes', 'Input bytes processed.', ['source'])
+_ENTITIES = METRICS.counter('metric_analysis_entities',
+                            'Distinct entities in the results of completed runs.', ['source'])
+_RUN_SECONDS = METRICS.histogram('metric_analysis_run_seconds', 'Duration of processing runs.',
+                                 [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+                                  60, 300], ['source'])
+_CACHE_LOOKUPS = METRICS.counter('metric_analysis_cache_lookups', 'Result cache lookups.',
+                                 ['result'])
+_READ_SECONDS = METRICS.counter('metric_analysis_read_seconds',
+                                'Time spent reading input blocks from files.', ['source'])
+_READ_WAIT_SECONDS = METRICS.counter('metric_analysis_read_wait_seconds',
+                                     'Time parsing waited for input blocks.', ['source'])
+_READ_OVERLAP = METRICS.histogram('metric_analysis_read_overlap_ratio',
+                                  'Share of the read time of a run hidden behind parsing.',
+                                  [0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1], ['source'])
+
+
+def _record_run(source, started, entities, lines=None, nbytes=None):
+    """Record a completed run that started at the given time.perf_counter() value."""
+    _RUN_SECONDS.observe(time.perf_counter() - started, source=source)
+    _RUNS.inc(source=source)
+    _ENTITIES.inc(entities, source=source)
+    if lines is not None:
+        _LINES.inc(lines, source=source)
+    if nbytes is not None:
+        _BYTES.inc(nbytes, source=source)
+
+
+def _record_reads(source, read_seconds, wait_seconds):
+    """Record the read and wait times of a run's read-ahead input."""
+    _READ_SECONDS.inc(read_seconds, source=source)
+    _READ_WAIT_SECONDS.inc(wait_seconds, source=source)
+    _READ_OVERLAP.observe(_overlap(read_seconds, wait_seconds), source=source)
+
+
+def _overlap(read_seconds, wait_seconds):
+    """Share of the read time that did not keep the parser waiting."""
+    if read_seconds <= 0:
+        return 0.0
+    return min(max(1 - wait_seconds / read_seconds, 0.0), 1.0)
+
+
+# Characters encoded at once when measuring the UTF-8 size of a string
+_BYTES_BLOCK_CHARS = 1 << 16
+
+
+def _text_bytes(data):
+    """
+    Return the UTF-8 size of a string without building an encoded copy.
+
+    ASCII strings are their own size. Otherwise the string is encoded one
+    block of characters at a time, so only a block's bytes exist at once.
+    """
+    if data.isascii():
+        return len(data)
+    return sum(len(data[start:start + _BYTES_BLOCK_CHARS].encode('utf-8'))
+               for start in range(0, len(data), _BYTES_BLOCK_CHARS))
+
+
+def serve_metrics(port, host='127.0.0.1', registry=METRICS):
+    """
+    Serve the metrics over HTTP from a background thread.
+
+    Any GET path returns the current exposition, so the endpoint can be
+    scraped as http://HOST:PORT/metrics.
+
+    Args:
+        port (int): Port to listen on; 0 picks a free port.
+        host (str): Interface to bind.
+        registry (MetricsRegistry): Metrics to expose.
+
+    Returns:
+        http.server.ThreadingHTTPServer: The running server; its
+        server_address holds the bound port and shutdown() stops it.
+    """
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Profiler modes: a sampling profiler for low overhead and hot lines, or
+# cProfile for exact call counts
+_PROFILER_MODES = ('sampling', 'deterministic')
+
+
+class Profiler:
+    """
+    Profile the code run inside a with block.
+
+    In 'sampling' mode a background thread records the Python stack of the
+    profiled thread every interval seconds, which costs little and shows
+    both the hot functions and the hot lines. In 'deterministic' mode
+    cProfile records every call, giving exact call counts at the price of a
+    per-call overhead, and no line-level data. Only code locations are
+    recorded, never the data being processed, so profiles of confidential
+    inputs can be shared.
+
+    Args:
+        mode (str): 'sampling' (the default) or 'deterministic'.
+        interval (float): Seconds between samples in sampling mode.
+
+    Raises:
+        ValueError: If the mode is unknown.
+
+    Examples:
+        >>> with Profiler() as profiler:
+        ...     process_data(data)
+        >>> profiler.functions()      # hot functions, most self time first
+        >>> profiler.lines()          # hot lines (sampling mode)
+        >>> open(profiler.file_name, 'wb').write(profiler.dump())
+    """
+
+    def __init__(self, mode='sampling', interval=0.005):
+        if mode not in _PROFILER_MODES:
+            raise ValueError(f'Unknown profiler mode: {mode}')
+        self.mode = mode
+        self.interval = interval
+        self.elapsed = 0.0
+        self.file_name = ('metric_analysis.prof' if mode == 'deterministic'
+                          else 'metric_analysis.folded')
+        self._stacks = collections.Counter()
+        self._stats = {}
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        if self.mode == 'deterministic':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._target = threading.get_ident()
+            self._stop = threading.Event()
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.mode == 'deterministic':
+            self._profile.disable()
+            self._profile.create_stats()
+            self._stats = self._profile.stats
+        else:
+            self._stop.set()
+            self._sampler.join()
+        self.elapsed = time.perf_counter() - self._started
+        return False
+
+    def _sample(self):
+        """Record the stack of the profiled thread until stopped."""
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            self._stacks[tuple(reversed(stack))] += 1
+
+    @property
+    def samples(self):
+        """Number of stack samples taken (sampling mode)."""
+        return sum(self._stacks.values())
+
+    def functions(self, top=20):
+        """
+        Summarize the functions that took the most time.
+
+        Args:
+            top (int): Number of functions to return.
+
+        Returns:
+            pd.DataFrame: Columns ['Function', 'Location', 'Calls',
+                         'Self seconds', 'Total seconds'], by self time in
+                         descending order. Calls are only counted in
+                         deterministic mode; sampled times are estimates.
+        """
+        rows = []
+        if self.mode == 'deterministic':
+            for (filename, line, name), (_, calls, self_time, total_time, _) in self._stats.items():
+                rows.append((name, _code_location(filename, line), calls, self_time, total_time))
+        elif self._stacks:
+            seconds = self.elapsed / self.samples
+            own = collections.Counter()
+            inclusive = collections.Counter()
+            for stack, count in self._stacks.items():
+                own[stack[-1][:3]] += count
+                for function in {frame[:3] for frame in stack}:
+                    inclusive[function] += count
+            for (filename, line, name), count in inclusive.items():
+                rows.append((name, _code_location(filename, line), None,
+                             own[filename, line, name] * seconds, count * seconds))
+        df = pd.DataFrame(rows, columns=['Function', 'Location', 'Calls',
+                                         'Self seconds', 'Total seconds'])
+        df = df.sort_values(['Self seconds', 'Total seconds'], ascending=False, kind='stable')
+        return df.head(top).reset_index(drop=True)
+
+    def lines(self, top=20):
+        """
+        Summarize the source lines that were running most often.
+
+        Args:
+            top (int): Number of lines to return.
+
+        Returns:
+            pd.DataFrame: Columns ['Location', 'Function', 'Samples',
+                         'Share'], by samples in descending order. Empty in
+                         deterministic mode.
+        """
+        counts = collections.Counter()
+        for stack, count in self._stacks.items():
+            filename, _, name, line = stack[-1]
+            counts[_code_location(filename, line), name] += count
+        rows = [(location, name, count, count / self.samples)
+                for (location, name), count in counts.most_common(top)]
+        return pd.DataFrame(rows, columns=['Location', 'Function', 'Samples', 'Share'])
+
+    def summary(self, top=10):
+        """Format the hot functions (and lines, when sampled) as plain text."""
+        with pd.option_context('display.width', 200, 'display.max_colwidth', 80):
+            text = (f'Profile ({self.mode}, {self.elapsed:.2f} s)\n\nHot functions:\n'
+                    f'{self.functions(top).to_string(index=False)}\n')
+            if self.mode == 'sampling':
+                text += f'\nHot lines ({self.samples} samples):\n{self.lines(top).to_string(index=False)}\n'
+        return text
+
+    def dump(self):
+        """
+        Return the raw profile.
+
+        Returns:
+            bytes: pstats data in deterministic mode (load it with
+                   pstats.Stats or a viewer such as SnakeViz), or folded
+                   stacks in sampling mode (one 'frame;frame;... count'
+                   line per stack, for flame graph tools such as speedscope).
+        """
+        if self.mode == 'deterministic':
+            return marshal.dumps(self._stats)
+        lines = []
+        for stack, count in self._stacks.items():
+            frames = ';'.join(f'{name} ({_code_location(filename, line)})'
+                              for filename, _, name, line in stack)
+            lines.append(f'{frames} {count}\n')
+        return ''.join(lines).encode('utf-8')
+
+
+def _code_location(filename, line):
+    """Short file:line label of a code location."""
+    return f'{os.path.basename(filename)}:{line}'
+
+
+# Aggregation backends accepted by process_data
+_BACKENDS = ('pandas', 'arrow')
+
+
+def _parse_columns(rows, parse_row):
+    """
+    Parse rows into a flat list of names plus one volume and name count per row.
+
+    Unlike the (name, volume) pairs built by process_data, no tuple is
+    created per name, and the volumes can be expanded with np.repeat.
+    """
+    names = []
+    row_volumes = []
+    counts = []
+    extend = names.extend
+    add_volume = row_volumes.append
+    add_count = counts.append
+    for row in rows:
+        row_names, volume = parse_row(row)
+        extend(row_names)
+        add_volume(volume)
+        add_count(len(row_names))
+    return names, row_volumes, counts
+
+
+def _aggregate_arrow(names, row_volumes, counts):
+    """
+    Aggregate parsed columns with Arrow compute kernels.
+
+    The multi-threaded hash aggregation and the sort by name (the order
+    pandas' groupby produces) run in Arrow; only the final sort by volume
+    happens in pandas, on a numeric column, so ties come out exactly as in
+    process_data.
+
+    Args:
+        names (list): Entity names, as returned by _parse_columns.
+        row_volumes (list): Volume of each row.
+        counts (list): Number of names on each row.
+
+    Returns:
+        pd.DataFrame or None: The process_data result, or None if there are
+                              no entities or a volume does not fit int64;
+                              the pandas path decides the column type then.
+
+    Raises:
+        ImportError: If pyarrow is not installed.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError as e:
+        raise ImportError("The 'arrow' backend requires pyarrow") from e
+
+    if not names:
+        return None
+    try:
+        volumes = np.repeat(np.array(row_volumes, dtype=np.int64), counts)
+    except OverflowError:
+        return None
+
+    table = pa.table({'Entity': pa.array(names, pa.string()), 'Volume': volumes})
+    sums = table.group_by('Entity').aggregate([('Volume', 'sum')])
+    sums = sums.take(pc.sort_indices(sums, sort_keys=[('Entity', 'ascending')]))
+    df = pd.DataFrame({'Entity': sums.column('Entity').to_pandas(),
+                       'Volume': sums.column('Volume_sum').to_numpy()})
+    return df.sort_values('Volume', ascending=False)
+
+
+def process_data(data, grammar=DEFAULT_GRAMMAR, backend='pandas'):
     """
     Process pipe-delimited entity data with optional volume counts.
 
-    Parses input text to extract entity names and their volumes, aggregates
-    duplicate entities, and returns a sorted DataFrame.
+    Parses input text to extract entity names and their volumes, aggregates
+    duplicate entities, and returns a sorted DataFrame.
+
+    Args:
+        data (str): Input text with entities separated by pipes (|) or newlines.
+                   Optional volume can be specified as the last number on a line.
+                   Format: "Entity A|Entity B|Entity C 5" where 5 is the volume
+                   for all entities on that line.
+        grammar (Grammar): Alternative separators and volume placement. The
+                          default is the format described above. With
+                          numbers='decimal', volumes such as 2.5 are recognised
+                          and integer sums beyond int64 are kept exact.
+        backend (str): 'pandas', or 'arrow' to aggregate and sort with
+                      pyarrow compute kernels. Both give identical results;
+                      decimal mode and volumes beyond int64 always use pandas.
+
+    Returns:
+        pd.DataFrame: DataFrame with columns ['Entity', 'Volume'], sorted by
+                     volume in descending order. Duplicate entities are aggregated
+                     with their volumes summed. In decimal mode the Volume
+                     column is int64, float64 if any volume is fractional, or
+                     exact Python integers with df.attrs['volume_overflow'] set
+                     if the sums do not fit int64.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        ImportError: If the arrow backend is requested without pyarrow.
+
+    Examples:
+        >>> process_data("Entity A|Entity B 5")
+        # Returns DataFrame with Entity A and Entity B, both with volume 5
+
+        >>> process_data("Entity A\\nEntity A 3")
+        # Returns DataFrame with Entity A having volume 4 (1 + 3)
+
+        >>> process_data("5 Entity A,Entity B;2 Entity A", Grammar(';', ',', 'first'))
+        # Returns DataFrame with Entity A having volume 7 and Entity B volume 5
+
+        >>> process_data("Entity A 2.5\nEntity A 1", Grammar(numbers='decimal'))
+        # Returns DataFrame with Entity A having volume 3.5
+
+        >>> process_data(huge_export, backend='arrow')
+        # Same result, aggregated with Arrow instead of object-dtype pandas
+    """
+    if backend not in _BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}')
+    started = time.perf_counter()
+    parse_row = compile_parser(grammar)
+
+    # Split the data into rows
+    rows = data.split(grammar.row_separator)
+
+    if backend == 'arrow' and grammar.numbers == 'integer':
+        names, row_volumes, counts = _parse_columns(rows, parse_row)
+        df = _aggregate_arrow(names, row_volumes, counts)
+        if df is not None:
+            _record_run('process_data', started, len(df), len(rows), _text_bytes(data))
+            return df
+
+        # Arrow declined (no entities or volumes beyond int64): pair up for pandas
+        processed_data = list(zip(names, itertools.chain.from_iterable(
+            map(itertools.repeat, row_volumes, counts))))
+    else:
+        # Create a list to store the processed data
+        processed_data = []
+
+        # Process each row
+        for row in rows:
+            names, volume = parse_row(row)
+
+            # Add each entity and the row volume to the processed data
+            for name in names:
+                processed_data.append((name, volume))
+
+    # Decimal mode picks the column type so sums never wrap around
+    if grammar.numbers == 'decimal':
+        df = _group_volumes(processed_data)
+        _record_run('process_data', started, len(df), len(rows), _text_bytes(data))
+        return df
+
+    # Create a DataFrame from the processed data
+    df = pd.DataFrame(processed_data, columns=['Entity', 'Volume'])
+
+    # Group the DataFrame by entity and sum the volumes
+    df = df.groupby('Entity').sum().reset_index()
+
+    # Sort the DataFrame by volume in descending order
+    df = df.sort_values('Volume', ascending=False)
+
+    _record_run('process_data', started, len(df), len(rows), _text_bytes(data))
+    return df
+
+
+class BatchResult:
+    """
+    Aggregated volumes of many documents over a shared entity dictionary.
+
+    Every distinct entity name is stored once in entities; the per-document
+    totals are kept as parallel arrays (document_ids, entity_ids, volumes)
+    with one entry per document and entity, grouped by document. offsets[d]
+    to offsets[d + 1] delimit the entries of document d, and fractional[d]
+    tells whether document d had fractional volumes (decimal grammar only).
+
+    Built by process_batch; see there for an example.
+    """
+
+    def __init__(self, entities, document_ids, entity_ids, volumes, offsets, fractional):
+        self.entities = entities
+        self.document_ids = document_ids
+        self.entity_ids = entity_ids
+        self.volumes = volumes
+        self.offsets = offsets
+        self.fractional = fractional
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def ranking(self, document):
+        """
+        Return one document's ranking.
+
+        Args:
+            document (int): Position of the document in the batch.
+
+        Returns:
+            pd.DataFrame: The same DataFrame process_data returns for that
+                         document on its own.
+        """
+        start, end = self.offsets[document], self.offsets[document + 1]
+        names = [self.entities[entity] for entity in self.entity_ids[start:end].tolist()]
+        volumes = self.volumes[start:end].tolist()
+        # Whole-number documents keep an integer column even if others were fractional
+        if self.volumes.dtype == np.float64 and not self.fractional[document]:
+            volumes = [int(volume) for volume in volumes]
+        return _group_volumes(list(zip(names, volumes)))
+
+    def total(self):
+        """
+        Return the combined ranking of all documents.
+
+        Returns:
+            pd.DataFrame: The same DataFrame process_data returns for all
+                         documents joined into one input.
+        """
+        if self.volumes.dtype == object:
+            combined = [0] * len(self.entities)
+            for entity, volume in zip(self.entity_ids.tolist(), self.volumes.tolist()):
+                combined[entity] += volume
+        else:
+            # The dtype was chosen so that the grand total fits, so no sum overflows
+            sums = np.zeros(len(self.entities), dtype=self.volumes.dtype)
+            np.add.at(sums, self.entity_ids, self.volumes)
+            combined = sums.tolist()
+        return _group_volumes(list(zip(self.entities, combined)))
+
+    def to_frame(self):
+        """
+        Return all per-document rankings as one long DataFrame.
+
+        Ranks are computed with one vectorized sort for the whole batch rather
+        than one pandas sort per document. Ties are ranked by entity name.
+
+        Returns:
+            pd.DataFrame: Columns ['Document', 'Entity', 'Volume', 'Rank'],
+                         sorted by document and then by rank.
+        """
+        name_order = sorted(range(len(self.entities)), key=self.entities.__getitem__)
+        name_rank = np.empty(len(self.entities), dtype=np.int64)
+        name_rank[name_order] = np.arange(len(self.entities))
+
+        if self.volumes.dtype == object:
+            frame = pd.DataFrame({'Document': self.document_ids,
+                                  'Name': name_rank[self.entity_ids],
+                                  'Volume': self.volumes})
+            order = frame.sort_values(['Document', 'Volume', 'Name'],
+                                      ascending=[True, False, True], kind='stable').index
+            order = order.to_numpy()
+        else:
+            order = np.lexsort((name_rank[self.entity_ids], -self.volumes, self.document_ids))
+
+        document_ids = self.document_ids[order]
+        starts = np.asarray(self.offsets[:-1])[document_ids]
+        return pd.DataFrame({
+            'Document': document_ids,
+            'Entity': np.array(self.entities, dtype=object)[self.entity_ids[order]],
+            'Volume': self.volumes[order],
+            'Rank': np.arange(len(order)) - starts + 1,
+        })
+
+
+def process_batch(documents, grammar=DEFAULT_GRAMMAR):
+    """
+    Aggregate many documents in one pass with a shared entity dictionary.
+
+    Calling process_data once per document builds, groups and sorts a new
+    DataFrame each time and hashes the same entity names again for every
+    document. Here each name is encoded once into an integer id, every
+    document is aggregated into the shared compact arrays of a BatchResult,
+    and pandas is only used when a ranking is requested.
+
+    Args:
+        documents (iterable): Input texts in the process_data format.
+        grammar (Grammar): Separators and volume placement of every document.
+
+    Returns:
+        BatchResult: Per-document totals with ranking(document), total() and
+                     to_frame() accessors.
+
+    Examples:
+        >>> batch = process_batch(customer_exports)
+        >>> batch.ranking(0)     # same as process_data(customer_exports[0])
+        >>> batch.total()        # ranking over all exports
+        >>> batch.to_frame()     # (Document, Entity, Volume, Rank) rows
+    """
+    started = time.perf_counter()
+    parse_row = compile_parser(grammar)
+    separator = grammar.row_separator
+    ids = {}
+    entity_ids = []
+    volumes = []
+    offsets = [0]
+    fractional = []
+    lines = nbytes = 0
+
+    for data in documents:
+        totals = {}
+        get = totals.get
+        rows = data.split(separator)
+        lines += len(rows)
+        nbytes += _text_bytes(data)
+        for row in rows:
+            names, volume = parse_row(row)
+            for name in names:
+                entity = ids.setdefault(name, len(ids))
+                totals[entity] = get(entity, 0) + volume
+        entity_ids.extend(totals)
+        volumes.extend(totals.values())
+        offsets.append(len(entity_ids))
+        fractional.append(any(isinstance(volume, float) for volume in totals.values()))
+
+    document_ids = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+    dtype = _volume_dtype(volumes) or np.int64
+    if dtype is object:
+        volumes = [int(volume) for volume in volumes]
+    _record_run('process_batch', started, len(ids), lines, nbytes)
+    return BatchResult(list(ids), document_ids, np.array(entity_ids, dtype=np.int32),
+                       np.array(volumes, dtype=dtype), np.array(offsets, dtype=np.int64),
+                       np.array(fractional, dtype=bool))
+
+
+# MinHash estimates within this many standard errors below the threshold are
+# confirmed with the exact n-gram Jaccard similarity
+_MINHASH_MARGIN = 4
+
+
+@functools.lru_cache(maxsize=1 << 20)
+def _normalize_entity(name):
+    """
+    Reduce an entity name to the key used for near-duplicate comparison.
+
+    Case is folded and runs of whitespace collapse to a single space.
+    Punctuation is kept, since it often distinguishes entities ('C', 'C#',
+    'C++'); names differing only in punctuation are compared by n-gram
+    similarity instead. The result is memoized per distinct name, so repeated
+    calls over large result sets only pay for each spelling once.
+
+    Args:
+        name (str): Entity name as returned by process_data.
+
+    Returns:
+        str: Normalized comparison key.
+    """
+    return ' '.join(name.casefold().split())
+
+
+def _mix64(hashes):
+    """Apply the MurmurHash3 finalizer to a uint64 array in place and return it."""
+    for shift, multiplier in ((33, 0xff51afd7ed558ccd), (33, 0xc4ceb9fe1a85ec53), (33, None)):
+        hashes ^= hashes >> np.uint64(shift)
+        if multiplier:
+            hashes *= np.uint64(multiplier)
+    return hashes
+
+
+def _shingle_hashes(keys, ngram):
+    """
+    Hash the character n-grams of normalized keys, for all keys at once.
+
+    Keys are padded with a space on both sides, and with NUL characters up to
+    the n-gram length, and their code points are laid out in one array. Each
+    n-gram is then hashed by ngram NumPy operations over all start positions.
+
+    Args:
+        keys (list): Normalized comparison keys.
+        ngram (int): Character n-gram length.
+
+    Returns:
+        tuple: (hashes, counts) where hashes holds the 64-bit hash of every
+               n-gram, key by key, and counts the number of n-grams of each key.
+    """
+    padded = [f' {key} '.ljust(ngram, '\0') for key in keys]
+    codes = _code_points(''.join(padded))
+    lengths = np.fromiter(map(len, padded), dtype=np.int64, count=len(padded))
+    counts = lengths - ngram + 1
+    positions = _ranges(np.cumsum(lengths) - lengths, counts)
+    return _ngram_hashes(codes, positions, ngram), counts
+
+
+def _code_points(text):
+    """Return the code points of a string as a uint32 array."""
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+
+def _ngram_hashes(codes, positions, ngram):
+    """Return 64-bit FNV-1a hashes of the n-grams of codes starting at positions."""
+    hashes = np.full(len(positions), 0xcbf29ce484222325, dtype=np.uint64)
+    prime = np.uint64(0x100000001b3)
+    for offset in range(ngram):
+        hashes ^= codes[positions + offset]
+        hashes *= prime
+    return _mix64(hashes)
+
+
+def _minhash_signatures(hashes, gram_ids, counts, num_perm, seed=0):
+    """
+    Compute MinHash signatures from the n-gram ids of each key.
+
+    Each permutation is a multiply-shift hash of the 64-bit n-gram hash, which
+    needs no modulus, evaluated once per distinct n-gram. As in _key_hashes
+    the loop runs over n-gram positions rather than keys: keys are ordered by
+    n-gram count, so step j folds the j-th n-gram of every key that has one
+    into the running minimum in one NumPy operation.
+
+    Args:
+        hashes (np.ndarray): 64-bit hash of each distinct n-gram.
+        gram_ids (np.ndarray): Index into hashes of every n-gram, key by key.
+        counts (np.ndarray): Number of n-grams of each key, at least one.
+        num_perm (int): Number of permutations.
+
+    Returns:
+        np.ndarray: uint32 array of shape (len(counts), num_perm).
+    """
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    permuted = ((hashes[:, None] * a + b) >> np.uint64(32)).astype(np.uint32)
+
+    order = np.argsort(-counts, kind='stable')
+    sorted_starts, sorted_counts = (np.cumsum(counts) - counts)[order], counts[order]
+    signatures = permuted[gram_ids[sorted_starts]]
+    # Number of keys with more n-grams than each position
+    active = len(counts) - np.searchsorted(sorted_counts[::-1], np.arange(sorted_counts[0]), side='right')
+    for position in range(1, int(sorted_counts[0])):
+        count = int(active[position])
+        head = signatures[:count]
+        np.minimum(head, permuted[gram_ids[sorted_starts[:count] + position]], out=head)
+
+    result = np.empty_like(signatures)
+    result[order] = signatures
+    return result
+
+
+def _sorted_unique(values):
+    """Return the sorted distinct values of an integer array."""
+    values = np.sort(values)
+    return values[np.r_[True, values[1:] != values[:-1]]] if len(values) else values
+
+
+def _bucket_pairs(band_keys, max_bucket_size):
+    """
+    Return the pairs of rows sharing a band key, encoded as i * len(band_keys) + j with i < j.
+
+    Buckets are found by sorting, and the pairs of all buckets of one size
+    are generated together from the upper triangle of a size x size grid.
+    """
+    order = np.argsort(band_keys, kind='stable')
+    sorted_keys = band_keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    pairs = [np.zeros(0, dtype=np.int64)]
+    for size in np.unique(sizes[(sizes > 1) & (sizes <= max_bucket_size)]):
+        left, right = np.triu_indices(size, 1)
+        members = order[starts[sizes == size, None] + np.arange(size)]
+        i, j = members[:, left].ravel(), members[:, right].ravel()
+        pairs.append(np.minimum(i, j) * len(band_keys) + np.maximum(i, j))
+    return np.concatenate(pairs)
+
+
+def _common_shingles(entries, starts, sizes, stride, left, right):
+    """
+    Count the n-grams shared by each pair of keys.
+
+    Args:
+        entries (np.ndarray): Sorted unique key * stride + n-gram id values.
+        starts (np.ndarray): Position of each key's first entry.
+        sizes (np.ndarray): Number of distinct n-grams of each key.
+        stride (int): Number of distinct n-grams overall.
+        left (np.ndarray): First key of each pair.
+        right (np.ndarray): Second key of each pair.
+
+    Returns:
+        np.ndarray: Number of shared n-grams per pair.
+    """
+    pair = np.repeat(np.arange(len(left)), sizes[left])
+    probes = right[pair] * stride + entries[_ranges(starts[left], sizes[left])] % stride
+    found = np.searchsorted(entries, probes)
+    hit = entries[np.minimum(found, len(entries) - 1)] == probes
+    return np.bincount(pair[hit], minlength=len(left))
+
+
+def find_near_duplicates(df, threshold=0.8, ngram=3, num_perm=64, bands=16,
+                         max_bucket_size=50):
+    """
+    Propose merges for entity names that are near-duplicates of each other.
+
+    Names that normalize to the same key (case and spacing variants) are
+    always grouped. Remaining keys, including names that differ only in
+    punctuation, are compared using MinHash signatures over character n-grams
+    with locality-sensitive hashing, so only names sharing an LSH bucket are
+    ever compared and the cost stays close to linear in the number of
+    distinct entities. Candidate pairs are confirmed with the Jaccard
+    similarity of their hashed n-gram sets. Signatures, buckets and the
+    Jaccard check are computed with NumPy over all names at once. Empty
+    names are never merged.
+
+    Args:
+        df (pd.DataFrame): Result of process_data with columns ['Entity', 'Volume'].
+        threshold (float): Minimum n-gram Jaccard similarity for two names to
+                           be considered the same entity.
+        ngram (int): Character n-gram length used for shingling.
+        num_perm (int): Number of MinHash permutations; must be divisible by bands.
+        bands (int): Number of LSH bands the signature is split into.
+        max_bucket_size (int): LSH buckets larger than this are skipped, since
+                               they only arise from degenerate very short names.
+
+    Returns:
+        pd.DataFrame: One row per entity that would be merged, with columns
+                     ['Entity', 'Canonical', 'Volume']. The canonical name of
+                     each group is its highest-volume member.
+
+    Raises:
+        ValueError: If num_perm is not divisible by bands.
+    """
+    if num_perm % bands:
+        raise ValueError('num_perm must be divisible by bands')
+
+    columns = ['Entity', 'Canonical', 'Volume']
+    names = df['Entity']
+    normalized = names.map(_normalize_entity)
+    names, volumes = names[normalized != ''], df['Volume'][normalized != '']
+    if names.empty:
+        return pd.DataFrame(columns=columns)
+
+    # Names sharing a normalized key are merged unconditionally
+    codes, keys = pd.factorize(normalized[normalized != ''])
+    hashes, counts = _shingle_hashes(keys, ngram)
+    hashes, gram_ids = np.unique(hashes, return_inverse=True)
+    gram_ids = gram_ids.reshape(-1)
+    signatures = _minhash_signatures(hashes, gram_ids, counts, num_perm)
+    rows = num_perm // bands
+
+    # Collapse each band to a single 64-bit key (wrapping arithmetic is fine,
+    # collisions are filtered by the Jaccard check) and pair the keys of each bucket
+    mixers = np.random.RandomState(1).randint(1, 1 << 62, size=rows).astype(np.uint64)
+    pairs = _sorted_unique(np.concatenate([
+        _bucket_pairs((signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) * mixers).sum(axis=1),
+                      max_bucket_size)
+        for band in range(bands)
+    ]))
+
+    # Distinct n-grams of every key as sorted key * stride + n-gram id values
+    stride = len(hashes)
+    entries = _sorted_unique(np.repeat(np.arange(len(keys)), counts) * stride + gram_ids)
+    sizes = np.bincount(entries // stride, minlength=len(keys))
+    starts = np.cumsum(sizes) - sizes
+
+    # Only pairs whose MinHash estimate is close to the threshold get the exact check
+    margin = _MINHASH_MARGIN * np.sqrt(threshold * (1 - threshold) / num_perm)
+    matched = []
+    for chunk in range(0, len(pairs), 1 << 17):
+        left, right = np.divmod(pairs[chunk:chunk + (1 << 17)], len(keys))
+        agree = (signatures[left] == signatures[right]).sum(axis=1)
+        close = agree >= (threshold - margin) * num_perm
+        left, right = left[close], right[close]
+        common = _common_shingles(entries, starts, sizes, stride, left, right)
+        similar = common >= threshold * (sizes[left] + sizes[right] - common)
+        matched.extend(zip(left[similar].tolist(), right[similar].tolist()))
+
+    # Union-find over the confirmed pairs
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in matched:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[root_j] = root_i
+    groups = np.arange(len(keys))
+    for i in {i for pair in matched for i in pair}:
+        groups[i] = find(i)
+
+    frame = pd.DataFrame({'Entity': names.to_numpy(), 'Volume': volumes.to_numpy(),
+                          'Group': groups[codes]})
+    frame = frame[frame.duplicated('Group', keep=False)]
+    frame = frame.sort_values(['Group', 'Volume', 'Entity'], ascending=[True, False, True],
+                              kind='stable')
+    frame['Canonical'] = frame.groupby('Group')['Entity'].transform('first')
+    frame = frame[frame['Entity'] != frame['Canonical']]
+    return frame[columns].reset_index(drop=True)
+
+
+def canonicalize_entities(df, merges=None, **kwargs):
+    """
+    Merge near-duplicate entities in a process_data result.
+
+    Args:
+        df (pd.DataFrame): Result of process_data with columns ['Entity', 'Volume'].
+        merges (pd.DataFrame, optional): Merge proposals as returned by
+                                         find_near_duplicates. Computed from df
+                                         when not given.
+        **kwargs: Passed to find_near_duplicates when merges is not given.
+
+    Returns:
+        pd.DataFrame: DataFrame with columns ['Entity', 'Volume'] in the same
+                     format as process_data, with merged volumes summed under
+                     the canonical name.
+
+    Examples:
+        >>> canonicalize_entities(process_data("Entity A 3\\nentity  a"))
+        # Returns DataFrame with Entity A having volume 4
+    """
+    if merges is None:
+        merges = find_near_duplicates(df, **kwargs)
+    if merges.empty:
+        return df
+
+    mapping = dict(zip(merges['Entity'], merges['Canonical']))
+    df = df.assign(Entity=df['Entity'].map(lambda name: mapping.get(name, name)))
+    df = df.groupby('Entity').sum().reset_index()
+    return df.sort_values('Volume', ascending=False)
+
+
+# Code point between names in the search index; above the Unicode range, so no query contains it
+_NAME_BOUNDARY = 0x110000
+
+
+def _postings(keys, occurrences):
+    """
+    Group occurrences by key.
+
+    Returns:
+        tuple: (unique_keys, bounds, occurrences) where the occurrences of
+               unique_keys[i] are occurrences[bounds[i]:bounds[i + 1]], in
+               their original order.
+    """
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    first = np.ones(len(keys), dtype=bool)
+    np.not_equal(keys[1:], keys[:-1], out=first[1:])
+    return keys[first], np.r_[np.flatnonzero(first), len(keys)], occurrences[order]
+
+
+class EntitySearchIndex:
+    """
+    Case-insensitive search index over the entities of a processed result.
+
+    The casefolded names are laid out as one code point array, separated by
+    a value no query can contain, and the positions of every character and
+    every character n-gram are listed by value. A substring query anchors on
+    its rarest n-gram (its rarest character when shorter than an n-gram) and
+    checks the rest of the query at each occurrence with NumPy comparisons,
+    so lookups stay fast for results with hundreds of thousands of entities.
+    Prefix queries use binary search over the sorted names. The index is
+    built on the first query, so results that are never searched do not pay
+    for it.
+
+    Args:
+        df (pd.DataFrame): Result of process_data with columns ['Entity', 'Volume'].
+        ngram (int): Character n-gram length used for substring matching.
+
+    Examples:
+        >>> index = EntitySearchIndex(process_data("Entity A|Entity B 5"))
+        >>> index.filter("tity a")
+        # Returns the rows of the result whose Entity contains "tity a"
+    """
+
+    def __init__(self, df, ngram=3):
+        self.df = df
+        self.ngram = ngram
+        self._codes = None
+
+    def _gram_keys(self, codes, positions):
+        """Return the keys of the n-grams starting at positions; exact when they fit 63 bits."""
+        if self.ngram * 21 > 63:
+            return _ngram_hashes(codes, positions, self.ngram)
+        keys = np.zeros(len(positions), dtype=np.int64)
+        for offset in range(self.ngram):
+            keys <<= 21
+            keys |= codes[positions + offset]
+        return keys
+
+    def _build(self):
+        """Lay out the casefolded names and list character and n-gram positions."""
+        names = [name.casefold() for name in self.df['Entity']]
+        order = sorted(range(len(names)), key=names.__getitem__)
+        self._sorted_names = [names[i] for i in order]
+        self._sorted_positions = np.array(order, dtype=np.int64)
+
+        # Each name is followed by a boundary, so matches cannot span names
+        codes = _code_points('\0'.join(names) + '\0').copy()
+        lengths = np.fromiter(map(len, names), dtype=np.int64, count=len(names))
+        starts = np.cumsum(lengths + 1) - lengths - 1
+        codes[starts + lengths] = _NAME_BOUNDARY
+        codes[-1] = _NAME_BOUNDARY
+        dtype = np.int32 if len(codes) < 1 << 31 else np.int64
+        self._owners = np.repeat(np.arange(len(names), dtype=dtype), lengths + 1)
+
+        characters = _ranges(starts, lengths).astype(dtype)
+        self._characters = _postings(codes[characters], characters)
+        grams = _ranges(starts, np.maximum(lengths - self.ngram + 1, 0)).astype(dtype)
+        self._grams = _postings(self._gram_keys(codes, grams), grams)
+        self._codes = codes
+
+    def prefix_positions(self, prefix):
+        """
+        Return row positions of entities starting with prefix.
+
+        Args:
+            prefix (str): Case-insensitive prefix.
+
+        Returns:
+            np.ndarray: Sorted positional indices into the indexed DataFrame.
+        """
+        if self._codes is None:
+            self._build()
+        prefix = prefix.casefold()
+        lo = bisect.bisect_left(self._sorted_names, prefix)
+        hi = bisect.bisect_left(self._sorted_names, prefix + '\U0010ffff', lo)
+        return np.sort(self._sorted_positions[lo:hi])
+
+    def substring_positions(self, query):
+        """
+        Return row positions of entities containing query.
+
+        Args:
+            query (str): Case-insensitive substring.
+
+        Returns:
+            np.ndarray: Sorted positional indices into the indexed DataFrame.
+        """
+        if self._codes is None:
+            self._build()
+        codes = _code_points(query.casefold())
+        if not len(codes):
+            return np.arange(len(self.df), dtype=np.int64)
+
+        # Anchor on the query character or n-gram with the fewest occurrences
+        width = self.ngram if len(codes) >= self.ngram else 1
+        if width == 1:
+            (keys, bounds, occurrences), query_keys = self._characters, codes
+        else:
+            (keys, bounds, occurrences) = self._grams
+            query_keys = self._gram_keys(codes, np.arange(len(codes) - width + 1))
+        slots = np.minimum(np.searchsorted(keys, query_keys), max(len(keys) - 1, 0))
+        if not len(keys) or (keys[slots] != query_keys).any():
+            return np.array([], dtype=np.int64)
+        offset = int(np.argmin(bounds[slots + 1] - bounds[slots]))
+        slot = slots[offset]
+        starts = occurrences[bounds[slot]:bounds[slot + 1]]
+        if offset:
+            starts = starts[starts >= offset] - offset
+
+        # Confirm the characters outside the anchor; hashed n-grams are only candidates.
+        # Each check stops at a name boundary, so later checks stay inside the array.
+        exact = width == 1 or self.ngram * 21 <= 63
+        for position, code in enumerate(codes):
+            if exact and offset <= position < offset + width:
+                continue
+            starts = starts[self._codes[starts + position] == code]
+
+        # Anchor occurrences are in text order, so each name's matches are adjacent
+        positions = self._owners[starts]
+        first = np.ones(len(positions), dtype=bool)
+        np.not_equal(positions[1:], positions[:-1], out=first[1:])
+        return positions[first].astype(np.int64)
+
+    def filter(self, query, prefix=False):
+        """
+        Return the rows of the indexed result matching query.
+
+        Args:
+            query (str): Case-insensitive search text. Blank queries match all rows.
+            prefix (bool): Match only at the start of the entity name.
+
+        Returns:
+            pd.DataFrame: Matching rows in the original ranking order.
+        """
+        query = query.strip()
+        if not query:
+            return self.df
+        if prefix:
+            positions = self.prefix_positions(query)
+        else:
+            positions = self.substring_positions(query)
+        return self.df.iloc[positions]
+
+
+class ProvenanceIndex:
+    """
+    Compact index of the input lines each entity came from.
+
+    While rows are aggregated, every (entity, line number) occurrence is
+    appended to two typed arrays. On the first lookup the occurrences are
+    grouped by entity and each entity's line numbers are stored as
+    delta-encoded varints in one shared byte array, so the index typically
+    needs one or two bytes per occurrence instead of a Python list of ints.
+    The raw arrays are released at that point, so no more rows can be added.
+
+    Examples:
+        >>> provenance = ProvenanceIndex()
+        >>> totals = provenance.aggregate(data.split('\\n'), 0, {})
+        >>> provenance.lines('Entity A')
+        # Returns the 0-based numbers of the lines that mention Entity A
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._entity_ids = array.array('I')
+        self._line_numbers = array.array('I')
+        self._data = None
+        self._offsets = None
+        self._counts = None
+
+    def aggregate(self, rows, first_line, totals, parse_row=_parse_row):
+        """
+        Aggregate rows like _aggregate_rows while recording their line numbers.
+
+        Args:
+            rows (iterable): Input rows without trailing newlines.
+            first_line (int): Line number of the first row.
+            totals (dict): Mapping of entity name to summed volume, updated in place.
+            parse_row (callable): Row parser, as returned by compile_parser.
+
+        Returns:
+            dict: The updated totals.
+
+        Raises:
+            ValueError: If the index has already been queried.
+        """
+        if self._data is not None:
+            raise ValueError('Rows cannot be added to a provenance index after a lookup')
+        get = totals.get
+        ids = self._ids
+        entity_ids = self._entity_ids
+        line_numbers = self._line_numbers
+        for line_number, row in enumerate(rows, start=first_line):
+            names, volume = parse_row(row)
+            for name in names:
+                totals[name] = get(name, 0) + volume
+                entity_ids.append(ids.setdefault(name, len(ids)))
+                line_numbers.append(line_number)
+        return totals
+
+    def _build(self):
+        """Group occurrences by entity and varint-encode the line number deltas."""
+        ids = np.frombuffer(self._entity_ids, dtype=np.uint32).copy()
+        lines = np.frombuffer(self._line_numbers, dtype=np.uint32).astype(np.int64)
+
+        # Sort by entity, keeping line order, and drop repeats within a line
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        lines = lines[order]
+        keep = np.ones(len(ids), dtype=bool)
+        keep[1:] = (ids[1:] != ids[:-1]) | (lines[1:] != lines[:-1])
+        ids = ids[keep]
+        lines = lines[keep]
+
+        counts = np.bincount(ids, minlength=len(self._ids))
+        first = np.cumsum(counts) - counts
+        deltas = np.diff(lines, prepend=0)
+        starts = first[counts > 0]
+        deltas[starts] = lines[starts]
+
+        # Unsigned LEB128: 7 bits per byte, high bit set on all but the last byte
+        sizes = np.ones(len(deltas), dtype=np.int64)
+        for shift in (7, 14, 21, 28):
+            sizes += deltas >= (1 << shift)
+        ends = np.cumsum(sizes)
+        byte_starts = ends - sizes
+        data = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+        for k in range(5):
+            mask = sizes > k
+            chunk = (deltas[mask] >> (7 * k)) & 0x7F
+            more = (sizes[mask] > k + 1).astype(np.int64) << 7
+            data[byte_starts[mask] + k] = chunk | more
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(ids, weights=sizes, minlength=len(counts)))
+        self._data = data
+        self._offsets = offsets
+        self._counts = counts
+        self._entity_ids = None
+        self._line_numbers = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def count(self, name):
+        """Return the number of distinct lines that mention an entity."""
+        if name not in self._ids:
+            return 0
+        if self._data is None:
+            self._build()
+        return int(self._counts[self._ids[name]])
+
+    def lines(self, name, limit=None):
+        """
+        Return the line numbers an entity came from.
+
+        Args:
+            name (str): Exact entity name as shown in the result.
+            limit (int, optional): Return at most this many line numbers.
+
+        Returns:
+            np.ndarray: Ascending 0-based line numbers (empty if unknown).
+        """
+        if name not in self._ids:
+            return np.array([], dtype=np.int64)
+        if self._data is None:
+            self._build()
+        entity = self._ids[name]
+        data = self._data[self._offsets[entity]:self._offsets[entity + 1]]
+
+        # Vectorized varint decoding: each value ends at a byte below 0x80
+        value_ends = np.flatnonzero(data < 0x80)
+        value_starts = np.concatenate(([0], value_ends[:-1] + 1))
+        if limit is not None:
+            value_ends = value_ends[:limit]
+            value_starts = value_starts[:limit]
+            data = data[:value_ends[-1] + 1] if len(value_ends) else data[:0]
+        if not len(value_ends):
+            return np.array([], dtype=np.int64)
+        byte_index = np.arange(len(data)) - np.repeat(value_starts, value_ends - value_starts + 1)
+        values = (data & 0x7F).astype(np.int64) << (7 * byte_index)
+        return np.cumsum(np.add.reduceat(values, value_starts))
+
+    @property
+    def nbytes(self):
+        """Memory held by the encoded line numbers (building the index first)."""
+        if self._data is None:
+            self._build()
+        return self._data.nbytes + self._offsets.nbytes + self._counts.nbytes
+
+
+def _source_lines(data, separator, line_numbers):
+    """Return the text of the given 0-based lines without splitting the whole input."""
+    if not len(line_numbers):
+        return []
+    rows = data.split(separator, int(line_numbers[-1]) + 1)
+    return [rows[line] for line in line_numbers]
+
+
+# Compression formats recognised from the first bytes of an input file
+_COMPRESSION_MAGIC = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\xfd7zXZ\x00': 'xz',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+}
+
+# File name suffixes of compressed inputs, ignored when inferring the format
+_COMPRESSION_SUFFIXES = {'.gz', '.bz2', '.xz', '.zst'}
+
+
+def detect_compression(f):
+    """
+    Detect the compression of a binary file object from its magic bytes.
+
+    The file position is left unchanged, so the caller can go on reading it.
+
+    Args:
+        f: Binary file object that is seekable or supports peek().
+
+    Returns:
+        str or None: 'gzip', 'bz2', 'xz' or 'zstd', or None for plain input.
+    """
+    if hasattr(f, 'peek'):
+        head = f.peek(6)[:6]
+    else:
+        position = f.tell()
+        head = f.read(6)
+        f.seek(position)
+    for magic, compression in _COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_decompressed(f):
+    """
+    Wrap a binary file object so compressed input is decompressed on the fly.
+
+    Decompression is streamed: only the decompressor's buffers are held in
+    memory, never the whole decompressed input. Closing the returned object
+    leaves f open.
+
+    Args:
+        f: Binary file object that is seekable or supports peek().
+
+    Returns:
+        A binary file object yielding the decompressed bytes, or f itself if
+        the input is not compressed.
+
+    Raises:
+        ImportError: If the input is zstd-compressed and zstandard is not
+                     installed.
+
+    Examples:
+        >>> with open('export.txt.gz', 'rb') as raw:
+        ...     totals = _aggregate_rows(_iter_block_rows(ReadAhead(open_decompressed(raw))), {})
+    """
+    compression = detect_compression(f)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(f)
+    if compression == 'xz':
+        return lzma.LZMAFile(f)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError('Reading zstd-compressed files requires zstandard') from e
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True,
+                                                            closefd=False)
+        return io.BufferedReader(reader)
+    return f
+
+
+# Version of the checkpoint file layout written by process_files
+_CHECKPOINT_VERSION = 3
+
+
+def _save_checkpoint(checkpoint_path, state):
+    """
+    Atomically write a batch checkpoint.
+
+    The state is written to a temporary file next to the checkpoint and moved
+    into place, so a crash while saving leaves the previous checkpoint intact.
+    """
+    tmp_path = f'{checkpoint_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _load_checkpoint(checkpoint_path, paths, grammar):
+    """
+    Load a batch checkpoint written for the same list of input files.
+
+    Returns:
+        dict or None: The checkpoint state, or None if no checkpoint exists.
+
+    Raises:
+        ValueError: If the checkpoint has an unknown version, was written for
+                    different input files or grammar, or an input file has
+                    shrunk below the recorded offset.
+    """
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return None
+
+    with open(checkpoint_path, encoding='utf-8') as f:
+        state = json.load(f)
+
+    if state.get('version') != _CHECKPOINT_VERSION:
+        raise ValueError(f'Unsupported checkpoint version: {state.get("version")}')
+    if state['paths'] != [os.path.abspath(path) for path in paths]:
+        raise ValueError('Checkpoint was written for a different list of input files')
+    # Compare as stored, since JSON turns the filter rule tuples into lists
+    if state['grammar'] != json.loads(json.dumps(list(grammar))):
+        raise ValueError('Checkpoint was written with a different grammar')
+
+    # Offsets count decompressed bytes, so only plain files can be size checked
+    current = state['file_index']
+    if current < len(paths):
+        with open(paths[current], 'rb') as f:
+            compressed = detect_compression(f) is not None
+        if not compressed and os.path.getsize(paths[current]) < state['offset']:
+            raise ValueError(f'Input file {paths[current]} is smaller than the checkpoint offset')
+
+    return state
+
+
+# Default size of the blocks read ahead from input files and how many of
+# them may wait to be parsed
+_READ_BLOCK_SIZE = 4 << 20
+_READ_QUEUE_DEPTH = 4
+
+# Queue items marking the end of a read-ahead stream
+_END_OF_INPUT = object()
+
+
+class ReadAhead:
+    """
+    Read a binary stream in a background thread, in blocks ending at newlines.
+
+    The reader thread fills a bounded queue with blocks of about block_size
+    bytes, each cut after its last newline (the remainder starts the next
+    block), while the consuming thread parses the previous ones. File reads
+    and decompression release the GIL, so on slow or network-attached
+    storage the disk and the CPU are busy at the same time. When the queue is
+    full the reader waits, so at most queue_depth + 2 blocks are in memory.
+    A line longer than a block is returned whole in a larger block.
+
+    Newline bytes never occur inside multi-byte UTF-8 characters, so every
+    block decodes on its own.
+
+    Args:
+        f: Binary file object.
+        block_size (int): Number of bytes read at a time.
+        queue_depth (int): Blocks that may wait to be parsed; 0 reads in the
+                           consuming thread instead, without overlap.
+
+    Attributes:
+        read_seconds (float): Time spent in f.read().
+        wait_seconds (float): Time the consumer waited for blocks.
+
+    Raises:
+        ValueError: If block_size is not positive or queue_depth is negative.
+
+    Examples:
+        >>> with open('export.txt', 'rb') as f, ReadAhead(f) as blocks:
+        ...     for block in blocks:
+        ...         _aggregate_rows(_iter_block_rows([block]), totals)
+        >>> blocks.overlap    # share of the read time hidden behind parsing
+    """
+
+    def __init__(self, f, block_size=_READ_BLOCK_SIZE, queue_depth=_READ_QUEUE_DEPTH):
+        if block_size <= 0:
+            raise ValueError('Block size must be positive')
+        if queue_depth < 0:
+            raise ValueError('Queue depth must not be negative')
+        self._f = f
+        self.block_size = block_size
+        self.queue_depth = queue_depth
+        self.read_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        if queue_depth:
+            self._queue = queue.Queue(maxsize=queue_depth)
+            self._thread = threading.Thread(target=self._fill, daemon=True)
+            self._thread.start()
+
+    @property
+    def overlap(self):
+        """Share of the read time during which the consumer did not wait, from 0 to 1."""
+        return _overlap(self.read_seconds, self.wait_seconds)
+
+    def _blocks(self):
+        """Yield newline-terminated blocks read from the stream, timing the reads."""
+        carry = b''
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            data = self._f.read(self.block_size)
+            self.read_seconds += time.perf_counter() - started
+            if not data:
+                break
+            data = carry + data if carry else data
+            cut = data.rfind(b'\n') + 1
+            if cut:
+                carry = data[cut:]
+                yield data[:cut] if cut < len(data) else data
+            else:
+                carry = data
+        if carry:
+            yield carry
+
+    def _put(self, item):
+        """Queue an item, giving up if the consumer has stopped."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _fill(self):
+        """Reader thread: queue blocks, then an error if reading failed, then the end."""
+        try:
+            for block in self._blocks():
+                self._put(block)
+        except BaseException as e:
+            self._put(e)
+        self._put(_END_OF_INPUT)
+
+    def __iter__(self):
+        if self._thread is None:
+            for block in self._blocks():
+                # Reading in the consuming thread makes it wait for every block
+                self.wait_seconds = self.read_seconds
+                yield block
+            self.wait_seconds = self.read_seconds
+            return
+        while True:
+            started = time.perf_counter()
+            item = self._queue.get()
+            self.wait_seconds += time.perf_counter() - started
+            if item is _END_OF_INPUT:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def close(self):
+        """Stop the reader thread and drop the blocks it has queued."""
+        self._stop.set()
+        if self._thread is not None:
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _iter_block_rows(blocks):
+    """Yield the decoded rows of newline-terminated blocks, split on newlines only like process_data."""
+    for block in blocks:
+        rows = block.decode('utf-8').split('\n')
+        if block.endswith(b'\n'):
+            rows.pop()
+        yield from rows
+
+
+def process_files(paths, checkpoint_path=None, checkpoint_every=100000,
+                  grammar=DEFAULT_GRAMMAR, cache=None, block_size=_READ_BLOCK_SIZE,
+                  queue_depth=_READ_QUEUE_DEPTH):
+    """
+    Process one or more input files with periodic checkpointing.
+
+    Each file is parsed line by line using the same rules as process_data,
+    while a background thread reads the next blocks ahead (see ReadAhead).
+    The read time, the time parsing waited for input and the share of the
+    read time overlapped with parsing are recorded in METRICS. When
+    a checkpoint path is given, the partial per-entity totals and the byte
+    offset reached in the current file are saved every checkpoint_every lines.
+    Files compressed with gzip, bz2, xz or zstd are decompressed as they are
+    read; their offsets count decompressed bytes.
+    If the checkpoint exists when the function is called, processing resumes
+    from it and the final result is identical to an uninterrupted run. The
+    checkpoint is removed once all files have been processed.
+
+    Args:
+        paths (list): Paths of the input files, processed in order. Each file
+                     is treated as a separate document, so its last line never
+                     runs into the next file.
+        checkpoint_path (str, optional): Where to persist progress.
+        checkpoint_every (int): Number of lines between checkpoints.
+        grammar (Grammar): Entity separator and volume placement; rows are
+                          always lines.
+        cache (ResultCache, optional): Result cache consulted before any
+                                       parsing and updated afterwards.
+        block_size (int): Bytes read at a time.
+        queue_depth (int): Blocks read ahead of the parser; 0 reads and
+                           parses in turn.
+
+    Returns:
+        pd.DataFrame: DataFrame with columns ['Entity', 'Volume'] in the same
+                     format as process_data.
+
+    Raises:
+        ValueError: If an existing checkpoint does not match the inputs, the
+                    grammar does not use newline as row separator, or the
+                    block size or queue depth is invalid.
+
+    Examples:
+        >>> process_files(['export_1.txt', 'export_2.txt'], 'job.ckpt')
+        # Returns the combined ranking; rerun after a crash to resume
+    """
+    started = time.perf_counter()
+    paths = list(paths)
+    parse_row = _line_parser(grammar)
+    if cache is not None:
+        key = cache.key([digest_source(path) for path in paths], ('files', grammar))
+        df = cache.get(key)
+        if df is not None:
+            return df
+
+    state = _load_checkpoint(checkpoint_path, paths, grammar)
+    if state is None:
+        state = {
+            'version': _CHECKPOINT_VERSION,
+            'paths': [os.path.abspath(path) for path in paths],
+            'grammar': list(grammar),
+            'file_index': 0,
+            'offset': 0,
+            'totals': {},
+        }
+    totals = state['totals']
+    lines = nbytes = 0
+    read_seconds = wait_seconds = 0.0
+
+    while state['file_index'] < len(paths):
+        with open(paths[state['file_index']], 'rb') as raw, open_decompressed(raw) as f:
+            offset = start_offset = state['offset']
+            if f is raw:
+                f.seek(offset)
+            else:
+                # Compressed streams can only be skipped forward by decompressing
+                remaining = offset
+                while remaining:
+                    skipped = len(f.read(min(remaining, 1 << 20)))
+                    if not skipped:
+                        break
+                    remaining -= skipped
+            pending = 0
+
+            with ReadAhead(f, block_size, queue_depth) as blocks:
+                for block in blocks:
+                    rows = block.decode('utf-8').split('\n')
+                    if block.endswith(b'\n'):
+                        rows.pop()
+                    newlines = None
+                    position = 0
+                    while position < len(rows):
+                        # Parse up to the next checkpoint, or the whole block
+                        count = len(rows) - position
+                        if checkpoint_path:
+                            count = min(count, checkpoint_every - pending)
+                        _aggregate_rows(rows[position:position + count], totals, parse_row)
+                        position += count
+                        pending += count
+                        lines += count
+                        if checkpoint_path and pending >= checkpoint_every:
+                            # The checkpoint offset is the byte after the last parsed row
+                            if newlines is None:
+                                newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+                            end = newlines[position - 1] + 1 if position <= len(newlines) else len(block)
+                            state['offset'] = offset + int(end)
+                            _save_checkpoint(checkpoint_path, state)
+                            pending = 0
+                    offset += len(block)
+                read_seconds += blocks.read_seconds
+                wait_seconds += blocks.wait_seconds
+            nbytes += offset - start_offset
+
+        state['file_index'] += 1
+        state['offset'] = 0
+        if checkpoint_path:
+            _save_checkpoint(checkpoint_path, state)
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    df = _totals_to_frame(totals)
+    _record_run('process_files', started, len(df), lines, nbytes)
+    _record_reads('process_files', read_seconds, wait_seconds)
+    if cache is not None:
+        cache.put(key, df)
+    return df
+
+
+# File formats recognised by process_file, keyed by file extension
+_FILE_FORMATS = {
+    '.txt': 'text',
+    '.jsonl': 'ndjson',
+    '.ndjson': 'ndjson',
+    '.csv': 'csv',
+    '.tsv': 'tsv',
+    '.xlsx': 'excel',
+    '.xlsm': 'excel',
+}
+
+
+def _record_names(value):
+    """
+    Return the entity names of a structured record field.
+
+    Lists are taken as-is and strings are split on pipes like process_data
+    input; names are stripped and blank names dropped.
+    """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        parts = value
+    else:
+        parts = str(value).split('|')
+    return [name for name in (str(part).strip() for part in parts) if name]
+
+
+def _record_volume(value, numbers='integer'):
+    """
+    Return the volume of a structured record field.
+
+    Non-negative integers, floats with an integral value (JSON 5.0, or a
+    whole number in an Excel cell) and digit strings are used as the volume.
+    With numbers='decimal', as in Grammar, fractional floats and strings in
+    decimal or exponent notation are volumes too. Anything else, including a
+    missing or negative value, defaults to a volume of 1, as a line ending in
+    "-3" does in process_data.
+    """
+    if isinstance(value, float):
+        if value.is_integer():
+            value = int(value)
+        elif numbers == 'decimal' and math.isfinite(value) and value >= 0:
+            return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value if value >= 0 else 1
+    if isinstance(value, str):
+        token = value.strip()
+        if token.isdigit():
+            try:
+                return int(token)
+            except ValueError:
+                return 1
+        if numbers == 'decimal' and _DECIMAL_TOKEN_RE.fullmatch(token):
+            volume = _decimal_volume(token)
+            return 1 if volume is None else volume
+    return 1
+
+
+def _aggregate_records(records, totals):
+    """
+    Add (names, volume) records to a running per-entity total.
+
+    Args:
+        records (iterable): Pairs of an entity name list and a volume.
+        totals (dict): Mapping of entity name to summed volume, updated in place.
+
+    Returns:
+        dict: The updated totals.
+    """
+    get = totals.get
+    for names, volume in records:
+        for name in names:
+            totals[name] = get(name, 0) + volume
+    return totals
+
+
+def iter_ndjson_records(f, entity_column='Entity', volume_column='Volume', numbers='integer'):
+    """
+    Stream-parse JSON Lines input into (names, volume) records.
+
+    Each non-blank line must be a JSON object. The entity field may hold a
+    list of names or a pipe-separated string; the volume field is optional.
+
+    Args:
+        f: Binary file object.
+        entity_column (str): Field holding the entity names.
+        volume_column (str): Field holding the volume.
+        numbers (str): 'integer' or 'decimal', as in Grammar.
+
+    Yields:
+        tuple: (names, volume) for each line.
+
+    Raises:
+        ValueError: If a line is not a JSON object.
+    """
+    for line_number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError(f'Line {line_number} is not a JSON object')
+        yield (_record_names(record.get(entity_column)),
+               _record_volume(record.get(volume_column), numbers))
+
+
+def iter_csv_records(f, entity_column='Entity', volume_column='Volume', delimiter=',',
+                     numbers='integer'):
+    """
+    Stream-parse delimited text with a header row into (names, volume) records.
+
+    Args:
+        f: Binary file object.
+        entity_column (str): Column holding the entity names, pipe-separated
+                             when a row lists several entities.
+        volume_column (str): Column holding the volume. If the column is
+                             absent every row has a volume of 1.
+        delimiter (str): Field delimiter, e.g. ',' for CSV or '\\t' for TSV.
+        numbers (str): 'integer' or 'decimal', as in Grammar.
+
+    Yields:
+        tuple: (names, volume) for each row.
+
+    Raises:
+        ValueError: If the entity column is missing from the header.
+    """
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(text, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return
+        if entity_column not in header:
+            raise ValueError(f'Column {entity_column!r} not found in header')
+        entity_index = header.index(entity_column)
+        volume_index = header.index(volume_column) if volume_column in header else None
+
+        for row in reader:
+            if len(row) <= entity_index:
+                continue
+            volume = 1
+            if volume_index is not None and volume_index < len(row):
+                volume = _record_volume(row[volume_index], numbers)
+            yield _record_names(row[entity_index]), volume
+    finally:
+        # Leave the caller's file open
+        text.detach()
+
+
+def iter_excel_records(source, entity_column='Entity', volume_column='Volume', sheet=None,
+                       numbers='integer'):
+    """
+    Stream rows of an Excel worksheet into (names, volume) records.
+
+    The workbook is opened in read-only mode, so rows are read one at a time
+    rather than loading the whole sheet. Requires openpyxl.
+
+    Args:
+        source: Path or binary file object of an .xlsx workbook.
+        entity_column (str): Header of the column holding the entity names.
+        volume_column (str): Header of the column holding the volume.
+        sheet (str, optional): Worksheet name; the active sheet by default.
+        numbers (str): 'integer' or 'decimal', as in Grammar.
+
+    Yields:
+        tuple: (names, volume) for each row.
+
+    Raises:
+        ImportError: If openpyxl is not installed.
+        ValueError: If the entity column is missing from the header.
+    """
+    try:
+        import openpyxl
+    except ImportError as e:
+        raise ImportError('Reading Excel files requires openpyxl') from e
+
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        rows = worksheet.iter_rows(values_only=True)
+        header = [None if cell is None else str(cell) for cell in next(rows, ())]
+        if entity_column not in header:
+            raise ValueError(f'Column {entity_column!r} not found in header')
+        entity_index = header.index(entity_column)
+        volume_index = header.index(volume_column) if volume_column in header else None
+
+        for row in rows:
+            if len(row) <= entity_index:
+                continue
+            volume = 1
+            if volume_index is not None and volume_index < len(row):
+                volume = _record_volume(row[volume_index], numbers)
+            yield _record_names(row[entity_index]), volume
+    finally:
+        workbook.close()
+
+
+def _counted(items, counts):
+    """Yield items unchanged, adding one to counts[0] for each."""
+    for item in items:
+        counts[0] += 1
+        yield item
+
+
+def _counted_blocks(blocks, counts):
+    """Yield newline-aligned blocks unchanged, adding their rows to counts[0] and bytes to counts[1]."""
+    for block in blocks:
+        counts[0] += block.count(b'\n') + (not block.endswith(b'\n'))
+        counts[1] += len(block)
+        yield block
+
+
+def _stream_position(f):
+    """Return the position of a file object, or None if it cannot tell."""
+    try:
+        return f.tell()
+    except (OSError, ValueError):
+        return None
+
+
+def _stream_size(source):
+    """Return the size in bytes of a path or seekable file object, or None."""
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    try:
+        return source.seek(0, os.SEEK_END)
+    except (OSError, ValueError):
+        return None
+
+
+def process_file(source, file_format=None, entity_column='Entity', volume_column='Volume',
+                 sheet=None, grammar=DEFAULT_GRAMMAR):
+    """
+    Process a text, JSON Lines, CSV/TSV or Excel file into a ranking.
+
+    Input is streamed record by record into the aggregation, so it is never
+    converted to the pipe text format or loaded into a DataFrame first.
+    Text, JSON Lines and CSV/TSV input compressed with gzip, bz2, xz or zstd
+    is detected from its magic bytes and decompressed on the fly.
+
+    Args:
+        source: Path or binary file object (such as a Streamlit upload).
+        file_format (str, optional): One of 'text', 'ndjson', 'csv', 'tsv' or
+                                     'excel'. Inferred from the file name when
+                                     not given (ignoring a compression
+                                     suffix such as .gz), defaulting to
+                                     'text'.
+        entity_column (str): Field or column holding the entity names
+                             (structured formats only).
+        volume_column (str): Field or column holding the volume
+                             (structured formats only).
+        sheet (str, optional): Worksheet name for Excel files.
+        grammar (Grammar): Entity separator and volume placement for text
+                          files; rows are always lines. Its number format
+                          and filter rules apply to every format.
+
+    Returns:
+        pd.DataFrame: DataFrame with columns ['Entity', 'Volume'] in the same
+                     format as process_data.
+
+    Raises:
+        ValueError: If the format is unknown, a required column is missing or
+                    compressed input is corrupt.
+        ImportError: If the input is zstd-compressed and zstandard is not
+                     installed.
+
+    Examples:
+        >>> process_file('export.jsonl')
+        >>> process_file('archive/export.csv.gz')
+        >>> process_file('export.csv', entity_column='account', volume_column='hits')
+    """
+    if file_format is None:
+        name = source if isinstance(source, str) else getattr(source, 'name', '')
+        name, extension = os.path.splitext(name)
+        if extension.lower() in _COMPRESSION_SUFFIXES:
+            extension = os.path.splitext(name)[1]
+        file_format = _FILE_FORMATS.get(extension.lower(), 'text')
+    if file_format not in set(_FILE_FORMATS.values()):
+        raise ValueError(f'Unknown file format: {file_format}')
+
+    started = time.perf_counter()
+    totals = {}
+    # Rows or records read, and bytes read (decompressed, as in process_files)
+    counts = [0, 0]
+    if file_format == 'excel':
+        records = iter_excel_records(source, entity_column, volume_column, sheet, grammar.numbers)
+        _aggregate_records(_filter_records(_counted(records, counts), grammar), totals)
+        df = _totals_to_frame(totals)
+        _record_run('process_file', started, len(df), counts[0], _stream_size(source))
+        return df
+
+    raw = open(source, 'rb') if isinstance(source, str) else source
+    f = open_decompressed(raw)
+    try:
+        if file_format == 'text':
+            with ReadAhead(f) as blocks:
+                _aggregate_rows(_iter_block_rows(_counted_blocks(blocks, counts)), totals,
+                                _line_parser(grammar))
+            _record_reads('process_file', blocks.read_seconds, blocks.wait_seconds)
+        else:
+            start = _stream_position(f)
+            if file_format == 'ndjson':
+                records = iter_ndjson_records(f, entity_column, volume_column, grammar.numbers)
+            else:
+                delimiter = '\t' if file_format == 'tsv' else ','
+                records = iter_csv_records(f, entity_column, volume_column, delimiter,
+                                           grammar.numbers)
+            _aggregate_records(_filter_records(_counted(records, counts), grammar), totals)
+            end = _stream_position(f)
+            counts[1] = None if start is None or end is None else end - start
+    except (OSError, EOFError, lzma.LZMAError) as e:
+        if f is raw:
+            raise
+        raise ValueError(f'Could not decompress input: {e}') from e
+    finally:
+        if f is not raw:
+            f.close()
+        if isinstance(source, str):
+            raw.close()
+
+    df = _totals_to_frame(totals)
+    _record_run('process_file', started, len(df), counts[0], counts[1])
+    return df
+
+
+# Magic bytes and version of the partial aggregate file layout
+_PARTIAL_MAGIC = b'MEVPART'
+_PARTIAL_VERSION = 1
+
+
+def _encode_varint(value):
+    """Encode a non-negative integer as an unsigned LEB128 varint."""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _write_partial_entries(entries, path):
+    """
+    Stream (entity, volume) pairs, already in entity order, into a partial file.
+
+    Layout (all integers are unsigned varints):
+        magic, version byte
+        per entity: len(name) + 1, UTF-8 name, volume
+        0 terminator, entity count, total volume, CRC32 of everything before it
+
+    The file is written next to its destination and moved into place, so a
+    node that dies while writing never leaves a truncated partial behind.
+    """
+    tmp_path = f'{path}.tmp'
+    count = 0
+    total = 0
+    crc = 0
+    previous = None
+    try:
+        with open(tmp_path, 'wb') as f:
+            def write(data):
+                nonlocal crc
+                crc = zlib.crc32(data, crc)
+                f.write(data)
+
+            write(_PARTIAL_MAGIC + bytes([_PARTIAL_VERSION]))
+            for name, volume in entries:
+                if previous is not None and name <= previous:
+                    raise ValueError('Partial aggregate entries must be unique and sorted by entity')
+                if isinstance(volume, float) and not volume.is_integer():
+                    raise ValueError(f'Partial aggregates hold whole volumes only; '
+                                     f'entity {name!r} has {volume}')
+                volume = int(volume)
+                if volume < 0:
+                    raise ValueError(f'Negative volume for entity {name!r}')
+                encoded = name.encode('utf-8')
+                write(_encode_varint(len(encoded) + 1) + encoded + _encode_varint(volume))
+                previous = name
+                count += 1
+                total += volume
+            write(b'\x00' + _encode_varint(count) + _encode_varint(total))
+            f.write(crc.to_bytes(4, 'big'))
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        # Do not leave a partial file behind that can never be completed
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def write_partial(result, path):
+    """
+    Write per-entity partial sums in the compact partial aggregate format.
+
+    Partials are sorted by entity (code point order, which is also UTF-8 byte
+    order), so any number of them can be combined with a streaming k-way
+    merge. Each file carries a version byte, its entity count, the total
+    volume and a CRC32 so a damaged transfer is detected on read.
+
+    Args:
+        result: DataFrame with columns ['Entity', 'Volume'] as returned by
+                process_data, process_file or process_files, or a dict
+                mapping entity names to volumes.
+        path (str): File to write.
+
+    Raises:
+        ValueError: If a volume is negative or fractional.
+
+    Examples:
+        >>> write_partial(process_file('shard_3.jsonl'), 'shard_3.part')
+    """
+    if isinstance(result, pd.DataFrame):
+        totals = {}
+        for name, volume in zip(result['Entity'], result['Volume'].tolist()):
+            totals[name] = totals.get(name, 0) + volume
+    else:
+        totals = result
+    _write_partial_entries(sorted(totals.items()), path)
+
+
+class _PartialReader:
+    """Buffered reader for partial files that keeps a running CRC32."""
+
+    def __init__(self, f, block_size):
+        self._f = f
+        self._block_size = block_size
+        self._buffer = b''
+        self._pos = 0
+        self.crc = 0
+
+    def read(self, n):
+        while len(self._buffer) - self._pos < n:
+            chunk = self._f.read(self._block_size)
+            if not chunk:
+                raise ValueError('Partial aggregate file is truncated')
+            self._buffer = self._buffer[self._pos:] + chunk
+            self._pos = 0
+        data = self._buffer[self._pos:self._pos + n]
+        self._pos += n
+        self.crc = zlib.crc32(data, self.crc)
+        return data
+
+    def read_varint(self):
+        buffer = self._buffer
+        pos = self._pos
+        # Fast path: the whole varint is already buffered
+        value = 0
+        shift = 0
+        for index in range(pos, len(buffer)):
+            byte = buffer[index]
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                self._pos = index + 1
+                self.crc = zlib.crc32(buffer[pos:index + 1], self.crc)
+                return value
+            shift += 7
+
+        value = 0
+        shift = 0
+        while True:
+            byte = self.read(1)[0]
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+
+def iter_partial(path, block_size=1 << 16):
+    """
+    Stream the (entity, volume) pairs of a partial file in entity order.
+
+    Only one block of the file is held in memory at a time. The footer is
+    checked once the last entry has been read.
+
+    Args:
+        path (str): Partial file written by write_partial.
+        block_size (int): Number of bytes read from the file at a time.
+
+    Yields:
+        tuple: (entity, volume) pairs sorted by entity.
+
+    Raises:
+        ValueError: If the file is not a partial aggregate, has an unsupported
+                    version, is truncated or fails its integrity checks.
+    """
+    with open(path, 'rb') as f:
+        reader = _PartialReader(f, block_size)
+        try:
+            header = reader.read(len(_PARTIAL_MAGIC) + 1)
+        except ValueError:
+            raise ValueError(f'{path} is not a partial aggregate file') from None
+        if header[:-1] != _PARTIAL_MAGIC:
+            raise ValueError(f'{path} is not a partial aggregate file')
+        if header[-1] != _PARTIAL_VERSION:
+            raise ValueError(f'Unsupported partial aggregate version: {header[-1]}')
+
+        count = 0
+        total = 0
+        previous = None
+        while True:
+            length = reader.read_varint()
+            if length == 0:
+                break
+            name = reader.read(length - 1).decode('utf-8')
+            volume = reader.read_varint()
+            if previous is not None and name <= previous:
+                raise ValueError(f'{path} is corrupt: entities out of order')
+            previous = name
+            count += 1
+            total += volume
+            yield name, volume
+
+        expected = (reader.read_varint(), reader.read_varint())
+        crc = reader.crc
+        if int.from_bytes(reader.read(4), 'big') != crc or expected != (count, total):
+            raise ValueError(f'{path} is corrupt: integrity check failed')
+
+
+def iter_merged_partials(paths, block_size=1 << 16):
+    """
+    Combine partial files into one entity-ordered stream with a k-way merge.
+
+    Each input is read incrementally, so memory use depends on the number of
+    partials rather than their size.
+
+    Args:
+        paths (list): Partial files written by write_partial.
+        block_size (int): Number of bytes read from each file at a time.
+
+    Yields:
+        tuple: (entity, volume) pairs sorted by entity, with the volumes of
+               the same entity in different partials summed.
+    """
+    streams = [iter_partial(path, block_size) for path in paths]
+    current = None
+    volume = 0
+    for name, partial_volume in heapq.merge(*streams, key=lambda entry: entry[0]):
+        if name != current:
+            if current is not None:
+                yield current, volume
+            current = name
+            volume = 0
+        volume += partial_volume
+    if current is not None:
+        yield current, volume
+
+
+def merge_partials(paths, output_path=None):
+    """
+    Merge partial aggregates produced on different nodes into the final ranking.
+
+    Args:
+        paths (list): Partial files written by write_partial.
+        output_path (str, optional): When given, the merged sums are also
+                                     written there as a new partial, so
+                                     merges can be arranged in a tree.
+
+    Returns:
+        pd.DataFrame: DataFrame with columns ['Entity', 'Volume'] in the same
+                     format as process_data run over all the original input.
+
+    Raises:
+        ValueError: If any partial fails to read (see iter_partial).
+
+    Examples:
+        >>> merge_partials(['node_1.part', 'node_2.part', 'node_3.part'])
+    """
+    totals = {}
+    merged = iter_merged_partials(paths)
+    if output_path:
+        def collect():
+            for name, volume in merged:
+                totals[name] = volume
+                yield name, volume
+        _write_partial_entries(collect(), output_path)
+    else:
+        totals.update(merged)
+    return _totals_to_frame(totals)
+
+
+# Magic bytes and version of the result cache entry layout
+_CACHE_MAGIC = b'MEVCACHE'
+_CACHE_VERSION = 2
+
+# Environment variable naming the result cache directory of the web interface
+_CACHE_DIR_ENV = 'METRIC_ANALYSIS_CACHE_DIR'
+
+
+def digest_source(source, block_size=1 << 20):
+    """
+    Compute the SHA-256 content digest of an input.
+
+    Args:
+        source: Input bytes, a path, or a binary file object. File objects are
+                rewound afterwards so they can still be processed.
+        block_size (int): Number of bytes hashed at a time.
+
+    Returns:
+        str: Hex digest of the input bytes (as stored, i.e. still compressed
+             for compressed files).
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, bytes):
+        digest.update(source)
+        return digest.hexdigest()
+
+    f = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        position = f.tell()
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+        f.seek(position)
+    finally:
+        if isinstance(source, str):
+            f.close()
+    return digest.hexdigest()
+
+
+def _encode_result(df):
+    """
+    Serialize a ranking into a cache entry.
+
+    Layout: magic, version byte, volume type byte ('i' for int64, 'f' for
+    float64), entity count and name blob length (uint64), index and name end
+    offsets (int64 arrays), volumes (int64 or float64 array), UTF-8 name blob,
+    and a CRC32 of everything before it. Loading needs one decode of the blob
+    and no sorting, so it is much faster than parsing the input again.
+    """
+    names = df['Entity'].tolist()
+    blob = ''.join(names).encode('utf-8')
+    ends = np.cumsum([len(name) for name in names], dtype='<i8')
+    kind = b'f' if df['Volume'].dtype == np.float64 else b'i'
+    body = b''.join([
+        _CACHE_MAGIC, bytes([_CACHE_VERSION]), kind,
+        np.array([len(names), len(blob)], dtype='<u8').tobytes(),
+        df.index.to_numpy(dtype='<i8').tobytes(),
+        ends.tobytes(),
+        df['Volume'].to_numpy(dtype='<f8' if kind == b'f' else '<i8').tobytes(),
+        blob,
+    ])
+    return body + zlib.crc32(body).to_bytes(4, 'big')
+
+
+def _decode_result(data):
+    """
+    Deserialize a cache entry written by _encode_result.
+
+    Raises:
+        ValueError: If the entry is truncated, corrupt or of another version.
+    """
+    header_size = len(_CACHE_MAGIC) + 2 + 16
+    if len(data) < header_size + 4 or not data.startswith(_CACHE_MAGIC):
+        raise ValueError('Not a result cache entry')
+    if data[len(_CACHE_MAGIC)] != _CACHE_VERSION:
+        raise ValueError(f'Unsupported result cache version: {data[len(_CACHE_MAGIC)]}')
+    body = data[:-4]
+    if zlib.crc32(body) != int.from_bytes(data[-4:], 'big'):
+        raise ValueError('Result cache entry failed its integrity check')
+
+    kind = body[len(_CACHE_MAGIC) + 1:len(_CACHE_MAGIC) + 2]
+    count, blob_size = np.frombuffer(body, dtype='<u8', count=2, offset=len(_CACHE_MAGIC) + 2)
+    count = int(count)
+    if kind not in (b'i', b'f') or len(body) != header_size + 24 * count + int(blob_size):
+        raise ValueError('Result cache entry has an inconsistent layout')
+    if count == 0:
+        return _totals_to_frame({})
+    arrays = np.frombuffer(body, dtype='<i8', count=2 * count, offset=header_size)
+    index, ends = arrays[:count], arrays[count:]
+    volumes = np.frombuffer(body, dtype='<f8' if kind == b'f' else '<i8', count=count,
+                            offset=header_size + 16 * count)
+
+    text = body[header_size + 24 * count:].decode('utf-8')
+    starts = [0, *ends[:-1].tolist()]
+    names = [text[start:end] for start, end in zip(starts, ends.tolist())]
+    volumes = volumes.astype(np.float64 if kind == b'f' else np.int64)
+    return pd.DataFrame({'Entity': names, 'Volume': volumes},
+                        index=pd.Index(index.astype(np.int64)))
+
+
+class ResultCache:
+    """
+    Persistent, content-addressed cache of processed results.
+
+    Entries are keyed by the digests of the input contents plus the options
+    that affect parsing, so identical input processed the same way is only
+    parsed once, across server restarts and CLI runs. Each entry is a single
+    binary file carrying a CRC32; entries that fail to load are deleted and
+    treated as misses. When the cache grows beyond max_bytes, the least
+    recently used entries are evicted.
+
+    Args:
+        directory (str): Directory holding the cache entries; created if needed.
+        max_bytes (int): Size limit of all entries together.
+
+    Examples:
+        >>> cache = ResultCache('~/.cache/metric-analysis')
+        >>> key = cache.key([digest_source('export.txt')], grammar)
+        >>> df = cache.get(key)
+        >>> if df is None:
+        ...     df = process_files(['export.txt'], grammar=grammar)
+        ...     cache.put(key, df)
+    """
+
+    def __init__(self, directory, max_bytes=256 << 20):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(digests, options):
+        """
+        Build the cache key of a result.
+
+        Args:
+            digests (list): Content digests of the inputs, in processing order
+                            (see digest_source).
+            options: Everything else that affects the result, such as the
+                     Grammar or file format; must have a stable repr().
+
+        Returns:
+            str: Hex cache key.
+        """
+        key = hashlib.sha256(f'{_CACHE_VERSION}:{options!r}'.encode('utf-8'))
+        for digest in digests:
+            key.update(digest.encode('ascii'))
+        return key.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.result')
+
+    def get(self, key):
+        """
+        Load a cached result.
+
+        Returns:
+            pd.DataFrame or None: The result in the format of process_data,
+                                  or None if it is not cached (or was damaged).
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            _CACHE_LOOKUPS.inc(result='miss')
+            return None
+        try:
+            df = _decode_result(data)
+        except ValueError:
+            self._remove(path)
+            _CACHE_LOOKUPS.inc(result='miss')
+            return None
+        _CACHE_LOOKUPS.inc(result='hit')
+        # Mark the entry as recently used for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return df
+
+    def put(self, key, df):
+        """
+        Store a result and evict the oldest entries if the cache is too large.
+
+        Results whose volumes escalated to exact Python integers are not
+        cached; they are rare and cannot be stored as fixed-width arrays.
+        """
+        if df['Volume'].dtype == object and len(df):
+            return
+        path = self._path(key)
+        # Unique temporary name so concurrent writers of one key never collide
+        tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_encode_result(df))
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.result'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            self._remove(path)
+            size -= entry_size
+
+
+@st.cache_resource
+def _result_cache(directory):
+    """Return the server-wide result cache for a directory."""
+    return ResultCache(directory)
+
+
+# Magic bytes and version of the mapping index file layout
+_MAPPING_MAGIC = b'MEVMAP'
+_MAPPING_VERSION = 1
+
+# Group label of entities missing from the mapping when re-aggregating
+_UNMAPPED = '(unmapped)'
+
+
+def _key_hashes(keys):
+    """
+    Return stable 64-bit hashes of UTF-8 keys, computed for all keys at once.
+
+    Each key is hashed with FNV-1a followed by the MurmurHash3 finalizer, so
+    the low bits used for table slots are well mixed. The loop runs over
+    byte positions rather than keys: keys are ordered by length, so step j
+    updates the prefix of keys longer than j in one NumPy operation.
+
+    Args:
+        keys (list): Encoded entity names.
+
+    Returns:
+        tuple: (hashes, blob, starts, lengths) where blob is a uint8 array of
+               the concatenated keys and starts/lengths locate each key in it.
+    """
+    blob = np.frombuffer(b''.join(keys), dtype=np.uint8)
+    lengths = np.fromiter(map(len, keys), dtype=np.int64, count=len(keys))
+    starts = np.cumsum(lengths) - lengths
+    order = np.argsort(-lengths, kind='stable')
+    sorted_starts, sorted_lengths = starts[order], lengths[order]
+    hashes = np.full(len(keys), 0xcbf29ce484222325, dtype=np.uint64)
+    prime = np.uint64(0x100000001b3)
+    longest = int(sorted_lengths[0]) if len(keys) else 0
+    # Number of keys longer than each position
+    active = len(keys) - np.searchsorted(sorted_lengths[::-1], np.arange(longest), side='right')
+    for position in range(longest):
+        count = int(active[position])
+        head = hashes[:count]
+        head ^= blob[sorted_starts[:count] + position]
+        head *= prime
+    result = np.empty_like(hashes)
+    result[order] = _mix64(hashes)
+    return result, blob, starts, lengths
+
+
+def _ranges(starts, lengths):
+    """Return the concatenated positions start..start+length-1 of each range."""
+    nonempty = lengths > 0
+    starts, lengths = starts[nonempty], lengths[nonempty]
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    steps = np.ones(int(ends[-1]), dtype=np.int64)
+    # Each range starts with a jump from the end of the previous one
+    steps[0] = starts[0]
+    steps[ends[:-1]] = starts[1:] - (starts[:-1] + lengths[:-1]) + 1
+    return np.cumsum(steps)
+
+
+def _pad8(data):
+    """Pad a byte string to a multiple of 8 bytes so the next array is aligned."""
+    return data + b'\0' * (-len(data) % 8)
+
+
+class MappingIndex:
+    """
+    Memory-mapped hash index from entity names to mapped attributes.
+
+    The index is a file built once from a mapping table (see build() and
+    open_mapping()). It holds an open-addressing hash table of 64-bit key
+    hashes, the UTF-8 keys, and each attribute as dictionary codes, so
+    opening it only maps the file and reads the attribute value lists; the
+    operating system pages in what lookups touch, and every process serving
+    the same index shares those pages. Lookups are vectorized with NumPy and
+    verify the key bytes, so hash collisions never mix up entities.
+
+    Layout (little-endian): magic, version byte, a padding byte, entry,
+    slot and attribute counts and the metadata length (uint64), JSON
+    metadata with the attribute names and their distinct values, then the
+    key hashes and key end offsets (uint64 arrays), the attribute codes
+    (uint32, one row per entry), the hash table (uint32 entry number plus
+    one, 0 for empty slots) and the key blob. Sections are 8-byte aligned.
+
+    Args:
+        path (str): Index file written by build().
+
+    Raises:
+        ValueError: If the file is not a mapping index of this version.
+
+    Examples:
+        >>> mapping = open_mapping('owners.csv')
+        >>> mapping.enrich(process_data(data))             # adds owner, team, ...
+        >>> mapping.reaggregate(process_data(data), 'team')
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise ValueError('Not a mapping index') from e
+        buffer = self._mmap
+        header_size = len(_MAPPING_MAGIC) + 2 + 32
+        if len(buffer) < header_size or buffer[:len(_MAPPING_MAGIC)] != _MAPPING_MAGIC:
+            raise ValueError('Not a mapping index')
+        if buffer[len(_MAPPING_MAGIC)] != _MAPPING_VERSION:
+            raise ValueError(f'Unsupported mapping index version: {buffer[len(_MAPPING_MAGIC)]}')
+        entries, slots, attributes, meta_size = (int(value) for value in np.frombuffer(
+            buffer, dtype='<u8', count=4, offset=len(_MAPPING_MAGIC) + 2))
+
+        offset = header_size
+        meta = json.loads(bytes(buffer[offset:offset + meta_size]).decode('utf-8'))
+        offset += meta_size + (-meta_size % 8)
+        self._hashes = np.frombuffer(buffer, dtype='<u8', count=entries, offset=offset)
+        offset += 8 * entries
+        self._ends = np.frombuffer(buffer, dtype='<u8', count=entries, offset=offset)
+        offset += 8 * entries
+        codes = np.frombuffer(buffer, dtype='<u4', count=entries * attributes, offset=offset)
+        self._codes = codes.reshape(entries, attributes)
+        offset += 4 * entries * attributes
+        offset += -offset % 8
+        self._table = np.frombuffer(buffer, dtype='<u4', count=slots, offset=offset)
+        offset += 4 * slots
+        self._blob_start = offset + (-offset % 8)
+        blob_size = int(self._ends[-1]) if entries else 0
+        if self._blob_start + blob_size != len(buffer):
+            raise ValueError('Mapping index has an inconsistent layout')
+
+        self.path = path
+        self.attributes = meta['attributes']
+        self._values = [np.array(values, dtype=object) for values in meta['values']]
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def close(self):
+        """Unmap the index file."""
+        self._hashes = self._ends = self._codes = self._table = None
+        self._mmap.close()
+
+    def _same_keys(self, entries, keys, key_starts, key_lengths):
+        """Return which stored keys equal the query keys, comparing bytes in bulk."""
+        ends = self._ends[entries].astype(np.int64)
+        starts = np.where(entries > 0, self._ends[np.maximum(entries - 1, 0)].astype(np.int64), 0)
+        same = (ends - starts) == key_lengths
+        if not same.any():
+            return same
+        starts, key_starts, lengths = starts[same], key_starts[same], key_lengths[same]
+        blob = np.frombuffer(self._mmap, dtype=np.uint8, offset=self._blob_start)
+        differs = blob[_ranges(starts, lengths)] != keys[_ranges(key_starts, lengths)]
+        # Count differing bytes per key; empty keys have none
+        boundaries = np.cumsum(lengths) - lengths
+        nonempty = lengths > 0
+        mismatches = np.zeros(len(lengths), dtype=np.int64)
+        if differs.size:
+            mismatches[nonempty] = np.add.reduceat(differs, boundaries[nonempty])
+        same[np.flatnonzero(same)] = mismatches == 0
+        return same
+
+    def lookup(self, names):
+        """
+        Find the index entries of entity names.
+
+        Args:
+            names (iterable): Entity names.
+
+        Returns:
+            np.ndarray: Entry number of each name, or -1 if it is not mapped.
+        """
+        hashes, keys, key_starts, key_lengths = _key_hashes([name.encode('utf-8') for name in names])
+        found = np.full(len(hashes), -1, dtype=np.int64)
+        if not len(self._table):
+            return found
+
+        mask = np.uint64(len(self._table) - 1)
+        active = np.arange(len(hashes))
+        slots = (hashes & mask).astype(np.int64)
+        while len(active):
+            entries = self._table[slots].astype(np.int64) - 1
+            occupied = entries >= 0
+            matched = np.zeros(len(active), dtype=bool)
+            candidates = np.flatnonzero(occupied)
+            candidates = candidates[self._hashes[entries[candidates]] == hashes[active[candidates]]]
+            # Equal 64-bit hashes are confirmed by comparing the keys themselves
+            queries = active[candidates]
+            same = self._same_keys(entries[candidates], keys, key_starts[queries],
+                                   key_lengths[queries])
+            found[queries[same]] = entries[candidates[same]]
+            matched[candidates[same]] = True
+            keep = occupied & ~matched
+            active = active[keep]
+            slots = (slots[keep] + 1) % len(self._table)
+        return found
+
+    def enrich(self, df):
+        """
+        Add the mapped attributes of each entity as columns.
+
+        Args:
+            df (pd.DataFrame): Result with an 'Entity' column.
+
+        Returns:
+            pd.DataFrame: A copy with one column per attribute; entities
+                          missing from the mapping get None.
+        """
+        entries = self.lookup(df['Entity'])
+        mapped = entries >= 0
+        df = df.copy()
+        for position, attribute in enumerate(self.attributes):
+            column = np.full(len(df), None, dtype=object)
+            column[mapped] = self._values[position][self._codes[entries[mapped], position]]
+            df[attribute] = column
+        return df
+
+    def reaggregate(self, df, attribute):
+        """
+        Sum volumes by a mapped attribute instead of by entity.
+
+        Volumes are added up per dictionary code of the attribute, so no
+        DataFrame join or string grouping is needed.
+
+        Args:
+            df (pd.DataFrame): Result with 'Entity' and 'Volume' columns.
+            attribute (str): Mapped attribute to group by.
+
+        Returns:
+            pd.DataFrame: Columns [attribute, 'Volume'], sorted by volume in
+                         descending order and then by value. Entities
+                         missing from the mapping are summed under
+                         '(unmapped)'.
+
+        Raises:
+            ValueError: If the attribute is not in the mapping.
+        """
+        if attribute not in self.attributes:
+            raise ValueError(f'Unknown mapped attribute: {attribute}')
+        position = self.attributes.index(attribute)
+        values = self._values[position]
+        entries = self.lookup(df['Entity'])
+        # Code 0 collects unmapped entities, value codes are shifted by one
+        groups = np.zeros(len(df), dtype=np.int64)
+        mapped = entries >= 0
+        groups[mapped] = self._codes[entries[mapped], position].astype(np.int64) + 1
+
+        volumes = df['Volume'].to_numpy()
+        if volumes.dtype == object:
+            sums = [0] * (len(values) + 1)
+            for group, volume in zip(groups.tolist(), volumes.tolist()):
+                sums[group] += volume
+            sums = np.array(sums, dtype=object)
+        else:
+            sums = np.zeros(len(values) + 1, dtype=volumes.dtype)
+            np.add.at(sums, groups, volumes)
+
+        present = np.flatnonzero(np.bincount(groups, minlength=len(values) + 1))
+        labels = np.concatenate([np.array([_UNMAPPED], dtype=object), values])[present]
+        result = pd.DataFrame({attribute: labels, 'Volume': sums[present]})
+        return result.sort_values(['Volume', attribute], ascending=[False, True],
+                                  kind='stable').reset_index(drop=True)
+
+    @classmethod
+    def build(cls, source, path, entity_column='Entity', attributes=None, delimiter=None):
+        """
+        Build an index file from a delimited mapping table and open it.
+
+        The table is streamed row by row. When an entity appears more than
+        once, its last row wins. The file is written under a temporary name
+        and moved into place, so concurrent readers never see it half written.
+
+        Args:
+            source: Path or binary file object of a CSV/TSV table with a
+                    header row.
+            path (str): Index file to write.
+            entity_column (str): Column holding the entity names.
+            attributes (list, optional): Columns to index; all others by default.
+            delimiter (str, optional): Field delimiter; tab for .tsv paths
+                                       and comma otherwise by default.
+
+        Returns:
+            MappingIndex: The opened index.
+
+        Raises:
+            ValueError: If a column is missing or an attribute is named
+                        'Entity' or 'Volume'.
+        """
+        if delimiter is None:
+            name = source if isinstance(source, str) else getattr(source, 'name', '')
+            delimiter = '\t' if str(name).lower().endswith('.tsv') else ','
+        f = open(source, 'rb') if isinstance(source, str) else source
+        text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.reader(text, delimiter=delimiter)
+            header = next(reader, None) or []
+            if entity_column not in header:
+                raise ValueError(f'Column {entity_column!r} not found in header')
+            if attributes is None:
+                attributes = [column for column in header if column != entity_column]
+            for attribute in attributes:
+                if attribute not in header:
+                    raise ValueError(f'Column {attribute!r} not found in header')
+                if attribute in ('Entity', 'Volume'):
+                    raise ValueError(f'Attribute column cannot be named {attribute!r}')
+            entity_index = header.index(entity_column)
+            indices = [header.index(attribute) for attribute in attributes]
+
+            # Dictionary-encode attribute values while streaming the rows
+            dictionaries = [{} for _ in attributes]
+            rows = {}
+            for row in reader:
+                if len(row) <= entity_index:
+                    continue
+                row += [''] * (len(header) - len(row))
+                rows[row[entity_index].strip()] = [
+                    dictionary.setdefault(row[index], len(dictionary))
+                    for dictionary, index in zip(dictionaries, indices)]
+        finally:
+            text.detach()
+            if isinstance(source, str):
+                f.close()
+
+        keys = [key.encode('utf-8') for key in rows]
+        hashes, blob, starts, lengths = _key_hashes(keys)
+        hashes = hashes.astype('<u8')
+        ends = (starts + lengths).astype('<u8')
+        codes = np.array(list(rows.values()), dtype='<u4').reshape(len(rows), len(attributes))
+        table = cls._hash_table(hashes)
+        meta = json.dumps({'attributes': attributes,
+                           'values': [list(dictionary) for dictionary in dictionaries]})
+
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(_MAPPING_MAGIC + bytes([_MAPPING_VERSION, 0]))
+            meta = meta.encode('utf-8')
+            out.write(np.array([len(rows), len(table), len(attributes), len(meta)],
+                               dtype='<u8').tobytes())
+            out.write(_pad8(meta))
+            out.write(hashes.tobytes())
+            out.write(ends.tobytes())
+            out.write(_pad8(codes.tobytes()))
+            out.write(_pad8(table.tobytes()))
+            out.write(blob.tobytes())
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    @staticmethod
+    def _hash_table(hashes):
+        """Place entries into a power-of-two table with linear probing, vectorized."""
+        slots = 1 << max(len(hashes) * 2 - 1, 1).bit_length()
+        table = np.zeros(slots, dtype='<u4')
+        pending = np.arange(len(hashes))
+        positions = (hashes & np.uint64(slots - 1)).astype(np.int64)
+        while len(pending):
+            free = np.flatnonzero(table[positions] == 0)
+            # Of the entries wanting the same free slot, the first one gets it
+            taken, first = np.unique(positions[free], return_index=True)
+            table[taken] = pending[free[first]] + 1
+            placed = np.zeros(len(pending), dtype=bool)
+            placed[free[first]] = True
+            pending = pending[~placed]
+            positions = (positions[~placed] + 1) % slots
+        return table
+
+
+def open_mapping(source, entity_column='Entity', directory=None):
+    """
+    Open the index of a mapping table, building it on first use.
+
+    Index files are named after the SHA-256 of the table and the options,
+    so later runs (and other processes) reuse them until the table changes.
+
+    Args:
+        source (str): Path of the CSV/TSV mapping table.
+        entity_column (str): Column holding the entity names.
+        directory (str, optional): Where index files are kept; the system
+                                   temporary directory by default.
+
+    Returns:
+        MappingIndex: The opened index.
+
+    Examples:
+        >>> mapping = open_mapping('owners.csv', directory='/var/cache/metric_analysis')
+    """
+    directory = directory or os.path.join(tempfile.gettempdir(), 'metric_analysis_mappings')
+    os.makedirs(directory, exist_ok=True)
+    key = hashlib.sha256(f'{_MAPPING_VERSION}:{digest_source(source)}:{entity_column!r}'.encode('utf-8'))
+    path = os.path.join(directory, f'{key.hexdigest()}.mevmap')
+    try:
+        return MappingIndex(path)
+    except (FileNotFoundError, ValueError):
+        return MappingIndex.build(source, path, entity_column)
+
+
+# Mapping tables the web interface may load, separated by os.pathsep
+_MAPPING_FILES_ENV = 'METRIC_ANALYSIS_MAPPING_FILES'
+
+
+@st.cache_resource
+def _mapping_index(path, modified, entity_column, directory):
+    """Return the mapping index shared by all sessions; modified keys it to the file version."""
+    return open_mapping(path, entity_column, directory)
+
+
+def _mapping_header(path):
+    """Return the header row of a mapping table, read as MappingIndex.build reads it."""
+    delimiter = '\t' if path.lower().endswith('.tsv') else ','
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        header = next(csv.reader(f, delimiter=delimiter), None)
+    if not header:
+        raise ValueError('The mapping file has no header row')
+    return header
+
+
+class DirectoryFollower:
+    """
+    Keep a live aggregate of log-style files that are appended to over time.
+
+    Each call to poll() scans the directory and reads only the bytes appended
+    since the previous poll, feeding complete lines through the process_data
+    rules. Files are tracked by device and inode rather than by name, and
+    each followed file is kept open. A file that no longer matches the
+    pattern (rotated aside under a new name, or deleted) is finished through
+    its open handle from the remembered offset, including lines its writer
+    appends after the rotation, and closed once a poll finds nothing new in
+    it; the replacement is read from the start. A file that shrinks below
+    its offset is treated as truncated and re-read from the beginning. An
+    unterminated last line is left for the next poll. Bytes that are not
+    valid UTF-8 are replaced rather than failing the poll.
+
+    Polls are serialized with a lock, so one follower can be shared between
+    threads or Streamlit sessions. Call close() to release the open files.
+
+    Args:
+        directory (str): Directory to watch.
+        pattern (str): Glob pattern selecting the files to follow.
+        block_size (int): Number of bytes read at a time.
+        grammar (Grammar): Entity separator and volume placement; rows are
+                          always lines.
+
+    Examples:
+        >>> follower = DirectoryFollower('/var/log/feed', '*.log')
+        >>> follower.poll()
+        >>> follower.snapshot().to_csv('live.csv', index=False)
+    """
+
+    def __init__(self, directory, pattern='*', block_size=1 << 20, grammar=DEFAULT_GRAMMAR):
+        self.directory = directory
+        self.pattern = pattern
+        self.block_size = block_size
+        self._parse_row = _line_parser(grammar)
+        self.totals = {}
+        self.lines_processed = 0
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def poll(self):
+        """
+        Read newly appended complete lines from every followed file.
+
+        Returns:
+            int: Number of lines processed by this poll.
+
+        Raises:
+            OSError: If the directory or a matching file cannot be read.
+        """
+        with self._lock:
+            matching = set()
+            processed = nbytes = 0
+
+            for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+                if not entry.is_file() or not fnmatch.fnmatch(entry.name, self.pattern):
+                    continue
+                stat = entry.stat()
+                identity = (stat.st_dev, stat.st_ino)
+                if identity not in self._files:
+                    self._files[identity] = [open(entry.path, 'rb'), 0]
+                matching.add(identity)
+
+            for identity, state in list(self._files.items()):
+                f, offset = state
+                size = os.fstat(f.fileno()).st_size
+
+                # Truncated in place: start over from the beginning
+                if size < offset:
+                    offset = 0
+                lines = 0
+                if size > offset:
+                    start = offset
+                    offset, lines = self._read_new_lines(f, offset)
+                    processed += lines
+                    nbytes += offset - start
+                state[1] = offset
+
+                # Rotated out of the pattern or deleted: forget once it stops growing
+                if identity not in matching and not lines:
+                    f.close()
+                    del self._files[identity]
+
+            self.lines_processed += processed
+            _LINES.inc(processed, source='follow')
+            _BYTES.inc(nbytes, source='follow')
+            return processed
+
+    def _read_new_lines(self, f, offset):
+        """Aggregate complete lines after offset and return the new offset and line count."""
+        lines = 0
+        f.seek(offset)
+        tail = b''
+        while True:
+            block = f.read(self.block_size)
+            if not block:
+                break
+            block = tail + block
+            end = block.rfind(b'\n') + 1
+            if end:
+                rows = block[:end - 1].decode('utf-8', 'replace').split('\n')
+                _aggregate_rows(rows, self.totals, self._parse_row)
+                lines += len(rows)
+                offset += end
+            tail = block[end:]
+        return offset, lines
+
+    def close(self):
+        """Close the followed files."""
+        with self._lock:
+            for f, _ in self._files.values():
+                f.close()
+            self._files.clear()
+
+    def snapshot(self):
+        """
+        Return the current aggregate.
+
+        Returns:
+            pd.DataFrame: DataFrame with columns ['Entity', 'Volume'] in the
+                         same format as process_data.
+        """
+        with self._lock:
+            totals = dict(self.totals)
+        return _totals_to_frame(totals)
+
+
+# Directories the web interface may follow, separated by os.pathsep
+_FOLLOW_DIRS_ENV = 'METRIC_ANALYSIS_FOLLOW_DIRS'
+
+# Selectbox entry for leaving an operator-configured option off
+_NOT_SELECTED = '(none)'
+
+
+def _configured_paths(env):
+    """Return the server paths an operator listed in an environment variable."""
+    return [path for path in os.environ.get(env, '').split(os.pathsep) if path]
+
+
+@st.cache_resource
+def _shared_follower(directory, pattern):
+    """Return the server-wide follower for a directory and pattern."""
+    return DirectoryFollower(directory, pattern)
+
+
+class _AggregateShard:
+    """One lock-protected partition of a SharedAggregate."""
+
+    __slots__ = ('lock', 'totals', 'previous', 'epoch', 'frozen')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+        # Totals as of the end of the previous epoch, kept for a pending view
+        self.previous = None
+        # Epoch of the last contribution written to totals
+        self.epoch = 0
+        # Dictionary last handed to a view; writers copy it before modifying
+        self.frozen = None
+
+    def writable(self, name):
+        """Return the totals or previous dictionary, copied first if a view holds it."""
+        totals = getattr(self, name)
+        if totals is self.frozen:
+            totals = dict(totals)
+            setattr(self, name, totals)
+        return totals
+
+
+class AggregateView:
+    """
+    Read-only, consistent snapshot of a SharedAggregate.
+
+    A view holds references to the shard dictionaries as they were when the
+    snapshot was taken. Writers copy a shard before modifying it once it is
+    referenced by a view, so taking a view never copies the table and later
+    contributions never change it.
+    """
+
+    def __init__(self, shards, contributions):
+        self._shards = shards
+        self.contributions = contributions
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def get(self, entity, default=0):
+        """Return the volume of an entity in this snapshot."""
+        for shard in self._shards:
+            if entity in shard:
+                return shard[entity]
+        return default
+
+    def to_frame(self):
+        """
+        Return the snapshot as a result.
+
+        Returns:
+            pd.DataFrame: DataFrame with columns ['Entity', 'Volume'] in the
+                         same format as process_data.
+        """
+        totals = {}
+        for shard in self._shards:
+            totals.update(shard)
+        return _totals_to_frame(totals)
+
+
+class SharedAggregate:
+    """
+    Per-entity totals shared by concurrent contributors.
+
+    Entities are partitioned over independently locked shards. A contribution
+    is partitioned before any lock is taken and then applied one shard at a
+    time, holding only that shard's lock, so concurrent contributions only
+    wait for each other on the shard they are both updating.
+
+    Views are kept consistent with epochs instead of locking the shards
+    together. Every contribution belongs to the epoch current when it
+    starts. A view closes the epoch, waits for the contributions of the
+    closed epoch that are still in flight, and then reads each shard as it
+    was before its first write of the new epoch: the first such write keeps
+    the old dictionary aside for the view and continues on a copy. Shards
+    are only copied when a writer changes them after a view, and a view is
+    reused while nothing has been contributed since.
 
     Args:
-        data (str): Input text with entities separated by pipes (|) or newlines.
-                   Optional volume can be specified as the last number on a line.
-                   Format: "Entity A|Entity B|Entity C 5" where 5 is the volume
-                   for all entities on that line.
+        num_shards (int): Number of partitions.
+
+    Examples:
+        >>> shared = SharedAggregate()
+        >>> shared.contribute(process_data("Entity A|Entity B 5"))
+        >>> shared.view().to_frame()
+        # Returns the combined result of all contributions so far
+    """
+
+    def __init__(self, num_shards=16):
+        self._shards = [_AggregateShard() for _ in range(num_shards)]
+        # Guards the epoch and the counters below; held only to register a
+        # contribution, never while one is applied
+        self._epochs = threading.Condition()
+        self._epoch = 0
+        self._active = collections.Counter()
+        self._contributions = 0
+        # Views are taken one at a time; the last one is reused while unchanged
+        self._view_lock = threading.Lock()
+        self._view = None
+
+    def _shard_index(self, entity):
+        return hash(entity) % len(self._shards)
+
+    def contribute(self, df):
+        """
+        Add a result's volumes to the shared totals.
+
+        Args:
+            df (pd.DataFrame): Result of process_data with columns ['Entity', 'Volume'].
+        """
+        parts = {}
+        for entity, volume in zip(df['Entity'], df['Volume'].tolist()):
+            parts.setdefault(self._shard_index(entity), []).append((entity, volume))
+
+        with self._epochs:
+            epoch = self._epoch
+            self._active[epoch] += 1
+            self._contributions += 1
+        try:
+            for index, items in parts.items():
+                shard = self._shards[index]
+                with shard.lock:
+                    if shard.epoch < epoch:
+                        # First write since a view closed the epoch: the view
+                        # reads the old totals, this epoch continues on a copy
+                        shard.previous = shard.totals
+                        shard.totals = dict(shard.totals)
+                        shard.epoch = epoch
+                    names = ['totals']
+                    if shard.epoch > epoch:
+                        # A newer epoch forked this shard; the pending view
+                        # also needs this older contribution
+                        names.append('previous')
+                    for name in names:
+                        totals = shard.writable(name)
+                        get = totals.get
+                        for entity, volume in items:
+                            totals[entity] = get(entity, 0) + volume
+        finally:
+            with self._epochs:
+                self._active[epoch] -= 1
+                if not self._active[epoch]:
+                    del self._active[epoch]
+                    self._epochs.notify_all()
+
+    def view(self):
+        """
+        Take a consistent snapshot of the current totals.
+
+        Returns:
+            AggregateView: Snapshot unaffected by later contributions.
+        """
+        with self._view_lock:
+            with self._epochs:
+                if self._view is not None and self._view.contributions == self._contributions:
+                    return self._view
+                closed = self._epoch
+                self._epoch += 1
+                contributions = self._contributions
+                # Contributions of the closed epoch must be complete in the view
+                while self._active[closed]:
+                    self._epochs.wait()
+
+            shards = []
+            for shard in self._shards:
+                with shard.lock:
+                    totals = shard.totals if shard.epoch <= closed else shard.previous
+                    shard.previous = None
+                    shard.frozen = totals
+                shards.append(totals)
+            self._view = AggregateView(shards, contributions)
+            return self._view
+
+
+@st.cache_resource
+def _shared_aggregate():
+    """Return the aggregate shared by all sessions of this server process."""
+    return SharedAggregate()
+
+
+def iter_process_chunks(rows, totals, start=0, chunk_lines=20000, grammar=DEFAULT_GRAMMAR,
+                        provenance=None):
+    """
+    Aggregate rows into totals in chunks, yielding after each chunk.
+
+    This lets callers report progress, show partial results or stop between
+    chunks. Aggregating all chunks gives the same totals as processing the
+    rows in one go.
+
+    Args:
+        rows (list): Input rows without trailing newlines.
+        totals (dict): Mapping of entity name to summed volume, updated in place.
+        start (int): Index of the first row to process, to resume earlier work.
+        chunk_lines (int): Number of rows per chunk.
+        grammar (Grammar): Entity separator and volume placement of the rows.
+        provenance (ProvenanceIndex, optional): Index recording the row
+                                                numbers each entity came from.
+
+    Yields:
+        int: Index of the next unprocessed row after each chunk.
+
+    Examples:
+        >>> rows = data.split('\\n')
+        >>> totals = {}
+        >>> for position in iter_process_chunks(rows, totals):
+        ...     print(f'{position / len(rows):.0%} done')
+    """
+    parse_row = compile_parser(grammar)
+    for position in range(start, len(rows), chunk_lines):
+        end = min(position + chunk_lines, len(rows))
+        if provenance is None:
+            _aggregate_rows(rows[position:end], totals, parse_row)
+        else:
+            provenance.aggregate(rows[position:end], position, totals, parse_row)
+        yield end
+
+
+def _top_entities(totals, n=10):
+    """Return the n highest-volume entities of partial totals as a DataFrame."""
+    top = heapq.nlargest(n, totals.items(), key=lambda item: item[1])
+    return pd.DataFrame(top, columns=['Entity', 'Volume'])
+
+
+# Characters of text split at once when iterating over _TextRows
+_ROW_BLOCK_CHARS = 1 << 20
+
+
+class _TextRows:
+    """
+    Rows of a text, split one slice at a time instead of all at once.
+
+    Supports len() and contiguous slicing as used by iter_process_chunks,
+    and iteration as used by reservoir_sample. Sequential slices continue
+    from the previous one, so a full pass scans the text once while only one
+    chunk of rows exists at a time; iteration splits _ROW_BLOCK_CHARS
+    characters at a time at C speed.
+    """
+
+    def __init__(self, data, separator):
+        self._data = data
+        self._separator = separator
+        self._len = data.count(separator) + 1
+        # Row index and character offset where the previous slice ended
+        self._row = 0
+        self._offset = 0
+
+    def __len__(self):
+        return self._len
+
+    def _seek(self, row):
+        """Return the character offset of a row, scanning forward from the cursor."""
+        if row < self._row:
+            self._row, self._offset = 0, 0
+        find = self._data.find
+        separator = self._separator
+        offset = self._offset
+        for _ in range(row - self._row):
+            offset = find(separator, offset) + len(separator)
+        self._row, self._offset = row, offset
+        return offset
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(self._len)
+        if step != 1 or start >= stop:
+            raise ValueError('Only contiguous, non-empty slices are supported')
+        begin = self._seek(start)
+        if stop == self._len:
+            return self._data[begin:].split(self._separator)
+        end = self._seek(stop)
+        return self._data[begin:end - len(self._separator)].split(self._separator)
+
+    def __iter__(self):
+        """Yield the rows in order, splitting a block of characters at a time."""
+        data, separator = self._data, self._separator
+        start = 0
+        while True:
+            block = data[start:start + _ROW_BLOCK_CHARS]
+            if start + len(block) >= len(data):
+                yield from block.split(separator)
+                return
+            rows = block.split(separator)
+            if len(rows) == 1:
+                # A row longer than the block ends at the next separator
+                end = data.find(separator, start)
+                if end < 0:
+                    yield data[start:]
+                    return
+                yield data[start:end]
+                start = end + len(separator)
+                continue
+            # The last part may continue past the block; it starts the next one
+            partial = rows.pop()
+            yield from rows
+            start += len(block) - len(partial)
+
+
+# Workload predicted by estimate_workload; memory in bytes, time in seconds
+WorkloadEstimate = collections.namedtuple(
+    'WorkloadEstimate', ['bytes', 'lines', 'entities', 'memory', 'bounded_memory', 'seconds'])
+
+# Approximate CPython costs, calibrated with tracemalloc on process_data:
+# bytes per row string in the split list, per (name, volume) pair with its
+# name string and DataFrame cells, and per entity in a dict of totals
+_ROW_OVERHEAD = 57
+_PAIR_OVERHEAD = 185
+_ENTITY_OVERHEAD = 300
+
+# Rows held at once by the chunked job (the iter_process_chunks default)
+_JOB_CHUNK_LINES = 20000
+
+# Approximate processing time per name occurrence, distinct entity and character
+_SECONDS_PER_OCCURRENCE = 1.2e-6
+_SECONDS_PER_ENTITY = 2.5e-6
+_SECONDS_PER_CHARACTER = 1.5e-8
+
+
+def estimate_workload(data, grammar=DEFAULT_GRAMMAR, sample_lines=2000, seed=0):
+    """
+    Predict the memory and time process_data needs for an input, cheaply.
+
+    The size and line count come from one C-level scan. When there are more
+    lines than sample_lines, lines are sampled at random character offsets
+    (which favours long lines, corrected by weighting each by its inverse
+    length) and only those are parsed, giving the average number and length
+    of names per line. The number of distinct entities is extrapolated from
+    the sample with the Chao1 estimator, which adds f1^2 / 2f2 unseen names
+    for f1 names seen once and f2 seen twice; it errs on the low side for
+    very skewed inputs, where few entities make the bounded mode cheap anyway.
+
+    Args:
+        data (str): Input text in the process_data format.
+        grammar (Grammar): Separators and volume placement of the input.
+        sample_lines (int): Number of lines parsed for the estimate.
+        seed (int): Seed of the line sample.
 
     Returns:
-        pd.DataFrame: DataFrame with columns ['Entity', 'Volume'], sorted by
-                     volume in descending order. Duplicate entities are aggregated
-                     with their volumes summed.
+        WorkloadEstimate: Input 'bytes' (UTF-8) and 'lines', estimated
+        distinct 'entities', peak additional 'memory' of process_data,
+        'bounded_memory' of the chunked bounded-memory mode and 'seconds'.
+        Memory and time are rough, machine-dependent predictions.
 
     Examples:
-        >>> process_data("Entity A|Entity B 5")
-        # Returns DataFrame with Entity A and Entity B, both with volume 5
+        >>> estimate = estimate_workload(pasted_text)
+        >>> estimate.memory / 2 ** 20    # MiB process_data would allocate
+    """
+    separator = grammar.row_separator
+    parse_row = compile_parser(grammar)
+    lines = data.count(separator) + 1
 
-        >>> process_data("Entity A\\nEntity A 3")
-        # Returns DataFrame with Entity A having volume 4 (1 + 3)
+    if lines <= sample_lines:
+        rows = data.split(separator)
+        weights = [1.0] * len(rows)
+    else:
+        rng = random.Random(seed)
+        rows = []
+        weights = []
+        for _ in range(sample_lines):
+            offset = rng.randrange(len(data))
+            start = data.rfind(separator, 0, offset)
+            start = 0 if start < 0 else start + len(separator)
+            end = data.find(separator, offset)
+            end = len(data) if end < 0 else end
+            rows.append(data[start:end])
+            weights.append(1.0 / (end - start + len(separator)))
+
+    names = []
+    weight_sum = weighted_names = weighted_chars = 0.0
+    for row, weight in zip(rows, weights):
+        row_names = parse_row(row)[0]
+        names.extend(row_names)
+        weight_sum += weight
+        weighted_names += weight * len(row_names)
+        weighted_chars += weight * sum(map(len, row_names))
+
+    names_per_line = weighted_names / weight_sum
+    name_length = weighted_chars / weighted_names if weighted_names else 0.0
+    occurrences = lines * names_per_line
+    counts = collections.Counter(names)
+    if lines <= sample_lines:
+        entities = len(counts)
+    elif names:
+        singletons = sum(1 for count in counts.values() if count == 1)
+        doubletons = sum(1 for count in counts.values() if count == 2)
+        entities = len(counts) + singletons * (singletons - 1) / (2 * (doubletons + 1))
+        entities = round(min(entities, occurrences))
+    else:
+        entities = 0
+
+    line_length = len(data) / lines
+    memory = lines * _ROW_OVERHEAD + len(data) + occurrences * (_PAIR_OVERHEAD + name_length)
+    bounded_memory = (entities * (_ENTITY_OVERHEAD + name_length)
+                      + min(lines, _JOB_CHUNK_LINES) * (_ROW_OVERHEAD + line_length))
+    seconds = (occurrences * _SECONDS_PER_OCCURRENCE + entities * _SECONDS_PER_ENTITY
+               + len(data) * _SECONDS_PER_CHARACTER)
+    return WorkloadEstimate(_text_bytes(data), lines, entities, round(memory),
+                            round(bounded_memory), seconds)
+
+
+class Admission:
     """
-    # Split the data into rows
-    rows = data.split('\n')
+    Memory reserved for one job by an AdmissionController.
 
-    # Create a list to store the processed data
-    processed_data = []
+    Attributes:
+        mode (str): 'run' for an in-memory run, 'bounded' for the
+                    bounded-memory mode, which also holds a heavy-job slot.
+        reserved (int): Bytes reserved from the budget.
 
-    # Process each row
-    for row in rows:
-        # Skip empty rows
-        if not row.strip():
-            continue
+    Use as a context manager, or call release() when the job ends.
+    """
 
-        # Split the row into entities
-        metrics = row.split('|')
+    def __init__(self, controller, mode, reserved):
+        self._controller = controller
+        self.mode = mode
+        self.reserved = reserved
 
-        # Check if the last part of the row contains a volume number
-        # Input validation to prevent crashes on malformed data
-        try:
-            last_part = metrics[-1].strip().split()
-            if len(last_part) > 1 and last_part[-1].isdigit():
-                volume = int(last_part[-1])
-                metrics[-1] = ' '.join(last_part[:-1])
-            else:
-                volume = 1
-        except (IndexError, ValueError):
-            # If parsing fails, default to volume of 1
-            volume = 1
+    def release(self):
+        """Return the reservation to the controller; calling it again has no effect."""
+        if self._controller is not None:
+            self._controller._release(self)
+            self._controller = None
 
-        # Process each entity
-        for metric in metrics:
-            name = metric.strip()
+    def __enter__(self):
+        return self
 
-            # Add the entity and volume to the processed data if the name is not blank
-            if name:
-                processed_data.append((name, volume))
+    def __exit__(self, *exc_info):
+        self.release()
 
-    # Create a DataFrame from the processed data
-    df = pd.DataFrame(processed_data, columns=['Entity', 'Volume'])
 
-    # Group the DataFrame by entity and sum the volumes
-    df = df.groupby('Entity').sum().reset_index()
+class AdmissionController:
+    """
+    Server-wide memory budget and limit on simultaneous heavy jobs.
 
-    # Sort the DataFrame by volume in descending order
-    df = df.sort_values('Volume', ascending=False)
+    plan() maps a WorkloadEstimate to 'run' when process_data's predicted
+    memory is small, 'bounded' when the bounded-memory mode fits the
+    budget, and 'reject' otherwise. admit() then reserves the memory of the
+    planned mode, waiting while the budget or the heavy-job slots are used
+    up by other jobs. A job that fits the budget on its own is admitted at
+    the latest once nothing else is running.
+
+    Args:
+        memory_budget (int): Bytes all admitted jobs may use together.
+        max_heavy_jobs (int): Number of bounded-memory jobs run at once.
+        heavy_memory (int, optional): Predicted process_data memory above
+                                      which a job is heavy; an eighth of
+                                      the budget by default.
+
+    Examples:
+        >>> controller = AdmissionController(2 << 30, max_heavy_jobs=2)
+        >>> estimate = estimate_workload(data)
+        >>> if controller.plan(estimate) != 'reject':
+        ...     with controller.admit(estimate) as admission:
+        ...         run(data, bounded=admission.mode == 'bounded')
+    """
+
+    def __init__(self, memory_budget, max_heavy_jobs=2, heavy_memory=None):
+        self.memory_budget = memory_budget
+        self.max_heavy_jobs = max_heavy_jobs
+        self.heavy_memory = memory_budget // 8 if heavy_memory is None else heavy_memory
+        self._condition = threading.Condition()
+        self.reserved = 0
+        self.heavy_jobs = 0
+
+    def plan(self, estimate):
+        """
+        Choose how a job should run, ignoring the current load.
+
+        Returns:
+            str: 'run', 'bounded' or 'reject'.
+        """
+        if estimate.memory <= min(self.heavy_memory, self.memory_budget):
+            return 'run'
+        if estimate.bounded_memory <= self.memory_budget:
+            return 'bounded'
+        return 'reject'
+
+    def _fits(self, mode, reserved):
+        if mode == 'bounded' and self.heavy_jobs >= self.max_heavy_jobs:
+            return False
+        return self.reserved + reserved <= self.memory_budget
+
+    def admit(self, estimate, timeout=None):
+        """
+        Reserve memory for a job, waiting for capacity if necessary.
+
+        Args:
+            estimate (WorkloadEstimate): Prediction for the job.
+            timeout (float, optional): Seconds to wait; None waits as long
+                                       as needed and 0 does not wait.
+
+        Returns:
+            Admission or None: The reservation, or None if capacity did not
+                               free up within the timeout.
 
+        Raises:
+            ValueError: If the job can never fit the budget.
+        """
+        mode = self.plan(estimate)
+        if mode == 'reject':
+            raise ValueError('The job does not fit the memory budget')
+        reserved = estimate.memory if mode == 'run' else estimate.bounded_memory
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._fits(mode, reserved), timeout):
+                return None
+            self.reserved += reserved
+            if mode == 'bounded':
+                self.heavy_jobs += 1
+        return Admission(self, mode, reserved)
+
+    def _release(self, admission):
+        with self._condition:
+            self.reserved -= admission.reserved
+            if admission.mode == 'bounded':
+                self.heavy_jobs -= 1
+            self._condition.notify_all()
+
+
+def _open_uniform(rng):
+    """Draw from the open interval (0, 1), as the skip formulas need."""
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+
+def reservoir_sample(items, k, rng=None):
+    """
+    Draw a uniform random sample of k items in one pass over an iterable.
+
+    Uses Algorithm L, which computes how many items to skip between
+    replacements, so the items that are not sampled are only counted (with
+    itertools, without Python-level work per item).
+
+    Args:
+        items (iterable): Items to sample, such as input rows.
+        k (int): Sample size.
+        rng (random.Random, optional): Source of randomness.
+
+    Returns:
+        tuple: (sample, count) where sample is a list of min(k, count) items
+               and count is the number of items seen.
+    """
+    rng = rng or random.Random()
+    numbered = enumerate(items, start=1)
+    reservoir = [item for _, item in itertools.islice(numbered, k)]
+    count = len(reservoir)
+    if count < k or k == 0:
+        return reservoir, count
+
+    w = math.exp(math.log(_open_uniform(rng)) / k)
+    while True:
+        skip = int(math.log(_open_uniform(rng)) / math.log1p(-w))
+        # Consume the skipped items at C speed, remembering only the last one
+        skipped = collections.deque(itertools.islice(numbered, skip), maxlen=1)
+        if skipped:
+            count = skipped[0][0]
+        following = next(numbered, None)
+        if following is None:
+            return reservoir, count
+        count, item = following
+        reservoir[rng.randrange(k)] = item
+        w *= math.exp(math.log(_open_uniform(rng)) / k)
+
+
+def preview_rows(rows, sample_size=10000, grammar=DEFAULT_GRAMMAR, confidence=0.95, seed=None):
+    """
+    Estimate the ranking from a random sample of rows.
+
+    Rows are reservoir-sampled in a single pass and only the sample is
+    parsed. Each entity's total is estimated as N/k times its volume in the
+    sample of k out of N rows, with a normal-approximation confidence
+    interval that accounts for sampling without replacement (it collapses
+    to the exact value when every row is sampled). Rank intervals follow
+    from the volume intervals: an entity ranks no better than one plus the
+    number of entities that are certainly larger, and no worse than the
+    number of entities that may be at least as large.
+
+    Args:
+        rows (iterable): Input rows without trailing newlines.
+        sample_size (int): Number of rows to sample.
+        grammar (Grammar): Entity separator and volume placement of the rows.
+        confidence (float): Confidence level of the intervals.
+        seed (int, optional): Seed for a reproducible sample.
+
+    Returns:
+        pd.DataFrame: Columns ['Entity', 'Volume', 'Low', 'High', 'Best rank',
+                     'Worst rank'] for the entities seen in the sample,
+                     sorted by estimated volume. df.attrs holds the number
+                     of 'sampled' and 'total' rows.
+
+    Examples:
+        >>> preview_rows(data.split('\\n'), sample_size=5000).head(10)
+        # Estimated top ten with 95% intervals, in a fraction of the time
+    """
+    parse_row = compile_parser(grammar)
+    sample, total = reservoir_sample(rows, sample_size, random.Random(seed))
+    k = len(sample)
+
+    # Per entity: sum and sum of squares of its volume per sampled row
+    sums = {}
+    squares = {}
+    for row in sample:
+        names, volume = parse_row(row)
+        row_volumes = {}
+        for name in names:
+            row_volumes[name] = row_volumes.get(name, 0) + volume
+        for name, value in row_volumes.items():
+            sums[name] = sums.get(name, 0) + value
+            squares[name] = squares.get(name, 0) + value * value
+
+    names = list(sums)
+    s1 = np.array([sums[name] for name in names], dtype=np.float64)
+    s2 = np.array([squares[name] for name in names], dtype=np.float64)
+    scale = total / k if k else 0.0
+    estimate = s1 * scale
+    if 1 < k < total:
+        variance = np.maximum(s2 - s1 * s1 / k, 0) / (k - 1)
+        z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        margin = z * total * np.sqrt((1 - k / total) * variance / k)
+    else:
+        margin = np.zeros(len(names))
+    # The total can never be below what the sample already contains
+    low = np.maximum(estimate - margin, s1)
+    high = estimate + margin
+
+    sorted_low = np.sort(low)
+    sorted_high = np.sort(high)
+    best = 1 + len(names) - np.searchsorted(sorted_low, high, side='right')
+    worst = len(names) - np.searchsorted(sorted_high, low, side='left')
+
+    df = pd.DataFrame({'Entity': names, 'Volume': estimate, 'Low': low, 'High': high,
+                       'Best rank': best, 'Worst rank': worst})
+    df = df.sort_values('Volume', ascending=False, kind='stable').reset_index(drop=True)
+    df.attrs['sampled'] = k
+    df.attrs['total'] = total
     return df
 
+
+def top_entities_with_other(df, n=20):
+    """
+    Reduce a ranking to its top n entities plus one bucket for the rest.
+
+    Args:
+        df (pd.DataFrame): Result of process_data, sorted by volume.
+        n (int): Number of entities kept individually.
+
+    Returns:
+        pd.DataFrame: At most n + 1 rows with columns ['Entity', 'Volume'];
+                     the last row, labelled "Other (k entities)", sums the
+                     volumes of the remaining k entities.
+
+    Examples:
+        >>> top_entities_with_other(process_data(data), n=10)
+        # Returns the ten largest entities and an "Other" row
+    """
+    top = df[['Entity', 'Volume']].head(n).reset_index(drop=True)
+    rest = df['Volume'].iloc[n:]
+    if len(rest):
+        other = pd.DataFrame({'Entity': [f'Other ({len(rest)} entities)'], 'Volume': [rest.sum()]})
+        top = pd.concat([top, other], ignore_index=True)
+    return top
+
+
+def cumulative_share(df, max_points=200):
+    """
+    Compute the share of the total volume covered by the top-ranked entities.
+
+    The curve is decimated to at most max_points ranks, spaced geometrically
+    so the steep head of a long-tailed ranking keeps its detail. The first
+    and last ranks are always included, so the curve ends at a share of 1.
+
+    Args:
+        df (pd.DataFrame): Result of process_data, sorted by volume.
+        max_points (int): Maximum number of points returned.
+
+    Returns:
+        pd.DataFrame: Columns ['Entities', 'Share'], where Share is the
+                     fraction of the total volume held by the first
+                     Entities entities.
+    """
+    if df.empty:
+        return pd.DataFrame({'Entities': pd.Series([], dtype=np.int64),
+                             'Share': pd.Series([], dtype=np.float64)})
+    cumulative = np.cumsum(df['Volume'].to_numpy(dtype=np.float64))
+    total = cumulative[-1]
+    ranks = np.unique(np.geomspace(1, len(df), max_points).round().astype(np.int64))
+    shares = cumulative[ranks - 1] / total if total else np.zeros(len(ranks))
+    return pd.DataFrame({'Entities': ranks, 'Share': shares})
+
+
+def volume_histogram(df, bins=30):
+    """
+    Count entities per volume range.
+
+    Bins are logarithmic when the positive volumes span at least two orders
+    of magnitude, as ranked volumes usually do, and linear otherwise.
+
+    Args:
+        df (pd.DataFrame): Result of process_data.
+        bins (int): Maximum number of bins.
+
+    Returns:
+        pd.DataFrame: One row per non-empty bin, in ascending order, with
+                     columns ['Volume', 'Entities'] where Volume labels the
+                     bin range.
+    """
+    volumes = df['Volume'].to_numpy(dtype=np.float64)
+    if not len(volumes):
+        return pd.DataFrame({'Volume': pd.Series([], dtype=object),
+                             'Entities': pd.Series([], dtype=np.int64)})
+    low, high = volumes.min(), volumes.max()
+    if low > 0 and high / low >= 100:
+        edges = np.unique(np.geomspace(low, high, bins + 1))
+    elif low == high:
+        edges = np.array([low, high + 1])
+    else:
+        edges = np.linspace(low, high, bins + 1)
+    counts, edges = np.histogram(volumes, bins=edges)
+
+    nonempty = counts > 0
+    labels = [f'{lo:.4g}–{hi:.4g}' for lo, hi in zip(edges[:-1], edges[1:])]
+    return pd.DataFrame({
+        'Volume': np.array(labels, dtype=object)[nonempty],
+        'Entities': counts[nonempty],
+    })
+
+
+# Size limits of the charts shown in the web interface
+_CHART_TOP_N = 20
+_CHART_POINTS = 200
+_CHART_BINS = 30
+
+
+def _show_charts(df):
+    """Chart a result from its downsampled summaries, so the payload stays small."""
+    top = top_entities_with_other(df, _CHART_TOP_N)
+    st.altair_chart(
+        alt.Chart(top, title='Top entities').mark_bar().encode(
+            x=alt.X('Volume:Q'), y=alt.Y('Entity:N', sort=None, title=None)),
+        use_container_width=True)
+
+    share = cumulative_share(df, _CHART_POINTS)
+    st.altair_chart(
+        alt.Chart(share, title='Cumulative share of volume').mark_line().encode(
+            x=alt.X('Entities:Q', scale=alt.Scale(type='log'), title='Top entities'),
+            y=alt.Y('Share:Q', axis=alt.Axis(format='%'))),
+        use_container_width=True)
+
+    histogram = volume_histogram(df, _CHART_BINS)
+    st.altair_chart(
+        alt.Chart(histogram, title='Entities by volume').mark_bar().encode(
+            x=alt.X('Volume:N', sort=None), y=alt.Y('Entities:Q')),
+        use_container_width=True)
+
+
+def _run_job(job):
+    """
+    Advance a chunked processing job stored in the session state.
+
+    Progress is kept in the job after every chunk, so a rerun that interrupts
+    this one (another click, a widget change) resumes where it stopped. While
+    the job runs, a progress bar, a cancel button and a live top-N preview
+    are shown.
+
+    Args:
+        job (dict): Job with the input 'data', its 'grammar', the next row
+                    'position', partial 'totals' and optional 'provenance'
+                    index. Jobs flagged 'bounded' split the input one chunk
+                    at a time instead of keeping a list of all rows.
+
+    Returns:
+        pd.DataFrame or None: The final result, or None if the job was cancelled.
+    """
+    grammar = job['grammar']
+    if job.get('bounded'):
+        rows = _TextRows(job['data'], grammar.row_separator)
+    else:
+        rows = job['data'].split(grammar.row_separator)
+    status = st.container()
+    if status.button('Cancel'):
+        return None
+
+    progress = status.progress(job['position'] / max(len(rows), 1), text='Processing...')
+    preview = status.empty()
+
+    for position in iter_process_chunks(rows, job['totals'], job['position'], grammar=grammar,
+                                        provenance=job.get('provenance')):
+        job['position'] = position
+        progress.progress(position / len(rows), text=f'Processed {position} of {len(rows)} lines')
+        preview.dataframe(_top_entities(job['totals']))
+
+    progress.empty()
+    preview.empty()
+    return _totals_to_frame(job['totals'])
+
+
+# Sidebar choices for the input grammar, mapped to Grammar field values
+_ROW_SEPARATORS = {'Newline': '\n', 'Semicolon (;)': ';', 'Comma (,)': ','}
+_VOLUME_POSITIONS = {
+    'Last number on the line': 'last',
+    'First number on the line': 'first',
+    'No volume': 'none',
+}
+
+
+# Shown when volume sums left the int64 range and exact integers were used
+_OVERFLOW_NOTICE = ('Some volume totals exceed the 64-bit integer range, so exact '
+                    '(slower) integer arithmetic was used.')
+
+
+def _sidebar_grammar():
+    """Read the input grammar from the sidebar settings."""
+    row_separator = st.sidebar.selectbox('Row separator:', list(_ROW_SEPARATORS))
+    entity_separator = st.sidebar.text_input('Entity separator:', value='|')
+    volume = st.sidebar.selectbox('Volume position:', list(_VOLUME_POSITIONS))
+    volume_prefix = st.sidebar.text_input('Volume prefix:', value='')
+    decimal = st.sidebar.checkbox('Decimal volumes')
+    include = st.sidebar.text_area('Include entities (one rule per line):')
+    exclude = st.sidebar.text_area('Exclude entities (one rule per line):')
+    filters = EntityFilter(parse_filter_rules(include), parse_filter_rules(exclude))
+    grammar = Grammar(_ROW_SEPARATORS[row_separator], entity_separator or '|',
+                      _VOLUME_POSITIONS[volume], volume_prefix,
+                      'decimal' if decimal else 'integer',
+                      filters if filters.include or filters.exclude else None)
+    try:
+        compile_parser(grammar)
+    except ValueError as e:
+        st.sidebar.error(f'Filter rules ignored: {e}')
+        grammar = grammar._replace(filters=None)
+    return grammar
+
+
+# Sidebar choices for profiling, mapped to Profiler modes
+_PROFILER_CHOICES = {
+    'Sampling (hot lines, low overhead)': 'sampling',
+    'Deterministic (exact call counts)': 'deterministic',
+}
+
+
+def _profiled(mode):
+    """Profile the enclosed processing into the session, if a profiler mode is chosen."""
+    if mode is None:
+        return contextlib.nullcontext()
+    profiler = Profiler(mode)
+    st.session_state['profile'] = profiler
+    return profiler
+
+
+def _show_profile(profiler):
+    """Show the summary of a profile and offer the raw profile as a download."""
+    st.caption(f'{profiler.mode.capitalize()} profile of {profiler.elapsed:.2f} s of processing. '
+               'Only code locations are recorded, not the input.')
+    st.dataframe(profiler.functions())
+    if profiler.mode == 'sampling':
+        st.caption(f'Hot lines ({profiler.samples} samples)')
+        st.dataframe(profiler.lines())
+    st.download_button(label='Download profile', data=profiler.dump(),
+                       file_name=profiler.file_name, mime='application/octet-stream')
+
+
+# Environment variables and defaults of the server-wide admission control;
+# the budget is in MiB
+_MEMORY_BUDGET_ENV = 'METRIC_ANALYSIS_MEMORY_BUDGET'
+_MAX_HEAVY_JOBS_ENV = 'METRIC_ANALYSIS_MAX_HEAVY_JOBS'
+_DEFAULT_MEMORY_BUDGET = 2048
+_DEFAULT_MAX_HEAVY_JOBS = 2
+
+# Seconds a job waits for memory or a heavy-job slot before it is queued
+_ADMISSION_WAIT = 10
+
+
+@st.cache_resource
+def _admission_controller(memory_budget, max_heavy_jobs):
+    """Return the admission controller shared by all sessions."""
+    return AdmissionController(memory_budget, max_heavy_jobs)
+
+
+def _admit_job(job, admissions):
+    """Reserve server memory for a job, or return None if it has to keep waiting."""
+    estimate = job.get('estimate')
+    if estimate is None:
+        return contextlib.nullcontext()
+    admission = admissions.admit(estimate, timeout=0)
+    if admission is None:
+        with st.spinner('Waiting for other large inputs to finish...'):
+            admission = admissions.admit(estimate, timeout=_ADMISSION_WAIT)
+    return admission
+
+
+# Environment variable naming the port of the metrics endpoint
+_METRICS_PORT_ENV = 'METRIC_ANALYSIS_METRICS_PORT'
+
+
+@st.cache_resource
+def _metrics_server(port):
+    """Start the metrics endpoint once per server process."""
+    return serve_metrics(port)
+
+
+# Number of lines sampled for a quick preview of the ranking
+_PREVIEW_SAMPLE = 10000
+
+# Maximum number of source lines shown for one entity
+_DRILL_DOWN_LIMIT = 1000
+
+
+def _show_preview(preview):
+    """Show an estimated ranking; returns True when the full run is requested."""
+    st.subheader('Estimated ranking from a sample:')
+    sampled, total = preview.attrs['sampled'], preview.attrs['total']
+    st.caption(f'Estimated from {sampled} of {total} lines, with 95% confidence intervals '
+               'on volumes and ranks.')
+    st.dataframe(preview)
+    return st.container().button('Run full processing')
+
+
+def _show_source_lines(provenance, data, separator):
+    """Show the input lines an entity came from, looked up in the provenance index."""
+    name = st.text_input('Show source lines of entity:')
+    if not name:
+        return
+    if name not in provenance:
+        st.caption(f'No entity named {name!r}.')
+        return
+
+    count = provenance.count(name)
+    lines = provenance.lines(name, limit=_DRILL_DOWN_LIMIT)
+    shown = f', showing the first {len(lines)}' if count > len(lines) else ''
+    st.caption(f'{count} lines mention {name}{shown}.')
+    st.dataframe(pd.DataFrame({'Line': lines + 1, 'Text': _source_lines(data, separator, lines)}))
+
+
+def _store_result(df, merge_duplicates, contribute_shared, mapping=None):
+    """Apply the optional post-processing steps and keep the result in the session."""
+    if df.attrs.get('volume_overflow'):
+        st.warning(_OVERFLOW_NOTICE)
+
+    # Fold case, spacing and typo variants into one entity if requested
+    if merge_duplicates:
+        merges = find_near_duplicates(df)
+        df = canonicalize_entities(df, merges)
+        st.caption(f'Merged {len(merges)} near-duplicate entities.')
+
+    # Add the mapped attributes of each entity as columns
+    if mapping is not None:
+        df = mapping.enrich(df)
+
+    # Keep the result and its search index across reruns triggered by searching
+    st.session_state['result'] = (df, EntitySearchIndex(df))
+
+    # Add this session's result to the server-wide aggregate if opted in
+    if contribute_shared:
+        _shared_aggregate().contribute(df)
+
+
 def main():
     """
     Main Streamlit application for the Metric Entity Volume Analyser.
@@ -90,10 +4644,40 @@ def main():
     4. Download the results as a CSV file
 
     The interface includes:
-    - Text area for data input
-    - Process button to trigger data processing
-    - DataFrame preview of results
+    - Text area for data input, or a file upload (text, JSON Lines, CSV/TSV, Excel),
+      optionally gzip/bz2/xz/zstd compressed
+    - Sidebar settings for the row and entity separators, volume placement and
+      decimal volumes, with a warning when sums needed exact integers
+    - Sidebar option to merge near-duplicate entity names
+    - Sidebar include/exclude rules (exact names, prefixes, substrings,
+      regular expressions) applied while parsing
+    - Process button to trigger data processing, processed in chunks with a
+      progress bar, live top-N preview and cancel button
+    - Sidebar preview button estimating the ranking from a random sample of the pasted
+      lines, with confidence intervals and a button to run the exact processing
+    - DataFrame preview of results with an indexed entity search box
+    - Optional drill-down from an entity to its source lines, using a compact
+      provenance index built while parsing
     - CSV download button
+    - Charts (top entities with an "Other" bucket, cumulative share, volume
+      histogram) computed from downsampled summaries of the result
+    - Optional contribution to an aggregate shared across sessions
+    - Optional live aggregate of a directory the operator listed in
+      METRIC_ANALYSIS_FOLLOW_DIRS
+    - Results cached on disk when METRIC_ANALYSIS_CACHE_DIR is set, so the same
+      input is not parsed again after a restart
+    - Processing metrics served in the OpenMetrics format when
+      METRIC_ANALYSIS_METRICS_PORT is set
+    - Admission control of pasted text: memory and time are estimated before
+      processing, and large inputs run in a bounded-memory mode, wait for a
+      heavy-job slot, or are rejected according to a server-wide budget
+    - Optional profiling of processing runs (sampling or deterministic), with
+      the hot functions and lines shown in the app and the raw profile
+      offered as a download
+    - Optional enrichment from a mapping table (CSV/TSV) the operator listed
+      in METRIC_ANALYSIS_MAPPING_FILES, loaded once into a memory-mapped
+      index, adding attribute columns to the result and re-aggregating
+      volumes by a chosen attribute
 
     This function is the entry point for the Streamlit application.
     """
@@ -101,14 +4685,166 @@ def main():
 
     # Get the input data from the user
     data = st.text_area('Enter the data:', height=200)
+    uploaded = st.file_uploader('Or upload a file:',
+                                type=['txt', 'jsonl', 'ndjson', 'csv', 'tsv', 'xlsx',
+                                      'gz', 'bz2', 'xz', 'zst'])
+
+    # Optional post-processing settings
+    merge_duplicates = st.sidebar.checkbox('Merge near-duplicate entities')
+    contribute_shared = st.sidebar.checkbox('Contribute to shared aggregate')
+    # Only directories configured by the operator can be followed
+    follow_dirs = _configured_paths(_FOLLOW_DIRS_ENV)
+    follow_dir = (st.sidebar.selectbox('Follow directory:', [_NOT_SELECTED, *follow_dirs])
+                  if follow_dirs else _NOT_SELECTED)
+    index_lines = st.sidebar.checkbox('Index source lines')
+    profile = st.sidebar.checkbox('Profile processing')
+    profiler_mode = _PROFILER_CHOICES[st.sidebar.selectbox('Profiler:', list(_PROFILER_CHOICES))] \
+        if profile else None
+    grammar = _sidebar_grammar()
+    entity_column = st.sidebar.text_input('Entity column of uploaded files:', value='Entity')
+    volume_column = st.sidebar.text_input('Volume column of uploaded files:', value='Volume')
+    # Only mapping tables configured by the operator can be loaded
+    mapping_files = _configured_paths(_MAPPING_FILES_ENV)
+    mapping_path = (st.sidebar.selectbox('Mapping file:', [_NOT_SELECTED, *mapping_files])
+                    if mapping_files else _NOT_SELECTED)
+
+    # Results are cached on disk across restarts when a cache directory is configured
+    cache_dir = os.environ.get(_CACHE_DIR_ENV)
+    cache = _result_cache(cache_dir) if cache_dir else None
+
+    # The mapping index is built once and shared by all sessions
+    mapping = None
+    if mapping_path != _NOT_SELECTED:
+        try:
+            columns = _mapping_header(mapping_path)
+            mapping_entity_column = st.sidebar.selectbox(
+                'Entity column of the mapping file:', columns,
+                index=columns.index('Entity') if 'Entity' in columns else 0)
+            mapping = _mapping_index(mapping_path, os.stat(mapping_path).st_mtime_ns,
+                                     mapping_entity_column, cache_dir)
+        except (OSError, ValueError) as e:
+            st.sidebar.error(f'Could not load the mapping file: {e}')
+    group_by = (st.sidebar.selectbox('Aggregate by:', ['Entity', *mapping.attributes])
+                if mapping is not None else 'Entity')
+
+    # Memory budget and heavy-job limit shared by all sessions of the server
+    admissions = _admission_controller(
+        int(os.environ.get(_MEMORY_BUDGET_ENV, _DEFAULT_MEMORY_BUDGET)) << 20,
+        int(os.environ.get(_MAX_HEAVY_JOBS_ENV, _DEFAULT_MAX_HEAVY_JOBS)))
+
+    # Processing metrics are served for scraping when a port is configured
+    metrics_port = os.environ.get(_METRICS_PORT_ENV)
+    if metrics_port:
+        _metrics_server(int(metrics_port))
+
+    process = st.button('Process Data')
 
-    if st.button('Process Data'):
-        # Process the data
-        df = process_data(data)
+    # A quick estimate from a sample of lines before committing to a full run
+    if st.sidebar.button('Preview sample'):
+        if uploaded is not None:
+            st.caption('Sampled previews are available for pasted text only.')
+        else:
+            # Rows are split lazily, so only the sample is ever held as strings
+            rows = _TextRows(data, grammar.row_separator)
+            st.session_state['preview'] = (data, grammar,
+                                           preview_rows(rows, _PREVIEW_SAMPLE, grammar))
+    preview = st.session_state.get('preview')
+    if preview is not None and uploaded is None and preview[:2] == (data, grammar):
+        process = _show_preview(preview[2]) or process
+
+    if process:
+        st.session_state.pop('preview', None)
+        st.session_state.pop('profile', None)
+        job = st.session_state.get('job')
+        if uploaded is not None:
+            # Uploads are streamed straight into the aggregation
+            st.session_state.pop('job', None)
+            st.session_state.pop('provenance', None)
+            entity_column = entity_column or 'Entity'
+            volume_column = volume_column or 'Volume'
+            key = cache and cache.key([digest_source(uploaded)],
+                                      ('upload', uploaded.name, entity_column, volume_column, grammar))
+            df = cache.get(key) if cache else None
+            if df is not None:
+                st.caption('Loaded cached result.')
+                _store_result(df, merge_duplicates, contribute_shared, mapping)
+            else:
+                try:
+                    with _profiled(profiler_mode):
+                        df = process_file(uploaded, entity_column=entity_column,
+                                          volume_column=volume_column, grammar=grammar)
+                except (ValueError, ImportError, zipfile.BadZipFile) as e:
+                    st.error(f'Could not process {uploaded.name}: {e}')
+                else:
+                    if cache:
+                        cache.put(key, df)
+                    _store_result(df, merge_duplicates, contribute_shared, mapping)
+        elif job is not None and job['data'] == data and job['grammar'] == grammar:
+            # The same input is still being processed: keep going instead of restarting
+            st.caption('This input is already being processed.')
+        else:
+            st.session_state.pop('job', None)
+            st.session_state.pop('provenance', None)
+            key = cache and cache.key([digest_source(data.encode('utf-8'))], ('text', grammar))
+            # Source lines can only be indexed by parsing, so skip the lookup then
+            df = cache.get(key) if cache and not index_lines else None
+            if df is not None:
+                st.caption('Loaded cached result.')
+                _store_result(df, merge_duplicates, contribute_shared, mapping)
+            else:
+                # Predict the cost before committing server memory to the input
+                estimate = estimate_workload(data, grammar)
+                mode = admissions.plan(estimate)
+                if mode == 'reject':
+                    st.error(f'This input needs about {estimate.bounded_memory >> 20} MiB even in '
+                             f'bounded-memory mode, more than the server allows '
+                             f'({admissions.memory_budget >> 20} MiB). Split it or use the batch '
+                             'command line.')
+                else:
+                    if mode == 'bounded':
+                        st.caption(f'Large input ({estimate.lines} lines, about {estimate.entities} '
+                                   f'entities and {estimate.seconds:.0f} s): processing in '
+                                   'bounded-memory mode without the source line index.')
+                    st.session_state['job'] = {
+                        'data': data, 'grammar': grammar, 'position': 0, 'totals': {},
+                        'cache_key': key, 'started': time.perf_counter(),
+                        'provenance': ProvenanceIndex() if index_lines and mode == 'run' else None,
+                        'estimate': estimate, 'bounded': mode == 'bounded',
+                    }
+
+    job = st.session_state.get('job')
+    if job is not None:
+        admission = _admit_job(job, admissions)
+        if admission is None:
+            st.warning('The server is busy with other large inputs, so this one is queued. '
+                       'Click Process Data to check again.')
+            job = None
+    if job is not None:
+        # Process the data in chunks with progress; None means cancelled
+        with admission, _profiled(profiler_mode):
+            df = _run_job(job)
+        del st.session_state['job']
+
+        if df is None:
+            st.caption('Processing cancelled.')
+        else:
+            _record_run('web', job.get('started', time.perf_counter()), len(df),
+                        job['position'], _text_bytes(job['data']))
+            if cache and job.get('cache_key'):
+                cache.put(job['cache_key'], df)
+            if job.get('provenance') is not None:
+                st.session_state['provenance'] = (job['provenance'], job['data'],
+                                                  job['grammar'].row_separator)
+            _store_result(df, merge_duplicates, contribute_shared, mapping)
+
+    result = st.session_state.get('result')
+    if result is not None:
+        df, index = result
 
         # Display the preview of the CSV file
         st.subheader('Preview of CSV file:')
-        st.write(df)
+        query = st.text_input('Search entities:')
+        st.write(index.filter(query))
 
         # Convert the DataFrame to CSV
         csv = df.to_csv(index=False)
@@ -121,6 +4857,251 @@ def main():
             mime='text/csv'
         )
 
+        # Volumes summed by a mapped attribute instead of by entity
+        if group_by != 'Entity':
+            st.subheader(f'Volume by {group_by}:')
+            st.dataframe(mapping.reaggregate(df, group_by))
+
+        # Charts of the whole result, downsampled on the server
+        with st.expander('Charts'):
+            _show_charts(df)
+
+        # Drill down from an entity to the input lines it came from
+        provenance = st.session_state.get('provenance')
+        if provenance is not None:
+            _show_source_lines(*provenance)
+
+    # Hot functions and lines of the last profiled run, without any of its data
+    profiler = st.session_state.get('profile')
+    if profile and profiler is not None:
+        with st.expander('Profile', expanded=True):
+            _show_profile(profiler)
+
+    # Snapshot of the shared aggregate, taken once and then only on request:
+    # every snapshot makes the next writer of each shard copy it
+    if contribute_shared:
+        with st.expander('Shared aggregate', expanded=True):
+            shared_view = st.session_state.get('shared_view')
+            if shared_view is None or st.button('Refresh shared aggregate'):
+                shared_view = st.session_state['shared_view'] = _shared_aggregate().view()
+            st.caption(f'Snapshot of {shared_view.contributions} contributions, '
+                       f'{len(shared_view)} entities')
+            st.dataframe(shared_view.to_frame())
+
+    # Live aggregate of a watched directory, refreshed on every rerun
+    if follow_dir != _NOT_SELECTED:
+        follower = _shared_follower(follow_dir, '*')
+        try:
+            follower.poll()
+        except OSError as e:
+            st.error(f'Could not read the followed directory: {e}')
+        else:
+            with st.expander('Live aggregate of followed directory', expanded=True):
+                st.caption(f'{follower.lines_processed} lines processed from {follow_dir}')
+                st.dataframe(follower.snapshot())
+
+
+def _write_csv_atomic(df, path):
+    """Write a result as CSV so readers never see a partially written file."""
+    tmp_path = f'{path}.tmp'
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def cli(argv=None):
+    """
+    Command-line entry point for batch processing without the web interface.
+
+    Usage:
+        python Metric_multi_entity_analysis.py batch INPUT [INPUT ...] -o OUTPUT
+               [--checkpoint PATH] [--checkpoint-every N]
+               [--read-block-size MIB] [--read-queue-depth N]
+               [--cache-dir DIR] [--cache-size MIB] [--metrics-file PATH]
+               [--mapping TABLE [--mapping-entity-column COLUMN]
+                [--group-by ATTRIBUTE]] [--profile [MODE] [--profile-output PATH]]
+               [GRAMMAR OPTIONS]
+        python Metric_multi_entity_analysis.py follow DIRECTORY -o OUTPUT
+               [--pattern GLOB] [--interval SECONDS] [--metrics-file PATH]
+               [GRAMMAR OPTIONS]
+        python Metric_multi_entity_analysis.py partial INPUT [INPUT ...] -o PARTIAL
+               [--format FORMAT] [GRAMMAR OPTIONS]
+        python Metric_multi_entity_analysis.py merge PARTIAL [PARTIAL ...] -o OUTPUT
+               [--partial-output PATH]
+
+    Grammar options: --entity-separator SEP, --volume {last,first,none},
+    --volume-prefix MARKER, --decimal-volumes, --include RULE, --exclude RULE,
+    --include-file PATH, --exclude-file PATH.
+
+    Args:
+        argv (list, optional): Arguments to parse instead of sys.argv[1:].
+
+    Returns:
+        int: Process exit code.
+    """
+    parser = argparse.ArgumentParser(description='Metric Entity Volume Analyser')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # Input grammar options shared by the commands that parse text lines
+    grammar_options = argparse.ArgumentParser(add_help=False)
+    grammar_options.add_argument('--entity-separator', default='|',
+                                 help='separator between entities on a line (default: |)')
+    grammar_options.add_argument('--volume', choices=['last', 'first', 'none'], default='last',
+                                 help='position of the volume on a line (default: last)')
+    grammar_options.add_argument('--volume-prefix', default='',
+                                 help='marker written before the volume digits, e.g. x')
+    grammar_options.add_argument('--decimal-volumes', action='store_true',
+                                 help='also accept volumes such as 2.5 or 1e3')
+    grammar_options.add_argument('--include', action='append', default=[], metavar='RULE',
+                                 help='keep only entities matching a rule: NAME, prefix:TEXT, '
+                                      'contains:TEXT or re:PATTERN (repeatable)')
+    grammar_options.add_argument('--exclude', action='append', default=[], metavar='RULE',
+                                 help='drop entities matching a rule (repeatable)')
+    grammar_options.add_argument('--include-file', action='append', default=[], metavar='PATH',
+                                 help='read include rules from a file, one per line')
+    grammar_options.add_argument('--exclude-file', action='append', default=[], metavar='PATH',
+                                 help='read exclude rules from a file, one per line')
+
+    batch = commands.add_parser('batch', parents=[grammar_options],
+                                help='process input files into a CSV ranking')
+    batch.add_argument('inputs', nargs='+',
+                       help='input files in the process_data format, optionally compressed')
+    batch.add_argument('-o', '--output', required=True, help='CSV file to write')
+    batch.add_argument('--checkpoint', help='checkpoint file used to resume an interrupted run')
+    batch.add_argument('--checkpoint-every', type=int, default=100000,
+                       help='lines between checkpoints (default: 100000)')
+    batch.add_argument('--cache-dir', default=os.environ.get(_CACHE_DIR_ENV),
+                       help=f'result cache directory (default: ${_CACHE_DIR_ENV}, if set)')
+    batch.add_argument('--read-block-size', type=float, default=_READ_BLOCK_SIZE / (1 << 20),
+                       metavar='MIB', help='size of the blocks read ahead of parsing in MiB '
+                                           f'(default: {_READ_BLOCK_SIZE >> 20})')
+    batch.add_argument('--read-queue-depth', type=int, default=_READ_QUEUE_DEPTH, metavar='N',
+                       help='blocks read ahead of parsing; 0 reads and parses in turn '
+                            f'(default: {_READ_QUEUE_DEPTH})')
+    batch.add_argument('--cache-size', type=int, default=256,
+                       help='result cache size limit in MiB (default: 256)')
+    batch.add_argument('--metrics-file',
+                       help='write processing metrics in the OpenMetrics format when done')
+    batch.add_argument('--mapping',
+                       help='CSV/TSV table whose columns are added to each entity')
+    batch.add_argument('--mapping-entity-column', default='Entity',
+                       help='column of the mapping table holding entity names (default: Entity)')
+    batch.add_argument('--group-by', metavar='ATTRIBUTE',
+                       help='sum volumes by this mapping column instead of by entity')
+    batch.add_argument('--profile', nargs='?', const='sampling', choices=_PROFILER_MODES,
+                       help='profile the processing and print the hot functions and lines '
+                            '(default mode: sampling)')
+    batch.add_argument('--profile-output', metavar='PATH',
+                       help='also write the raw profile (folded stacks or pstats data)')
+
+    follow = commands.add_parser('follow', parents=[grammar_options],
+                                 help='tail a directory and keep a live CSV snapshot')
+    follow.add_argument('directory', help='directory containing the growing input files')
+    follow.add_argument('-o', '--output', required=True, help='CSV snapshot to rewrite')
+    follow.add_argument('--pattern', default='*', help='glob selecting files to follow (default: *)')
+    follow.add_argument('--interval', type=float, default=5.0,
+                        help='seconds between polls (default: 5)')
+    follow.add_argument('--metrics-file',
+                        help='rewrite processing metrics in the OpenMetrics format every poll')
+
+    partial = commands.add_parser('partial', parents=[grammar_options],
+                                  help='aggregate input files into a partial file for merging')
+    partial.add_argument('inputs', nargs='+', help='input files in any supported format')
+    partial.add_argument('-o', '--output', required=True, help='partial file to write')
+    partial.add_argument('--format', choices=sorted(set(_FILE_FORMATS.values())),
+                         help='input format (default: inferred from each file name)')
+
+    merge = commands.add_parser('merge', help='merge partial files into a CSV ranking')
+    merge.add_argument('partials', nargs='+', help='partial files written by the partial command')
+    merge.add_argument('-o', '--output', required=True, help='CSV file to write')
+    merge.add_argument('--partial-output', help='also write the merged sums as a partial file')
+
+    args = parser.parse_args(argv)
+    if args.command == 'batch' and args.group_by and not args.mapping:
+        parser.error('--group-by requires --mapping')
+    if args.command == 'batch' and args.profile_output and not args.profile:
+        parser.error('--profile-output requires --profile')
+    if args.command == 'batch':
+        block_size = int(args.read_block_size * (1 << 20))
+        if block_size <= 0 or args.read_queue_depth < 0:
+            parser.error('--read-block-size must be positive and --read-queue-depth not negative')
+    if args.command != 'merge':
+        include, exclude = list(args.include), list(args.exclude)
+        for rules, paths in ((include, args.include_file), (exclude, args.exclude_file)):
+            for path in paths:
+                with open(path, encoding='utf-8') as f:
+                    rules.extend(parse_filter_rules(f.read()))
+        grammar = Grammar(entity_separator=args.entity_separator, volume=args.volume,
+                          volume_prefix=args.volume_prefix,
+                          numbers='decimal' if args.decimal_volumes else 'integer',
+                          filters=EntityFilter(include, exclude) if include or exclude else None)
+        try:
+            compile_parser(grammar)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.command == 'batch':
+        cache = ResultCache(args.cache_dir, args.cache_size << 20) if args.cache_dir else None
+        profiler = Profiler(args.profile) if args.profile else contextlib.nullcontext()
+        with profiler:
+            df = process_files(args.inputs, args.checkpoint, args.checkpoint_every, grammar, cache,
+                               block_size, args.read_queue_depth)
+        if args.profile:
+            print(profiler.summary(), file=sys.stderr)
+            if args.profile_output:
+                with open(args.profile_output, 'wb') as f:
+                    f.write(profiler.dump())
+        if df.attrs.get('volume_overflow'):
+            print(_OVERFLOW_NOTICE, file=sys.stderr)
+        if args.mapping:
+            # Index files are kept next to cached results when a cache is used
+            mapping = open_mapping(args.mapping, args.mapping_entity_column, args.cache_dir)
+            try:
+                df = mapping.reaggregate(df, args.group_by) if args.group_by else mapping.enrich(df)
+            except ValueError as e:
+                parser.error(str(e))
+            finally:
+                mapping.close()
+        df.to_csv(args.output, index=False)
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+
+    elif args.command == 'follow':
+        follower = DirectoryFollower(args.directory, args.pattern, grammar=grammar)
+        try:
+            while True:
+                if follower.poll():
+                    _write_csv_atomic(follower.snapshot(), args.output)
+                if args.metrics_file:
+                    METRICS.write(args.metrics_file)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            _write_csv_atomic(follower.snapshot(), args.output)
+        finally:
+            follower.close()
+
+    elif args.command == 'partial':
+        frames = [process_file(path, args.format, grammar=grammar) for path in args.inputs]
+        try:
+            write_partial(pd.concat(frames), args.output)
+        except ValueError as e:
+            # With --decimal-volumes, fractional sums do not fit the integer format
+            parser.error(str(e))
+
+    elif args.command == 'merge':
+        df = merge_partials(args.partials, args.partial_output)
+        if df.attrs.get('volume_overflow'):
+            print(_OVERFLOW_NOTICE, file=sys.stderr)
+        df.to_csv(args.output, index=False)
+
+    return 0
+
+
 if __name__ == '__main__':
-    main()
+    # `streamlit run` (and AppTest) execute this file as __main__ too; only use
+    # the CLI when not running inside a Streamlit script run
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    if get_script_run_ctx() is not None:
+        main()
+    else:
+        sys.exit(cli())
 # In[ ]:
@@ -0,0 +1,311 @@
+"""
+Differential fuzzing of the processing engines against process_data.
+
+process_data is the reference implementation (the oracle). Every other path
+that produces the same ranking (chunked processing, file and batch readers,
+follow mode, compiled grammars, merged partials, the batch API, the Arrow backend) is registered in ENGINES and run on the same
+random and adversarial inputs. Any input on which an engine's result differs
+from the oracle, or on which it raises, is reported after being minimized to a
+small counterexample. Each engine is also timed on fuzz inputs and on
+export-like inputs.
+
+Usage:
+    python tests/differential.py --cases 500 --seed 0
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    process_data,
+    process_file,
+    process_files,
+    iter_process_chunks,
+    DirectoryFollower,
+    Grammar,
+    write_partial,
+    merge_partials,
+    process_batch,
+    _totals_to_frame,
+)
+
+
+def _chunked(data):
+    totals = {}
+    for _ in iter_process_chunks(data.split('\n'), totals, chunk_lines=3):
+        pass
+    return _totals_to_frame(totals)
+
+
+def _file(data):
+    return process_file(io.BytesIO(data.encode('utf-8')), 'text')
+
+
+def _batch(data):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'input.txt')
+        with open(path, 'wb') as f:
+            f.write(data.encode('utf-8'))
+        return process_files([path])
+
+
+def _follow(data):
+    with tempfile.TemporaryDirectory() as tmp:
+        # Follow mode only reads complete lines, so terminate the last one
+        with open(os.path.join(tmp, 'feed.log'), 'wb') as f:
+            f.write(data.encode('utf-8') + b'\n')
+        follower = DirectoryFollower(tmp, block_size=5)
+        follower.poll()
+        follower.close()
+        return follower.snapshot()
+
+
+# Stand-in entity separator for the compiled grammar engine; never generated
+_ALT_SEPARATOR = '¦'
+
+
+def _compiled_grammar(data):
+    grammar = Grammar(entity_separator=_ALT_SEPARATOR)
+    return process_data(data.replace('|', _ALT_SEPARATOR), grammar)
+
+
+def _partials(data):
+    # Split the rows between two nodes, as a sharded export would be
+    rows = data.split('\n')
+    middle = len(rows) // 2
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i, shard in enumerate([rows[:middle], rows[middle:]]):
+            paths.append(os.path.join(tmp, f'shard_{i}.part'))
+            write_partial(process_data('\n'.join(shard)), paths[-1])
+        return merge_partials(paths)
+
+
+def _batch_api(data):
+    # Spread the rows over three documents of one batch
+    rows = data.split('\n')
+    documents = ['\n'.join(rows[i::3]) for i in range(3)]
+    return process_batch(documents).total()
+
+
+def _arrow(data):
+    return process_data(data, backend='arrow')
+
+
+# Engines checked against the oracle, by name
+ENGINES = {
+    'chunked': _chunked,
+    'file': _file,
+    'batch': _batch,
+    'follow': _follow,
+    'compiled_grammar': _compiled_grammar,
+    'partials': _partials,
+    'batch_api': _batch_api,
+    'arrow': _arrow,
+}
+
+
+# Building blocks for generated inputs, biased towards the quirks of the grammar
+_NAMES = ['Entity A', 'entity a', 'Entity B', 'Entité', '实体', '🚀', 'A & Co', "O'Brien",
+          'Entity 5', 'x', '5', '-5', '1.5', 'Name\twith tab', 'Entity  A']
+_VOLUMES = ['0', '1', '7', '42', '00', '123456789012', '99999999999999999999', '²', '٣', '５',
+            '-3', '2.5', '1e3', '0x1F']
+_SPACES = [' ', '  ', '\t', ' \t ', ' ', '　', '\x0b', '\x1f']
+_EXTRA = ['|', '||', ' | ', '\r', '', ' ']
+
+
+def generate_input(rng, max_lines=8):
+    """
+    Generate one random input in the process_data format.
+
+    Args:
+        rng (random.Random): Source of randomness.
+        max_lines (int): Maximum number of lines.
+
+    Returns:
+        str: Input text mixing entity names, separators, whitespace and
+             volume-like tokens, including malformed ones.
+    """
+    lines = []
+    for _ in range(rng.randint(0, max_lines)):
+        parts = [rng.choice(_NAMES + _EXTRA) for _ in range(rng.randint(0, 4))]
+        line = rng.choice(['|', '||', ' |']).join(parts) if rng.random() < 0.3 else '|'.join(parts)
+        if rng.random() < 0.6:
+            line += rng.choice(_SPACES) + rng.choice(_VOLUMES)
+        if rng.random() < 0.2:
+            line = rng.choice(_SPACES + _EXTRA) + line + rng.choice(_SPACES + _EXTRA)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def generate_export(rng, lines):
+    """
+    Generate a well-formed input shaped like a real export, for timing.
+
+    Entity popularity follows a long-tailed distribution and volumes are
+    small integers, so no engine has to fall back to a slower exact path.
+
+    Args:
+        rng (random.Random): Source of randomness.
+        lines (int): Number of lines.
+
+    Returns:
+        str: Input text with one to three entities and a volume per line.
+    """
+    rows = []
+    for _ in range(lines):
+        names = [f'Entity {int(rng.paretovariate(0.8)) % 100000}' for _ in range(rng.randint(1, 3))]
+        rows.append(f"{'|'.join(names)} {rng.randint(1, 1000)}")
+    return '\n'.join(rows)
+
+
+# Hand-written inputs covering the quirks pinned down by the unit tests
+ADVERSARIAL = [
+    '', '\n', '|||', '|  |   |', 'Entity A|Entity B|', '|Entity A', 'Entity A||Entity B',
+    'Entity Name\t5', 'Entity Name    10', 'Entity -5', 'Entity 1.5', 'Entity 1e3',
+    'Entity ²', 'Entity ５', 'Entity 99999999999999999999', '5', 'Entity 5 10',
+    'Entity A 0', 'A| 5', ' 5', 'Entity A 3\r\nEntity A 4\r', 'Entity\x0b5', 'Entity\x1f5',
+    'Entity A\nentity a\nENTITY A', 'Entity  A  B 3', 'Entité|实体|Сущность 2',
+]
+
+
+def _same(expected, actual):
+    """Return True if two results are identical, including order and dtypes."""
+    try:
+        pd.testing.assert_frame_equal(expected, actual)
+    except AssertionError:
+        return False
+    return True
+
+
+def diverges(engine, data):
+    """Return True if engine's result for data differs from the oracle or it raises."""
+    try:
+        actual = engine(data)
+    except Exception:
+        return True
+    return not _same(process_data(data), actual)
+
+
+def minimize(data, fails):
+    """
+    Shrink an input while it keeps failing.
+
+    Whole lines are removed first, then single characters, until no single
+    removal keeps the failure.
+
+    Args:
+        data (str): Failing input.
+        fails (callable): Predicate returning True for failing inputs.
+
+    Returns:
+        str: A locally minimal failing input.
+    """
+    for separator in ('\n', None):
+        units = data.split('\n') if separator else list(data)
+        join = (lambda parts: '\n'.join(parts)) if separator else ''.join
+        i = 0
+        while i < len(units):
+            candidate = units[:i] + units[i + 1:]
+            if fails(join(candidate)):
+                units = candidate
+            else:
+                i += 1
+        data = join(units)
+    return data
+
+
+def run_differential(cases=200, seed=0, engines=None):
+    """
+    Check every engine against the oracle on adversarial and random inputs.
+
+    Args:
+        cases (int): Number of random inputs in addition to ADVERSARIAL.
+        seed (int): Random seed for input generation.
+        engines (dict, optional): Engines to check; ENGINES by default.
+
+    Returns:
+        list: One dict per diverging engine with its 'engine' name, the
+              minimized 'input', and the oracle's 'expected' and engine's
+              'actual' result (or the exception raised).
+    """
+    engines = ENGINES if engines is None else engines
+    rng = random.Random(seed)
+    corpus = ADVERSARIAL + [generate_input(rng) for _ in range(cases)]
+
+    counterexamples = []
+    for name, engine in engines.items():
+        for data in corpus:
+            if diverges(engine, data):
+                smallest = minimize(data, lambda d: diverges(engine, d))
+                try:
+                    actual = engine(smallest)
+                except Exception as e:
+                    actual = e
+                counterexamples.append({
+                    'engine': name,
+                    'input': smallest,
+                    'expected': process_data(smallest),
+                    'actual': actual,
+                })
+                break
+    return counterexamples
+
+
+def time_engines(corpus, engines=None, repeat=3):
+    """
+    Time the oracle and each engine over the same corpus.
+
+    Args:
+        corpus (list): Inputs to process.
+        engines (dict, optional): Engines to time; ENGINES by default.
+        repeat (int): Runs per engine; the fastest is reported.
+
+    Returns:
+        dict: Engine name to best total time in seconds, including
+              'process_data' for the oracle.
+    """
+    engines = {'process_data': process_data, **(ENGINES if engines is None else engines)}
+    timings = {}
+    for name, engine in engines.items():
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for data in corpus:
+                engine(data)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cases', type=int, default=500, help='random inputs (default: 500)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--timing-lines', type=int, default=20000,
+                        help='lines per timing input (default: 20000)')
+    args = parser.parse_args()
+
+    found = run_differential(args.cases, args.seed)
+    for case in found:
+        print(f"[{case['engine']}] diverges on {case['input']!r}")
+        print(f"  expected:\n{case['expected']}\n  actual:\n{case['actual']}")
+    print(f'{len(found)} diverging engines out of {len(ENGINES)}')
+
+    rng = random.Random(args.seed)
+    corpora = {
+        'fuzz inputs': [generate_input(rng, max_lines=args.timing_lines) for _ in range(3)],
+        'export-like inputs': [generate_export(rng, args.timing_lines) for _ in range(3)],
+    }
+    for label, corpus in corpora.items():
+        print(f'Timing on {label}:')
+        timings = time_engines(corpus)
+        for name, seconds in timings.items():
+            print(f'{name:>18}: {seconds * 1000:9.1f} ms  ({seconds / timings["process_data"]:.2f}x)')
@@ -0,0 +1,202 @@
+"""
+Concurrent-session load test for the Streamlit app.
+
+Runs the real app script headlessly with Streamlit's AppTest, one AppTest per
+simulated analyst, and has every session press "Process Data" at the same
+time. Sessions run as threads in this process, which is also how a Streamlit
+server runs its sessions, so the reported memory is the memory of a server
+process handling that load.
+
+Usage:
+    python tests/load_test.py --sessions 20 --lines 50000 --entities 5000 --rounds 3
+"""
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.util import patch_config_options
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'Metric_multi_entity_analysis.py')
+
+
+def make_input(lines, entities, seed=0):
+    """
+    Generate a synthetic paste in the process_data format.
+
+    Args:
+        lines (int): Number of input lines.
+        entities (int): Number of distinct entity names to draw from.
+        seed (int): Random seed, so runs are reproducible.
+
+    Returns:
+        str: Input text with 1-4 pipe-separated entities per line and a
+             volume on roughly half of the lines.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(lines):
+        names = '|'.join(f'Entity-{rng.randrange(entities)}' for _ in range(rng.randint(1, 4)))
+        rows.append(f'{names} {rng.randint(1, 100)}' if rng.random() < 0.5 else names)
+    return '\n'.join(rows)
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values using linear interpolation."""
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _rss_mb():
+    """Current resident set size of this process in MB (Linux), or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unavailable."""
+    if resource is None:
+        return None
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _failed(at):
+    """
+    Return whether the last run of a session did not produce a result.
+
+    Runs that were queued or rejected by admission control return quickly
+    with a warning or error instead of a result, so they count as failures
+    rather than as fast runs.
+    """
+    return bool(at.exception or at.error or at.warning) or 'result' not in at.session_state
+
+
+def _session(data, rounds, barrier, timeout):
+    """Simulate one analyst: load the app, paste data and process it rounds times."""
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.run()
+    at.text_area[0].input(data)
+
+    latencies, errors = [], 0
+    for _ in range(rounds):
+        # Each round must produce its own result
+        if 'result' in at.session_state:
+            del at.session_state['result']
+        button = next(button for button in at.button if button.label == 'Process Data')
+        barrier.wait()
+        start = time.perf_counter()
+        button.click().run()
+        latencies.append(time.perf_counter() - start)
+        errors += _failed(at)
+    return latencies, errors
+
+
+def run_load_test(sessions=20, lines=50000, entities=5000, rounds=3, timeout=600):
+    """
+    Run concurrent sessions against the app and collect latency statistics.
+
+    Every round, all sessions click "Process Data" at the same moment.
+
+    Args:
+        sessions (int): Number of concurrent simulated analysts.
+        lines (int): Lines in each session's paste.
+        entities (int): Distinct entity names in each paste.
+        rounds (int): Number of clicks per session.
+        timeout (float): Per-run AppTest timeout in seconds.
+
+    Returns:
+        dict: Latency percentiles (seconds), throughput (runs and input
+              lines per second), error count and memory usage (MB). A run
+              is an error if it raised, showed a warning or error, or
+              produced no result (for example when admission control
+              queued or rejected it).
+    """
+    inputs = [make_input(lines, entities, seed=i) for i in range(sessions)]
+    barrier = threading.Barrier(sessions, timeout=timeout)
+    rss_before = _rss_mb()
+
+    # Each AppTest run switches the global "global.appTest" option on and back
+    # off around itself, so with concurrent runs one can switch it off under
+    # another and break widget lookups. Keep it on for the whole test instead.
+    # A Streamlit server compiles the script once into a cache shared by all
+    # sessions, while every AppTest run compiles it again; concurrent compiles
+    # can fail on Python 3.11, where ast.parse is not thread-safe. Share one
+    # cache between the sessions like the server does.
+    script_cache = ScriptCache()
+    start = time.perf_counter()
+    with patch_config_options({'global.appTest': True}), \
+            patch('streamlit.testing.v1.app_test.ScriptCache', return_value=script_cache), \
+            patch('streamlit.testing.v1.local_script_runner.ScriptCache', return_value=script_cache):
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            results = list(pool.map(lambda data: _session(data, rounds, barrier, timeout), inputs))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for session, _ in results for latency in session]
+    runs = len(latencies)
+    return {
+        'sessions': sessions,
+        'lines': lines,
+        'runs': runs,
+        'errors': sum(errors for _, errors in results),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+        'runs_per_second': runs / elapsed,
+        'lines_per_second': runs * lines / elapsed,
+        'rss_before_mb': rss_before,
+        'rss_after_mb': _rss_mb(),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def format_report(report):
+    """Format a load test report for the terminal."""
+    def mb(value):
+        return 'n/a' if value is None else f'{value:.0f} MB'
+
+    return '\n'.join([
+        f"{report['sessions']} sessions x {report['runs'] // report['sessions']} runs, "
+        f"{report['lines']} lines per paste",
+        f"latency p50 {report['p50']:.3f}s  p95 {report['p95']:.3f}s  "
+        f"p99 {report['p99']:.3f}s  max {report['max']:.3f}s",
+        f"throughput {report['runs_per_second']:.2f} runs/s, "
+        f"{report['lines_per_second']:.0f} lines/s",
+        f"errors {report['errors']}",
+        f"memory {mb(report['rss_before_mb'])} before, {mb(report['rss_after_mb'])} after, "
+        f"{mb(report['peak_rss_mb'])} peak",
+    ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sessions', type=int, default=20, help='concurrent sessions (default: 20)')
+    parser.add_argument('--lines', type=int, default=50000, help='lines per paste (default: 50000)')
+    parser.add_argument('--entities', type=int, default=5000,
+                        help='distinct entities per paste (default: 5000)')
+    parser.add_argument('--rounds', type=int, default=3, help='clicks per session (default: 3)')
+    parser.add_argument('--timeout', type=float, default=600, help='AppTest timeout in seconds')
+    args = parser.parse_args()
+
+    print(format_report(run_load_test(args.sessions, args.lines, args.entities,
+                                      args.rounds, args.timeout)))
@@ -0,0 +1,179 @@
+"""
+Tests for workload estimation and admission control.
+Tests the lazy row splitting, the size estimates and the admission decisions.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Metric_multi_entity_analysis as app
+from Metric_multi_entity_analysis import (
+    AdmissionController, Grammar, WorkloadEstimate, estimate_workload, iter_process_chunks,
+    process_data
+)
+
+
+def _estimate(memory, bounded_memory):
+    """A workload estimate with the given memory predictions"""
+    return WorkloadEstimate(0, 0, 0, memory, bounded_memory, 0.0)
+
+
+class TestTextRows:
+    """Test splitting an input one slice at a time"""
+
+    def test_slices_match_split(self):
+        """Test sequential, repeated and backward slices"""
+        data = "a\nb\n\nc|d 5\ne\n"
+        rows = app._TextRows(data, '\n')
+        expected = data.split('\n')
+
+        assert len(rows) == len(expected)
+        assert rows[0:2] == expected[0:2]
+        assert rows[2:5] == expected[2:5]
+        assert rows[5:6] == expected[5:6]
+        assert rows[1:4] == expected[1:4]
+        assert rows[0:len(rows)] == expected
+
+    @pytest.mark.parametrize('block_chars', [1, 2, 3, 7, 1 << 20])
+    def test_iteration_matches_split(self, monkeypatch, block_chars):
+        """Test that iterating yields every row across block boundaries"""
+        monkeypatch.setattr(app, '_ROW_BLOCK_CHARS', block_chars)
+        rng = random.Random(block_chars)
+        for separator in ['\n', '||', 'aa']:
+            for data in ["a\nb\n\nc|d 5\ne\n", "", "\n", "a\nb\nc", "aaa", "x" * 20,
+                         ''.join(rng.choice('ab|\nx') for _ in range(300))]:
+                assert list(app._TextRows(data, separator)) == data.split(separator)
+
+        # Iterating after slicing starts from the first row again
+        rows = app._TextRows("a;;b;c;d", ';')
+        rows[3:5]
+        assert list(rows) == ['a', '', 'b', 'c', 'd']
+
+    def test_chunked_aggregation(self):
+        """Test that chunked processing over lazy rows matches process_data"""
+        data = "\n".join(f"Entity {i % 37}|Entity {i % 11} {i % 5}" for i in range(1000))
+        totals = {}
+
+        for _ in iter_process_chunks(app._TextRows(data, '\n'), totals, chunk_lines=64):
+            pass
+
+        pd.testing.assert_frame_equal(app._totals_to_frame(totals), process_data(data))
+
+    def test_other_separator(self):
+        """Test a single-character row separator other than newline"""
+        rows = app._TextRows("a;b 2;c", ';')
+
+        assert rows[1:3] == ['b 2', 'c']
+
+
+class TestEstimateWorkload:
+    """Test the pre-flight size and cost estimate"""
+
+    def test_small_input_exact(self):
+        """Test that small inputs are counted exactly"""
+        estimate = estimate_workload("Entity A|Entity B 5\nEntité 3\nEntity A")
+
+        assert estimate.lines == 3
+        assert estimate.bytes == 38
+        assert estimate.entities == 3
+        assert estimate.memory > estimate.bytes
+        assert estimate.seconds > 0
+
+    def test_grammar(self):
+        """Test that the row separator and entity separator are used"""
+        estimate = estimate_workload("A,B;C;A", Grammar(';', ','))
+
+        assert (estimate.lines, estimate.entities) == (3, 3)
+
+    def test_empty(self):
+        """Test that an empty input has no entities"""
+        estimate = estimate_workload('')
+
+        assert (estimate.lines, estimate.entities) == (1, 0)
+
+    def test_sampled_entities(self):
+        """Test that distinct entities are extrapolated from a sample"""
+        rng = random.Random(0)
+        data = "\n".join(f"Entity {rng.randrange(50000)}|Entity {rng.randrange(50000)} 3"
+                         for _ in range(100000))
+        truth = len(process_data(data))
+
+        estimate = estimate_workload(data)
+
+        assert estimate.lines == 100000
+        assert 0.7 * truth < estimate.entities < 1.3 * truth
+
+    def test_memory_prediction(self):
+        """Test that predicted memory is close to what process_data allocates"""
+        rng = random.Random(1)
+        data = "\n".join(f"Entity {rng.randrange(1000)}|Entity {rng.randrange(500)} 3"
+                         for _ in range(50000))
+        estimate = estimate_workload(data, sample_lines=1000)
+
+        tracemalloc.start()
+        process_data(data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        assert 0.7 * peak < estimate.memory < 1.3 * peak
+        assert estimate.bounded_memory < estimate.memory / 5
+
+
+class TestAdmissionController:
+    """Test planning and reserving server memory"""
+
+    def test_plan(self):
+        """Test the run, bounded and reject decisions"""
+        controller = AdmissionController(800, heavy_memory=100)
+
+        assert controller.plan(_estimate(100, 10)) == 'run'
+        assert controller.plan(_estimate(5000, 800)) == 'bounded'
+        assert controller.plan(_estimate(5000, 801)) == 'reject'
+
+    def test_reserve_and_release(self):
+        """Test that admissions reserve memory until released"""
+        controller = AdmissionController(750, heavy_memory=100)
+
+        with controller.admit(_estimate(100, 10)) as small:
+            large = controller.admit(_estimate(5000, 600))
+            assert (small.mode, large.mode) == ('run', 'bounded')
+            assert (controller.reserved, controller.heavy_jobs) == (700, 1)
+            assert controller.admit(_estimate(100, 10), timeout=0) is None
+            large.release()
+            large.release()
+        assert (controller.reserved, controller.heavy_jobs) == (0, 0)
+
+    def test_heavy_job_limit(self):
+        """Test that only max_heavy_jobs bounded jobs run at once"""
+        controller = AdmissionController(1000, max_heavy_jobs=1, heavy_memory=100)
+
+        with controller.admit(_estimate(5000, 10)):
+            assert controller.admit(_estimate(5000, 10), timeout=0) is None
+            assert controller.admit(_estimate(50, 10), timeout=0) is not None
+
+    def test_waiting_job_admitted_after_release(self):
+        """Test that a queued job is admitted once capacity frees up"""
+        controller = AdmissionController(1000, max_heavy_jobs=1, heavy_memory=100)
+        first = controller.admit(_estimate(5000, 10))
+        admitted = []
+
+        waiter = threading.Thread(target=lambda: admitted.append(controller.admit(_estimate(5000, 10))))
+        waiter.start()
+        time.sleep(0.05)
+        assert admitted == []
+        first.release()
+        waiter.join(timeout=5)
+
+        assert admitted[0].mode == 'bounded'
+
+    def test_reject(self):
+        """Test that a job that can never fit is refused"""
+        with pytest.raises(ValueError, match='budget'):
+            AdmissionController(100).admit(_estimate(5000, 101))
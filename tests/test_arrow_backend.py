@@ -0,0 +1,71 @@
+"""
+Tests for the Arrow aggregation backend of process_data.
+Tests that it matches the pandas backend exactly, including its fallbacks.
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import Grammar, process_data
+
+
+def _assert_same(data, grammar=Grammar()):
+    """Assert that both backends give identical results"""
+    pd.testing.assert_frame_equal(process_data(data, grammar, backend='arrow'),
+                                  process_data(data, grammar))
+
+
+class TestArrowBackend:
+    """Test the Arrow backend against the pandas backend"""
+
+    def test_basic(self):
+        """Test aggregation and ordering of a small input"""
+        df = process_data("Entity A|Entity B 5\nEntity A 3\nEntity C", backend='arrow')
+
+        assert df['Entity'].tolist() == ['Entity A', 'Entity B', 'Entity C']
+        assert df['Volume'].tolist() == [8, 5, 1]
+        assert df['Volume'].dtype == np.int64
+        _assert_same("Entity A|Entity B 5\nEntity A 3\nEntity C")
+
+    def test_ties_and_unicode(self):
+        """Test that ties and non-ASCII names are ordered as by pandas"""
+        rng = np.random.default_rng(0)
+        names = ['Entité', '实体', '🚀', 'entity', 'Entity', 'Z', 'a b']
+        rows = [f"{names[i % 7]} {i % 50}|{'x' * (i % 13)}" for i in rng.integers(0, 10000, 20000)]
+
+        _assert_same('\n'.join(rows))
+
+    def test_many_entities(self):
+        """Test a larger input with many distinct entities"""
+        rng = np.random.default_rng(1)
+        rows = [f"Entity {a}|Entity {b} {c}" for a, b, c in rng.integers(0, 5000, (50000, 3))]
+
+        _assert_same('\n'.join(rows))
+
+    def test_grammar(self):
+        """Test that the grammar is applied before aggregating"""
+        _assert_same("5 Entity A,Entity B;2 Entity A", Grammar(';', ',', 'first'))
+
+    def test_fallbacks(self):
+        """Test inputs the Arrow kernels leave to pandas"""
+        _assert_same('')
+        _assert_same('||\n ')
+        _assert_same('Entity A 99999999999999999999\nEntity B 5')
+        _assert_same(f'Entity A {2 ** 62}\nEntity A {2 ** 62}')
+        _assert_same('Entity A 2.5\nEntity A 1', Grammar(numbers='decimal'))
+
+    def test_unknown_backend(self):
+        """Test that an unknown backend is rejected"""
+        with pytest.raises(ValueError, match='Unknown backend'):
+            process_data('Entity A', backend='polars')
+
+    def test_requires_pyarrow(self):
+        """Test that a missing pyarrow is reported"""
+        with patch.dict(sys.modules, {'pyarrow': None, 'pyarrow.compute': None}):
+            with pytest.raises(ImportError, match='pyarrow'):
+                process_data('Entity A', backend='arrow')
@@ -0,0 +1,151 @@
+"""
+Tests for batch file processing with checkpoint and resume.
+Tests equivalence with process_data, crash recovery and the CLI.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Metric_multi_entity_analysis as app
+from Metric_multi_entity_analysis import process_data, process_files, cli
+
+
+SAMPLE = "Entity A|Entity B 5\nEntity A\n\n|Entity C|\nEntity B 2\nEntité 3\nEntity A 1.5"
+
+
+@pytest.fixture
+def input_files(tmp_path):
+    """Write three input files, the last one without a trailing newline"""
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'input_{i}.txt'
+        lines = [f"Entity {j % 17}|Entity {j % 5} {j % 4}" for j in range(i * 50, i * 50 + 120)]
+        path.write_text("\n".join(lines) + ("\n" if i < 2 else ""), encoding='utf-8')
+        paths.append(str(path))
+    return paths
+
+
+def _expected(paths):
+    """Result of processing each file with process_data and combining totals"""
+    totals = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for _, row in process_data(f.read()).iterrows():
+                totals[row['Entity']] = totals.get(row['Entity'], 0) + row['Volume']
+    return app._totals_to_frame(totals)
+
+
+class TestProcessFiles:
+    """Test processing files without interruption"""
+
+    def test_matches_process_data(self, tmp_path):
+        """Test that a single file gives exactly the process_data result"""
+        path = tmp_path / 'input.txt'
+        path.write_text(SAMPLE, encoding='utf-8')
+
+        result = process_files([str(path)])
+
+        pd.testing.assert_frame_equal(result, process_data(SAMPLE))
+
+    def test_multiple_files_combined(self, input_files):
+        """Test that totals are combined across files"""
+        result = process_files(input_files)
+
+        pd.testing.assert_frame_equal(result, _expected(input_files))
+
+    def test_checkpoint_removed_after_success(self, input_files, tmp_path):
+        """Test that a finished run leaves no checkpoint behind"""
+        checkpoint = tmp_path / 'job.ckpt'
+
+        process_files(input_files, str(checkpoint), checkpoint_every=10)
+
+        assert not checkpoint.exists()
+
+
+class TestCheckpointResume:
+    """Test resuming from a checkpoint after a crash"""
+
+    @pytest.mark.parametrize('crash_after', [1, 5, 13, 14])
+    def test_resume_matches_uninterrupted_run(self, input_files, tmp_path, crash_after):
+        """Test that resuming after a crash gives the uninterrupted result"""
+        checkpoint = str(tmp_path / 'job.ckpt')
+        real_save = app._save_checkpoint
+        saves = []
+
+        def crashing_save(path, state):
+            real_save(path, state)
+            saves.append(path)
+            if len(saves) == crash_after:
+                raise KeyboardInterrupt
+
+        with patch.object(app, '_save_checkpoint', crashing_save):
+            with pytest.raises(KeyboardInterrupt):
+                process_files(input_files, checkpoint, checkpoint_every=25)
+
+        assert os.path.exists(checkpoint)
+        result = process_files(input_files, checkpoint, checkpoint_every=25)
+
+        pd.testing.assert_frame_equal(result, process_files(input_files))
+        assert not os.path.exists(checkpoint)
+
+    def test_checkpoint_for_other_inputs_rejected(self, input_files, tmp_path):
+        """Test that a checkpoint cannot be resumed with different inputs"""
+        checkpoint = str(tmp_path / 'job.ckpt')
+        app._save_checkpoint(checkpoint, {
+            'version': app._CHECKPOINT_VERSION, 'paths': [os.path.abspath(input_files[0])],
+            'grammar': list(app.DEFAULT_GRAMMAR),
+            'file_index': 0, 'offset': 0, 'totals': {},
+        })
+
+        with pytest.raises(ValueError):
+            process_files(input_files[1:], checkpoint)
+
+    def test_truncated_input_rejected(self, input_files, tmp_path):
+        """Test that an input shorter than the saved offset is detected"""
+        checkpoint = str(tmp_path / 'job.ckpt')
+        app._save_checkpoint(checkpoint, {
+            'version': app._CHECKPOINT_VERSION,
+            'paths': [os.path.abspath(p) for p in input_files],
+            'grammar': list(app.DEFAULT_GRAMMAR),
+            'file_index': 0, 'offset': 10 ** 9, 'totals': {},
+        })
+
+        with pytest.raises(ValueError):
+            process_files(input_files, checkpoint)
+
+
+    def test_checkpoint_for_other_grammar_rejected(self, input_files, tmp_path):
+        """Test that a checkpoint cannot be resumed with a different grammar"""
+        checkpoint = str(tmp_path / 'job.ckpt')
+        app._save_checkpoint(checkpoint, {
+            'version': app._CHECKPOINT_VERSION,
+            'paths': [os.path.abspath(p) for p in input_files],
+            'grammar': list(app.Grammar(volume_prefix='x')),
+            'file_index': 0, 'offset': 0, 'totals': {},
+        })
+
+        with pytest.raises(ValueError):
+            process_files(input_files, checkpoint)
+
+
+class TestBatchCLI:
+    """Test the batch command line"""
+
+    def test_batch_writes_csv(self, input_files, tmp_path):
+        """Test that the batch command writes the ranking as CSV"""
+        output = tmp_path / 'out.csv'
+
+        assert cli(['batch', *input_files, '-o', str(output)]) == 0
+
+        written = pd.read_csv(output)
+        expected = process_files(input_files).reset_index(drop=True)
+        pd.testing.assert_frame_equal(written, expected)
+
+    def test_batch_requires_output(self, input_files):
+        """Test that the output option is mandatory"""
+        with pytest.raises(SystemExit):
+            cli(['batch', *input_files])
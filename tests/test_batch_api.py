@@ -0,0 +1,123 @@
+"""
+Tests for the multi-document batch API.
+Tests per-document rankings, the combined total and the long-format frame.
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import random
+import sys
+import os
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import process_data, process_batch, Grammar
+
+
+DOCUMENTS = [
+    "Entity A|Entity B 5\nEntity A",
+    "",
+    "Entity B 2\nEntity C|Entity A 3\n\n|Entity C|",
+    "Entité 4\nEntity A 1.5",
+]
+
+
+@pytest.fixture
+def random_documents():
+    """Many small documents sharing most of their entities"""
+    rng = random.Random(0)
+    return ["\n".join('|'.join(f'Customer {rng.randrange(200)}' for _ in range(rng.randint(0, 3)))
+                      + f' {rng.randrange(20)}' for _ in range(rng.randint(0, 30)))
+            for _ in range(200)]
+
+
+class TestProcessBatch:
+    """Test aggregating many documents at once"""
+
+    def test_rankings_match_process_data(self, random_documents):
+        """Test that each document's ranking equals process_data on it"""
+        batch = process_batch(random_documents)
+
+        assert len(batch) == len(random_documents)
+        for i, data in enumerate(random_documents):
+            pd.testing.assert_frame_equal(batch.ranking(i), process_data(data))
+
+    def test_total_matches_joined_input(self, random_documents):
+        """Test that the combined total equals processing all documents together"""
+        batch = process_batch(random_documents)
+
+        pd.testing.assert_frame_equal(batch.total(), process_data("\n".join(random_documents)))
+
+    def test_shared_dictionary(self):
+        """Test that each entity name is stored once across documents"""
+        batch = process_batch(DOCUMENTS)
+
+        assert sorted(batch.entities) == sorted(process_data("\n".join(DOCUMENTS))['Entity'])
+        assert batch.entity_ids.dtype == np.int32
+        assert batch.offsets.tolist()[:3] == [0, 2, 2]
+
+    def test_to_frame(self):
+        """Test the long (document, entity, volume, rank) format"""
+        frame = process_batch(DOCUMENTS).to_frame()
+
+        assert list(frame.columns) == ['Document', 'Entity', 'Volume', 'Rank']
+        first = frame[frame['Document'] == 0]
+        assert first['Entity'].tolist() == ['Entity A', 'Entity B']
+        assert first['Volume'].tolist() == [6, 5]
+        assert first['Rank'].tolist() == [1, 2]
+        assert 1 not in frame['Document'].tolist()
+
+    def test_to_frame_ties_ranked_by_name(self):
+        """Test that equal volumes are ranked alphabetically"""
+        frame = process_batch(["Zeta|Alpha|Mid 3"]).to_frame()
+
+        assert frame['Entity'].tolist() == ['Alpha', 'Mid', 'Zeta']
+
+    def test_to_frame_matches_rankings(self, random_documents):
+        """Test that the long frame holds every document's ranking"""
+        batch = process_batch(random_documents)
+        frame = batch.to_frame()
+
+        for i in range(0, len(random_documents), 17):
+            expected = batch.ranking(i)
+            rows = frame[frame['Document'] == i]
+            assert sorted(zip(rows['Entity'], rows['Volume'])) == \
+                sorted(zip(expected['Entity'], expected['Volume']))
+            assert rows['Volume'].is_monotonic_decreasing
+
+    def test_empty_batch(self):
+        """Test that no documents give empty results"""
+        batch = process_batch([])
+
+        assert len(batch) == 0
+        assert batch.total().empty
+        assert batch.to_frame().empty
+
+    def test_grammar(self):
+        """Test that the grammar applies to every document"""
+        grammar = Grammar(row_separator=';', entity_separator=',')
+
+        batch = process_batch(["A,B 2;A", "B 3"], grammar)
+
+        assert dict(zip(batch.total()['Entity'], batch.total()['Volume'])) == {'A': 3, 'B': 5}
+
+    def test_decimal_documents_keep_their_dtype(self):
+        """Test that whole-number documents stay integer next to fractional ones"""
+        grammar = Grammar(numbers='decimal')
+        documents = ["A 2\nB 1", "A 1.5\nC 2"]
+
+        batch = process_batch(documents, grammar)
+
+        for i, data in enumerate(documents):
+            pd.testing.assert_frame_equal(batch.ranking(i), process_data(data, grammar))
+        pd.testing.assert_frame_equal(batch.total(), process_data("\n".join(documents), grammar))
+
+    def test_overflow_escalates(self):
+        """Test that totals beyond int64 stay exact"""
+        grammar = Grammar(numbers='decimal')
+        batch = process_batch(["A 9223372036854775807", "A 9223372036854775807"], grammar)
+
+        total = batch.total()
+
+        assert total['Volume'].tolist() == [2 * 9223372036854775807]
+        assert total.attrs['volume_overflow'] is True
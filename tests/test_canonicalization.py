@@ -0,0 +1,159 @@
+"""
+Tests for near-duplicate entity detection and merging.
+Tests normalization, MinHash candidate detection and canonical merging.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    process_data,
+    find_near_duplicates,
+    canonicalize_entities,
+    _normalize_entity,
+)
+
+
+class TestNormalization:
+    """Test the comparison key used for entity names"""
+
+    def test_case_is_folded(self):
+        """Test that case variants share a key"""
+        assert _normalize_entity('Entity A') == _normalize_entity('ENTITY a')
+
+    def test_whitespace_is_collapsed(self):
+        """Test that spacing variants share a key"""
+        assert _normalize_entity('Entity   A') == _normalize_entity(' Entity A')
+
+    def test_punctuation_is_kept(self):
+        """Test that names differing in punctuation get different keys"""
+        assert _normalize_entity('C#') != _normalize_entity('C')
+        assert _normalize_entity('Acme-Corp.') == 'acme-corp.'
+
+
+class TestFindNearDuplicates:
+    """Test merge proposals"""
+
+    def test_empty_result(self):
+        """Test that an empty result yields no proposals"""
+        merges = find_near_duplicates(process_data(""))
+
+        assert len(merges) == 0
+        assert list(merges.columns) == ['Entity', 'Canonical', 'Volume']
+
+    def test_case_variants_proposed(self):
+        """Test that case variants are merged into the highest-volume name"""
+        df = process_data("Entity A 5\nentity a 2\nENTITY A")
+        merges = find_near_duplicates(df)
+
+        assert len(merges) == 2
+        assert set(merges['Canonical']) == {'Entity A'}
+        assert set(merges['Entity']) == {'entity a', 'ENTITY A'}
+
+    def test_typo_variant_proposed(self):
+        """Test that a small typo in a long name is detected"""
+        df = process_data("International Business Machines 10\nInternational Business Machine 2")
+        merges = find_near_duplicates(df)
+
+        assert len(merges) == 1
+        assert merges.iloc[0]['Entity'] == 'International Business Machine'
+        assert merges.iloc[0]['Canonical'] == 'International Business Machines'
+
+    def test_distinct_entities_not_proposed(self):
+        """Test that similar but distinct short names are kept apart"""
+        df = process_data("Entity A|Entity B|Entity C")
+
+        assert len(find_near_duplicates(df)) == 0
+
+    def test_punctuation_variants_compared_by_similarity(self):
+        """Test that punctuation-only differences must pass the threshold"""
+        df = process_data("C++ 9\nC# 5\nC 3\n??? 2\n--- 4")
+        assert len(find_near_duplicates(df)) == 0
+
+        df = process_data("International Business Machines Corp. 10\nInternational Business Machines Corp 2")
+        merges = find_near_duplicates(df)
+        assert merges[['Entity', 'Canonical']].values.tolist() == [
+            ['International Business Machines Corp', 'International Business Machines Corp.']]
+
+    def test_empty_names_not_merged(self):
+        """Test that names with an empty key are never merged"""
+        df = pd.DataFrame({'Entity': ['', ' ', 'Entity A', 'entity a'], 'Volume': [5, 4, 3, 2]})
+        merges = find_near_duplicates(df)
+
+        assert merges['Entity'].tolist() == ['entity a']
+
+    def test_threshold_controls_merging(self):
+        """Test that a lower threshold merges less similar names"""
+        df = process_data("Entity A|Entity AB")
+
+        assert len(find_near_duplicates(df)) == 0
+        assert len(find_near_duplicates(df, threshold=0.5)) == 1
+
+    def test_invalid_band_configuration(self):
+        """Test that num_perm must split evenly into bands"""
+        with pytest.raises(ValueError):
+            find_near_duplicates(process_data("Entity A"), num_perm=10, bands=3)
+
+    def test_many_distinct_entities(self):
+        """Test that unrelated names produce no proposals at scale"""
+        data = "\n".join(f"Entity{i:05d}xyz{i * 7919 % 10007}" for i in range(2000))
+        merges = find_near_duplicates(process_data(data), threshold=0.95)
+
+        assert len(merges) == 0
+
+    def test_matches_pairwise_jaccard(self):
+        """Test the vectorized candidate check against pairwise n-gram Jaccard"""
+        names = ['Northwind Traders', 'Northwind Trader', 'northwind  traders', 'Contoso Ltd',
+                 'Contoso Ltd.', 'Contoso', 'Fabrikam Inc', 'Fabrikam, Inc.', 'Adventure Works']
+        df = pd.DataFrame({'Entity': names, 'Volume': range(len(names), 0, -1)})
+
+        def shingles(name):
+            padded = f' {_normalize_entity(name)} '
+            return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+        for threshold in (0.6, 0.8, 0.95):
+            merged = set(find_near_duplicates(df, threshold=threshold)['Entity'])
+            for name in names[1:]:
+                similar = any(
+                    len(shingles(name) & shingles(other)) >= threshold * len(shingles(name) | shingles(other))
+                    for other in names[:names.index(name)])
+                assert (name in merged) == similar, (threshold, name)
+
+
+class TestCanonicalizeEntities:
+    """Test applying merges to a result"""
+
+    def test_volumes_summed_under_canonical_name(self):
+        """Test that merged volumes are summed"""
+        df = process_data("Entity A 3\nentity  a\nEntity B 2")
+        result = canonicalize_entities(df)
+
+        assert len(result) == 2
+        assert result.iloc[0]['Entity'] == 'Entity A'
+        assert result.iloc[0]['Volume'] == 4
+
+    def test_result_format_matches_process_data(self):
+        """Test that the merged result keeps the process_data format"""
+        df = process_data("Entity A 3\nentity a|Entity B 5")
+        result = canonicalize_entities(df)
+
+        assert list(result.columns) == ['Entity', 'Volume']
+        assert result['Volume'].is_monotonic_decreasing
+        assert result['Volume'].sum() == df['Volume'].sum()
+
+    def test_no_merges_returns_input(self):
+        """Test that a result without duplicates is returned unchanged"""
+        df = process_data("Entity A|Entity B 5")
+
+        pd.testing.assert_frame_equal(canonicalize_entities(df), df)
+
+    def test_precomputed_merges_applied(self):
+        """Test that reviewed proposals can be applied directly"""
+        df = process_data("Entity A 3\nentity a\nEntity B")
+        merges = find_near_duplicates(df)
+        result = canonicalize_entities(df, merges)
+
+        assert len(result) == 2
@@ -0,0 +1,109 @@
+"""
+Tests for the downsampled chart summaries.
+Tests the top-N "Other" bucket, the cumulative share curve and the histogram.
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    process_data, top_entities_with_other, cumulative_share, volume_histogram
+)
+
+
+@pytest.fixture
+def long_tail():
+    """A sorted result with many entities and a long-tailed volume distribution"""
+    volumes = np.sort(np.random.default_rng(0).zipf(1.6, 100000))[::-1]
+    return pd.DataFrame({'Entity': [f'Entity {i}' for i in range(len(volumes))],
+                         'Volume': volumes})
+
+
+class TestTopEntitiesWithOther:
+    """Test the ranked bar chart data"""
+
+    def test_other_bucket(self, long_tail):
+        """Test that the tail is summed into one Other row"""
+        top = top_entities_with_other(long_tail, n=10)
+
+        assert len(top) == 11
+        assert top['Entity'].tolist()[:10] == long_tail['Entity'].tolist()[:10]
+        assert top['Entity'].iloc[-1] == 'Other (99990 entities)'
+        assert top['Volume'].sum() == long_tail['Volume'].sum()
+
+    def test_no_other_when_everything_fits(self):
+        """Test that small results are returned unchanged"""
+        df = process_data("Entity A 5\nEntity B 3")
+
+        top = top_entities_with_other(df, n=10)
+
+        assert top['Entity'].tolist() == ['Entity A', 'Entity B']
+
+    def test_empty(self):
+        """Test that an empty result gives an empty chart"""
+        assert top_entities_with_other(process_data('')).empty
+
+
+class TestCumulativeShare:
+    """Test the cumulative share curve"""
+
+    def test_decimated_and_exact(self, long_tail):
+        """Test that the curve is bounded in size and exact at its points"""
+        share = cumulative_share(long_tail, max_points=100)
+        cumulative = long_tail['Volume'].cumsum() / long_tail['Volume'].sum()
+
+        assert len(share) <= 100
+        assert share['Entities'].iloc[0] == 1
+        assert share['Entities'].iloc[-1] == len(long_tail)
+        assert share['Share'].iloc[-1] == pytest.approx(1.0)
+        assert np.allclose(share['Share'], cumulative.iloc[share['Entities'] - 1])
+        assert share['Share'].is_monotonic_increasing
+
+    def test_small_result(self):
+        """Test that small results keep every rank"""
+        share = cumulative_share(process_data("Entity A 3\nEntity B 1"))
+
+        assert share['Entities'].tolist() == [1, 2]
+        assert share['Share'].tolist() == [0.75, 1.0]
+
+    def test_zero_total(self):
+        """Test that all-zero volumes do not divide by zero"""
+        share = cumulative_share(process_data("Entity A 0\nEntity B 0"))
+
+        assert share['Share'].tolist() == [0.0, 0.0]
+
+    def test_empty(self):
+        """Test that an empty result gives an empty curve"""
+        assert cumulative_share(process_data('')).empty
+
+
+class TestVolumeHistogram:
+    """Test the binned volume histogram"""
+
+    def test_counts_every_entity(self, long_tail):
+        """Test that bins are bounded and cover all entities"""
+        histogram = volume_histogram(long_tail, bins=30)
+
+        assert len(histogram) <= 30
+        assert histogram['Entities'].sum() == len(long_tail)
+
+    def test_log_bins_for_wide_ranges(self, long_tail):
+        """Test that long-tailed volumes get logarithmic bins"""
+        histogram = volume_histogram(long_tail, bins=30)
+
+        # With linear bins nearly every entity would fall into the first bin
+        assert histogram['Entities'].iloc[0] < 0.9 * len(long_tail)
+
+    def test_single_volume(self):
+        """Test that identical volumes form one bin"""
+        histogram = volume_histogram(process_data("Entity A\nEntity B"))
+
+        assert histogram['Entities'].tolist() == [2]
+
+    def test_empty(self):
+        """Test that an empty result gives an empty histogram"""
+        assert volume_histogram(process_data('')).empty
@@ -0,0 +1,51 @@
+"""
+Tests for chunked processing.
+Tests that aggregating in chunks matches process_data and can be resumed.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import process_data, iter_process_chunks, _totals_to_frame
+
+
+DATA = "\n".join(f"Entity {i % 13}x|Entity {i % 7}y {i % 5}" for i in range(1000))
+
+
+class TestIterProcessChunks:
+    """Test chunked aggregation"""
+
+    @pytest.mark.parametrize('chunk_lines', [1, 7, 100, 5000])
+    def test_matches_process_data(self, chunk_lines):
+        """Test that chunked processing gives the process_data result"""
+        totals = {}
+        for _ in iter_process_chunks(DATA.split('\n'), totals, chunk_lines=chunk_lines):
+            pass
+
+        pd.testing.assert_frame_equal(_totals_to_frame(totals), process_data(DATA))
+
+    def test_yields_positions(self):
+        """Test that the position after each chunk is yielded"""
+        rows = ['Entity A'] * 25
+
+        assert list(iter_process_chunks(rows, {}, chunk_lines=10)) == [10, 20, 25]
+
+    def test_empty_input(self):
+        """Test that empty input yields nothing"""
+        assert list(iter_process_chunks([], {})) == []
+
+    def test_resume_from_position(self):
+        """Test that stopping and resuming gives the same totals"""
+        rows = DATA.split('\n')
+        totals = {}
+        chunks = iter_process_chunks(rows, totals, chunk_lines=100)
+        position = next(chunks)
+        chunks.close()
+
+        for _ in iter_process_chunks(rows, totals, start=position, chunk_lines=100):
+            pass
+
+        pd.testing.assert_frame_equal(_totals_to_frame(totals), process_data(DATA))
@@ -0,0 +1,166 @@
+"""
+Tests for transparent decompression of gzip, bz2, xz and zstd inputs.
+Tests magic byte detection, the file, batch and upload paths and error handling.
+"""
+import pytest
+import pandas as pd
+import bz2
+import gzip
+import io
+import lzma
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    process_data, process_file, process_files, detect_compression, open_decompressed, cli
+)
+
+
+SAMPLE = "Entity A|Entity B 5\nEntity A\n\n|Entity C|\nEntity B 2\nEntité 3\nEntity A 1.5"
+
+COMPRESSORS = {
+    'gzip': (gzip.compress, '.gz'),
+    'bz2': (bz2.compress, '.bz2'),
+    'xz': (lzma.compress, '.xz'),
+}
+
+
+class TestDetectCompression:
+    """Test recognising compressed input from its first bytes"""
+
+    @pytest.mark.parametrize('compression', sorted(COMPRESSORS))
+    def test_detects_format(self, compression):
+        """Test that each supported format is recognised"""
+        compress = COMPRESSORS[compression][0]
+        f = io.BytesIO(compress(SAMPLE.encode('utf-8')))
+
+        assert detect_compression(f) == compression
+        assert f.tell() == 0
+
+    def test_detects_zstd_magic(self):
+        """Test that zstd frames are recognised without zstandard installed"""
+        assert detect_compression(io.BytesIO(b'\x28\xb5\x2f\xfd\x00\x00')) == 'zstd'
+
+    def test_plain_input(self):
+        """Test that plain text and short inputs are not treated as compressed"""
+        assert detect_compression(io.BytesIO(SAMPLE.encode('utf-8'))) is None
+        assert detect_compression(io.BytesIO(b'')) is None
+        assert detect_compression(io.BytesIO(b'B')) is None
+
+    def test_peekable_stream_not_consumed(self, tmp_path):
+        """Test that buffered files are inspected with peek"""
+        path = tmp_path / 'input.gz'
+        path.write_bytes(gzip.compress(b'Entity A 5\n'))
+
+        with open(path, 'rb') as f:
+            assert detect_compression(f) == 'gzip'
+            assert f.read(2) == b'\x1f\x8b'
+
+    def test_plain_input_returned_unwrapped(self):
+        """Test that plain input is read directly"""
+        f = io.BytesIO(b'Entity A 5\n')
+
+        assert open_decompressed(f) is f
+
+    def test_zstd_requires_zstandard(self):
+        """Test that a missing optional dependency is reported clearly"""
+        with patch.dict(sys.modules, {'zstandard': None}):
+            with pytest.raises(ImportError, match='zstandard'):
+                open_decompressed(io.BytesIO(b'\x28\xb5\x2f\xfd\x00\x00'))
+
+
+class TestCompressedFiles:
+    """Test the file, batch and upload paths on compressed input"""
+
+    @pytest.mark.parametrize('compression', sorted(COMPRESSORS))
+    def test_process_file_matches_process_data(self, compression, tmp_path):
+        """Test that compressed text gives the same ranking as plain text"""
+        compress, suffix = COMPRESSORS[compression]
+        path = tmp_path / f'export.txt{suffix}'
+        path.write_bytes(compress(SAMPLE.encode('utf-8')))
+
+        pd.testing.assert_frame_equal(process_file(str(path)), process_data(SAMPLE))
+
+    def test_format_inferred_under_compression_suffix(self, tmp_path):
+        """Test that export.csv.gz is read as CSV"""
+        path = tmp_path / 'export.csv.gz'
+        path.write_bytes(gzip.compress(b"Entity,Volume\nEntity A,3\nEntity B,2\n"))
+
+        result = process_file(str(path))
+
+        assert dict(zip(result['Entity'], result['Volume'])) == {'Entity A': 3, 'Entity B': 2}
+
+    def test_detected_without_suffix(self):
+        """Test that an upload is decompressed based on content, not name"""
+        upload = io.BytesIO(gzip.compress(b'{"Entity": "A", "Volume": 4}\n'))
+        upload.name = 'export.jsonl'
+
+        result = process_file(upload)
+
+        assert result['Volume'].tolist() == [4]
+        assert not upload.closed
+
+    def test_concatenated_gzip_members(self, tmp_path):
+        """Test that multi-member gzip files (e.g. appended logs) are read fully"""
+        path = tmp_path / 'export.txt.gz'
+        path.write_bytes(gzip.compress(b'Entity A 1\n') + gzip.compress(b'Entity A 2\n'))
+
+        assert process_file(str(path))['Volume'].tolist() == [3]
+
+    def test_corrupt_input(self, tmp_path):
+        """Test that damaged archives raise ValueError"""
+        path = tmp_path / 'export.txt.gz'
+        path.write_bytes(gzip.compress(SAMPLE.encode('utf-8') * 100)[:40])
+
+        with pytest.raises(ValueError, match='decompress'):
+            process_file(str(path))
+
+    def test_batch_mixed_inputs(self, tmp_path):
+        """Test that process_files handles plain and compressed files together"""
+        plain = tmp_path / 'part_1.txt'
+        plain.write_text(SAMPLE, encoding='utf-8')
+        packed = tmp_path / 'part_2.txt.xz'
+        packed.write_bytes(lzma.compress(SAMPLE.encode('utf-8')))
+
+        result = process_files([str(plain), str(packed)])
+
+        pd.testing.assert_frame_equal(result, process_data(SAMPLE + "\n" + SAMPLE))
+
+    def test_batch_resume_compressed(self, tmp_path):
+        """Test that a checkpoint offset into a compressed file resumes correctly"""
+        lines = [f"Entity {i % 13}|Entity {i % 7} {i % 5}" for i in range(500)]
+        path = tmp_path / 'export.txt.gz'
+        path.write_bytes(gzip.compress("\n".join(lines).encode('utf-8')))
+        checkpoint = str(tmp_path / 'job.ckpt')
+
+        import Metric_multi_entity_analysis as app
+        original = app._aggregate_rows
+        calls = {'n': 0}
+
+        def crash_after_300(rows, totals, parse_row=app._parse_row):
+            rows = list(rows)
+            calls['n'] += len(rows)
+            if calls['n'] > 300:
+                raise KeyboardInterrupt
+            return original(rows, totals, parse_row)
+
+        with patch.object(app, '_aggregate_rows', crash_after_300):
+            with pytest.raises(KeyboardInterrupt):
+                process_files([str(path)], checkpoint, checkpoint_every=100)
+        assert os.path.exists(checkpoint)
+
+        result = process_files([str(path)], checkpoint, checkpoint_every=100)
+
+        pd.testing.assert_frame_equal(result, process_data("\n".join(lines)))
+
+    def test_cli_batch(self, tmp_path):
+        """Test that the batch command reads compressed inputs"""
+        path = tmp_path / 'export.txt.bz2'
+        path.write_bytes(bz2.compress(SAMPLE.encode('utf-8')))
+        output = tmp_path / 'ranking.csv'
+
+        assert cli(['batch', str(path), '-o', str(output)]) == 0
+        assert pd.read_csv(output)['Volume'].tolist() == process_data(SAMPLE)['Volume'].tolist()
@@ -0,0 +1,102 @@
+"""
+Differential tests of every processing engine against process_data.
+Runs the fuzzing harness in differential.py at a size suitable for CI.
+"""
+import pytest
+import sys
+import os
+import random
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import process_data
+from tests.differential import (
+    ENGINES,
+    ADVERSARIAL,
+    generate_input,
+    generate_export,
+    diverges,
+    minimize,
+    run_differential,
+    time_engines,
+)
+
+
+class TestEnginesAgree:
+    """Test that all engines match the oracle"""
+
+    @pytest.mark.parametrize('name', sorted(ENGINES))
+    def test_adversarial_inputs(self, name):
+        """Test each engine on the hand-written quirk inputs"""
+        failing = [data for data in ADVERSARIAL if diverges(ENGINES[name], data)]
+
+        assert failing == []
+
+    def test_random_inputs(self):
+        """Test all engines on random inputs"""
+        counterexamples = run_differential(cases=150, seed=1)
+
+        assert [(case['engine'], case['input']) for case in counterexamples] == []
+
+
+class TestHarness:
+    """Test the harness itself"""
+
+    def test_generation_is_reproducible(self):
+        """Test that the same seed gives the same inputs"""
+        first = [generate_input(random.Random(5)) for _ in range(3)]
+        second = [generate_input(random.Random(5)) for _ in range(3)]
+
+        assert first == second
+
+    def test_broken_engine_detected_and_minimized(self):
+        """Test that a divergence is found and shrunk to a small input"""
+        def ignores_volumes(data):
+            return process_data('\n'.join(row.rsplit(' ', 1)[0] for row in data.split('\n')))
+
+        counterexamples = run_differential(cases=50, seed=0, engines={'broken': ignores_volumes})
+
+        assert len(counterexamples) == 1
+        case = counterexamples[0]
+        assert case['engine'] == 'broken'
+        assert len(case['input']) <= 4
+        assert diverges(ignores_volumes, case['input'])
+
+    def test_raising_engine_detected(self):
+        """Test that an engine raising an exception counts as divergent"""
+        def crashes(data):
+            raise RuntimeError('boom')
+
+        counterexamples = run_differential(cases=0, engines={'crashes': crashes})
+
+        assert counterexamples[0]['input'] == ''
+        assert isinstance(counterexamples[0]['actual'], RuntimeError)
+
+    def test_minimize_removes_lines_then_characters(self):
+        """Test that minimization keeps only what the failure needs"""
+        result = minimize("noise\nkeep XY here\nmore noise", lambda d: 'XY' in d)
+
+        assert result == 'XY'
+
+    @pytest.mark.xfail(strict=True, reason='process_data sums an int64 column in integer mode, '
+                       'which wraps around on overflow, while the dictionary-based engines keep '
+                       'exact Python integers (only numbers="decimal" escalates)')
+    def test_int64_overflow_agrees(self):
+        """Test that engines agree with the oracle on sums beyond int64"""
+        data = "Entity A 9223372036854775807\nEntity A 9223372036854775807"
+
+        assert not diverges(ENGINES['file'], data)
+
+    def test_timing_report(self):
+        """Test that every engine and the oracle are timed"""
+        timings = time_engines(ADVERSARIAL, repeat=1)
+
+        assert set(timings) == {'process_data', *ENGINES}
+        assert all(seconds >= 0 for seconds in timings.values())
+
+    def test_export_timing_corpus(self):
+        """Test that export-like timing inputs are well-formed and agree across engines"""
+        data = generate_export(random.Random(2), 200)
+
+        assert len(data.split('\n')) == 200
+        assert not [name for name, engine in ENGINES.items() if diverges(engine, data)]
@@ -0,0 +1,207 @@
+"""
+Tests for include/exclude entity filtering.
+Tests the rule syntax, the compiled multi-pattern matcher and filtering
+while parsing in the processing entry points.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+import io
+import random
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Metric_multi_entity_analysis as app
+from Metric_multi_entity_analysis import (
+    EntityFilter, EntityMatcher, Grammar, cli, compile_parser, parse_filter_rules,
+    process_batch, process_data, process_file, process_files
+)
+
+
+DATA = (
+    "acct-1|test-acct 5\n"
+    "acct-2|svc-bot7 3\n"
+    "tmp-9|acct-1\n"
+    "the|acct-3 2\n"
+)
+
+
+class TestRules:
+    """Test reading and normalizing filter rules"""
+
+    def test_parse_filter_rules(self):
+        """Test one rule per line with blank lines skipped"""
+        assert parse_filter_rules("the\n\n  prefix:tmp- \r\nre:^a$\n") == ('the', 'prefix:tmp-', 're:^a$')
+
+    def test_entity_filter_hashable(self):
+        """Test that rule lists become tuples so grammars stay hashable"""
+        filters = EntityFilter(include=['prefix:a'], exclude='the')
+
+        assert filters == EntityFilter(('prefix:a',), ('the',))
+        assert hash(Grammar(filters=filters)) == hash(Grammar(filters=EntityFilter(['prefix:a'], ['the'])))
+
+
+class TestEntityMatcher:
+    """Test the compiled multi-pattern matcher"""
+
+    def test_rule_kinds(self):
+        """Test exact, prefix, substring and regular expression rules"""
+        matcher = EntityMatcher(['Entity A', 'exact:re:x', 'prefix:tmp-', 'contains:bot', r're:\d{3}$'])
+
+        for name in ('Entity A', 're:x', 'tmp-1', 'svc-bot', 'acct-123'):
+            assert matcher.matches(name), name
+        for name in ('Entity AB', 'x', 'a-tmp-1', 'svc-bo', 'acct-12'):
+            assert not matcher.matches(name), name
+
+    def test_unknown_kind_is_exact(self):
+        """Test that a name containing a colon is matched as a whole"""
+        matcher = EntityMatcher(['host:db1'])
+        assert matcher.matches('host:db1')
+        assert not matcher.matches('host')
+
+    def test_substrings_match_naive_search(self):
+        """Test the Aho-Corasick automaton against str.__contains__ on random words"""
+        rng = random.Random(7)
+        words = {''.join(rng.choice('abc') for _ in range(rng.randint(1, 5))) for _ in range(40)}
+        matcher = EntityMatcher([f'contains:{word}' for word in words])
+
+        for _ in range(2000):
+            name = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 12)))
+            assert matcher.matches(name) == any(word in name for word in words), name
+
+    def test_overlapping_substrings(self):
+        """Test words reachable only through failure links"""
+        matcher = EntityMatcher(['contains:she', 'contains:hers', 'contains:his'])
+
+        assert matcher.matches('ushers')
+        assert matcher.matches('ahishe')
+        assert not matcher.matches('sh')
+
+    def test_empty_substring_matches_everything(self):
+        """Test that an empty substring rule matches every name"""
+        assert EntityMatcher(['contains:']).matches('anything')
+
+    def test_regexes_with_same_group_name(self):
+        """Test regular expressions that cannot be joined into one alternation"""
+        matcher = EntityMatcher([r're:(?P<n>\d)x', r're:(?P<n>\d)y'])
+        assert matcher.matches('1y')
+        assert not matcher.matches('yy')
+
+    def test_inline_flags_stay_scoped(self):
+        """Test that an inline flag of one rule does not apply to the other rules"""
+        matcher = EntityMatcher(['re:(?i)foo', 're:Bar', r're:\d$'])
+
+        assert matcher.matches('FOO')
+        assert matcher.matches('Bar')
+        assert matcher.matches('x1')
+        assert not matcher.matches('bar')
+        assert not matcher.matches('BAR')
+        # The flagged rule is compiled on its own, the others share one alternation
+        assert len(matcher._regexes) == 2
+
+    def test_scoped_flags_joined(self):
+        """Test that flags scoped to a group keep the rule in the alternation"""
+        matcher = EntityMatcher(['re:(?i:foo)', 're:Bar'])
+
+        assert matcher.matches('FOO')
+        assert not matcher.matches('bar')
+        assert len(matcher._regexes) == 1
+
+    def test_invalid_regex(self):
+        """Test that an invalid regular expression names its rule"""
+        with pytest.raises(ValueError, match=r"re:\("):
+            EntityMatcher(['re:('])
+
+
+class TestFilteredProcessing:
+    """Test filtering entities while parsing"""
+
+    def test_exclude(self):
+        """Test that excluded entities are dropped and others keep their volumes"""
+        filters = EntityFilter(exclude=['the', 'contains:test', 'prefix:tmp-', r're:bot\d+$'])
+        df = process_data(DATA, Grammar(filters=filters))
+
+        assert dict(zip(df['Entity'], df['Volume'])) == {'acct-1': 6, 'acct-2': 3, 'acct-3': 2}
+
+    def test_include_and_exclude(self):
+        """Test that include rules select entities before exclusions apply"""
+        filters = EntityFilter(include=['prefix:acct-', 'prefix:svc-'], exclude=['acct-2'])
+        df = process_data(DATA, Grammar(filters=filters))
+
+        assert sorted(df['Entity']) == ['acct-1', 'acct-3', 'svc-bot7']
+
+    def test_matches_post_filter(self):
+        """Test filtering while parsing against filtering the full result"""
+        rng = random.Random(3)
+        data = "\n".join("|".join(f"{rng.choice(['a', 'b', 'ab'])}{rng.randrange(50)}"
+                                  for _ in range(rng.randint(1, 3))) + f" {rng.randint(1, 9)}"
+                         for _ in range(500))
+        filters = EntityFilter(include=['prefix:a'], exclude=['contains:1', 'b7', 're:^ab?4'])
+
+        full = process_data(data)
+        names = full['Entity']
+        keep = (names.str.startswith('a') & ~names.str.contains('1') & (names != 'b7')
+                & ~names.str.contains('^ab?4'))
+        expected = full[keep].sort_values(['Volume', 'Entity']).reset_index(drop=True)
+        result = process_data(data, Grammar(filters=filters))
+        pd.testing.assert_frame_equal(result.sort_values(['Volume', 'Entity']).reset_index(drop=True),
+                                      expected)
+
+    def test_empty_filter_is_default(self):
+        """Test that a filter without rules leaves the default parser in place"""
+        assert compile_parser(Grammar(filters=EntityFilter())) is compile_parser(Grammar())
+
+    def test_custom_grammar_and_arrow_backend(self):
+        """Test filters combined with other grammar options and the arrow backend"""
+        grammar = Grammar(';', ',', 'first', filters=EntityFilter(exclude=['B']))
+        for backend in ('pandas', 'arrow'):
+            df = process_data("5 A,B;2 A,C", grammar, backend=backend)
+            assert dict(zip(df['Entity'], df['Volume'])) == {'A': 7, 'C': 2}
+
+    def test_batch(self):
+        """Test that filtered entities are not given entity ids in a batch"""
+        batch = process_batch(["a|b 2", "b|c"], Grammar(filters=EntityFilter(exclude=['b'])))
+        assert batch.entities == ['a', 'c']
+
+    def test_structured_file(self):
+        """Test that filters also apply to CSV and JSON Lines uploads"""
+        grammar = Grammar(filters=EntityFilter(exclude=['contains:test']))
+        upload = io.BytesIO(b"Entity,Volume\nacct-1,3\ntest-acct,5\n")
+        upload.name = 'export.csv'
+        assert process_file(upload, grammar=grammar)['Entity'].tolist() == ['acct-1']
+
+        upload = io.BytesIO(b'{"Entity": ["test-acct", "acct-2"], "Volume": 4}\n')
+        upload.name = 'export.jsonl'
+        assert process_file(upload, grammar=grammar)['Entity'].tolist() == ['acct-2']
+
+    def test_checkpoint_resume(self, tmp_path):
+        """Test that a checkpoint written with filter rules can be resumed"""
+        path = tmp_path / 'input.txt'
+        path.write_text(DATA, encoding='utf-8')
+        checkpoint = str(tmp_path / 'checkpoint.json')
+        grammar = Grammar(filters=EntityFilter(exclude=['the']))
+        state = {
+            'version': app._CHECKPOINT_VERSION, 'paths': [os.path.abspath(path)],
+            'grammar': list(grammar), 'file_index': 1, 'offset': 0, 'totals': {'resumed': 4},
+        }
+
+        app._save_checkpoint(checkpoint, state)
+        with pytest.raises(ValueError, match='different grammar'):
+            process_files([str(path)], checkpoint, grammar=Grammar())
+        assert process_files([str(path)], checkpoint, grammar=grammar)['Entity'].tolist() == ['resumed']
+
+    def test_cli(self, tmp_path):
+        """Test include and exclude rules from the command line and from files"""
+        path = tmp_path / 'input.txt'
+        path.write_text(DATA, encoding='utf-8')
+        rules = tmp_path / 'stop.txt'
+        rules.write_text("the\ncontains:test\n", encoding='utf-8')
+        output = tmp_path / 'out.csv'
+
+        assert cli(['batch', str(path), '-o', str(output), '--exclude-file', str(rules),
+                    '--exclude', 'prefix:tmp-', '--include', 're:^(acct|the|test)']) == 0
+        assert sorted(pd.read_csv(output)['Entity']) == ['acct-1', 'acct-2', 'acct-3']
+
+        with pytest.raises(SystemExit):
+            cli(['batch', str(path), '-o', str(output), '--exclude', 're:('])
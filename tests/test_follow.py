@@ -0,0 +1,216 @@
+"""
+Tests for directory follow mode.
+Tests incremental tailing, rotation, truncation and snapshots.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Metric_multi_entity_analysis as app
+from Metric_multi_entity_analysis import process_data, DirectoryFollower, cli
+
+
+def _append(path, text):
+    """Append text to a file"""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+def _volumes(df):
+    """Entity to volume mapping of a result"""
+    return dict(zip(df['Entity'], df['Volume']))
+
+
+class TestIncrementalTail:
+    """Test reading only newly appended data"""
+
+    def test_initial_poll_matches_process_data(self, tmp_path):
+        """Test that existing content is aggregated like process_data"""
+        data = "Entity A|Entity B 5\nEntity A\n\n|Entity C|\n"
+        (tmp_path / 'feed.log').write_text(data, encoding='utf-8')
+        follower = DirectoryFollower(str(tmp_path))
+
+        follower.poll()
+
+        pd.testing.assert_frame_equal(follower.snapshot(), process_data(data))
+
+    def test_appended_lines_added_once(self, tmp_path):
+        """Test that a second poll only adds the appended lines"""
+        path = tmp_path / 'feed.log'
+        _append(path, "Entity A 2\n")
+        follower = DirectoryFollower(str(tmp_path))
+        follower.poll()
+
+        _append(path, "Entity A 3\nEntity B\n")
+
+        assert follower.poll() == 2
+        assert _volumes(follower.snapshot()) == {'Entity A': 5, 'Entity B': 1}
+
+    def test_partial_line_waits_for_newline(self, tmp_path):
+        """Test that an unterminated line is not processed until complete"""
+        path = tmp_path / 'feed.log'
+        _append(path, "Entity A 2\nEntity B")
+        follower = DirectoryFollower(str(tmp_path))
+        follower.poll()
+
+        assert _volumes(follower.snapshot()) == {'Entity A': 2}
+
+        _append(path, " 7\n")
+        follower.poll()
+
+        assert _volumes(follower.snapshot()) == {'Entity A': 2, 'Entity B': 7}
+
+    def test_idle_poll_reads_nothing(self, tmp_path):
+        """Test that polling without new data processes no lines"""
+        _append(tmp_path / 'feed.log', "Entity A\n")
+        follower = DirectoryFollower(str(tmp_path))
+        follower.poll()
+
+        assert follower.poll() == 0
+
+    def test_small_blocks(self, tmp_path):
+        """Test that lines spanning read blocks are parsed correctly"""
+        data = "".join(f"Entité {i % 7}|Entity B {i}\n" for i in range(200))
+        (tmp_path / 'feed.log').write_text(data, encoding='utf-8')
+        follower = DirectoryFollower(str(tmp_path), block_size=7)
+
+        follower.poll()
+
+        pd.testing.assert_frame_equal(follower.snapshot(), process_data(data))
+
+    def test_pattern_selects_files(self, tmp_path):
+        """Test that only files matching the pattern are followed"""
+        _append(tmp_path / 'feed.log', "Entity A\n")
+        _append(tmp_path / 'notes.txt', "Entity B\n")
+        follower = DirectoryFollower(str(tmp_path), '*.log')
+
+        follower.poll()
+
+        assert _volumes(follower.snapshot()) == {'Entity A': 1}
+
+
+class TestRotationAndTruncation:
+    """Test log rotation and truncation handling"""
+
+    def test_rotation(self, tmp_path):
+        """Test that a rotated file is finished and its replacement read from the start"""
+        path = tmp_path / 'feed.log'
+        _append(path, "Entity A\n")
+        follower = DirectoryFollower(str(tmp_path))
+        follower.poll()
+
+        # Writer appends a last line, then the file is rotated aside
+        _append(path, "Entity B\n")
+        os.rename(path, tmp_path / 'feed.log.1')
+        _append(path, "Entity C\n")
+        follower.poll()
+
+        assert _volumes(follower.snapshot()) == {'Entity A': 1, 'Entity B': 1, 'Entity C': 1}
+
+    def test_rotation_out_of_pattern(self, tmp_path):
+        """Test that a file renamed out of the pattern is still finished"""
+        path = tmp_path / 'feed.log'
+        _append(path, "A 1\n")
+        follower = DirectoryFollower(str(tmp_path), '*.log')
+        follower.poll()
+
+        _append(path, "B 5\n")
+        os.rename(path, tmp_path / 'feed.log.1')
+        _append(path, "C 2\n")
+        follower.poll()
+
+        assert _volumes(follower.snapshot()) == {'A': 1, 'B': 5, 'C': 2}
+
+    def test_late_writes_after_rotation(self, tmp_path):
+        """Test that lines written to a rotated file before its writer reopens are read"""
+        path = tmp_path / 'feed.log'
+        _append(path, "A\n")
+        follower = DirectoryFollower(str(tmp_path), '*.log')
+        follower.poll()
+
+        os.rename(path, tmp_path / 'feed.log.1')
+        _append(tmp_path / 'feed.log.1', "B\n")
+        follower.poll()
+        _append(tmp_path / 'feed.log.1', "C\n")
+        follower.poll()
+        # A poll without new data releases the rotated file
+        follower.poll()
+        _append(tmp_path / 'feed.log.1', "D\n")
+        follower.poll()
+
+        assert _volumes(follower.snapshot()) == {'A': 1, 'B': 1, 'C': 1}
+        assert len(follower._files) == 0
+
+    def test_deleted_file_finished(self, tmp_path):
+        """Test that lines appended just before a file is deleted are read"""
+        path = tmp_path / 'feed.log'
+        _append(path, "A\n")
+        follower = DirectoryFollower(str(tmp_path))
+        follower.poll()
+
+        _append(path, "B\n")
+        os.remove(path)
+        follower.poll()
+
+        assert _volumes(follower.snapshot()) == {'A': 1, 'B': 1}
+
+    def test_truncation(self, tmp_path):
+        """Test that a truncated file is re-read from the beginning"""
+        path = tmp_path / 'feed.log'
+        _append(path, "Entity A 10\nEntity A 10\n")
+        follower = DirectoryFollower(str(tmp_path))
+        follower.poll()
+
+        path.write_text("Entity B\n", encoding='utf-8')
+        follower.poll()
+
+        assert _volumes(follower.snapshot()) == {'Entity A': 20, 'Entity B': 1}
+
+
+class TestErrors:
+    """Test unreadable input"""
+
+    def test_invalid_utf8_replaced(self, tmp_path):
+        """Test that bytes that are not UTF-8 are replaced instead of failing the poll"""
+        (tmp_path / 'feed.log').write_bytes(b"Entit\xe9 A 2\nEntity B\n")
+        follower = DirectoryFollower(str(tmp_path))
+
+        assert follower.poll() == 2
+        assert _volumes(follower.snapshot()) == {'Entit\ufffd A': 2, 'Entity B': 1}
+
+    def test_missing_directory(self, tmp_path):
+        """Test that a missing directory raises OSError"""
+        with pytest.raises(OSError):
+            DirectoryFollower(str(tmp_path / 'missing')).poll()
+
+    def test_close(self, tmp_path):
+        """Test that closing releases the followed files"""
+        _append(tmp_path / 'feed.log', "A\n")
+        follower = DirectoryFollower(str(tmp_path))
+        follower.poll()
+        f = next(iter(follower._files.values()))[0]
+
+        follower.close()
+        assert f.closed
+
+
+class TestFollowCLI:
+    """Test the follow command line"""
+
+    def test_follow_writes_snapshot(self, tmp_path):
+        """Test that the follow command keeps the CSV snapshot current"""
+        feed = tmp_path / 'feed'
+        feed.mkdir()
+        _append(feed / 'a.log', "Entity A 3\n")
+        output = tmp_path / 'live.csv'
+
+        with patch.object(app.time, 'sleep', side_effect=KeyboardInterrupt):
+            assert cli(['follow', str(feed), '-o', str(output)]) == 0
+
+        written = pd.read_csv(output)
+        assert written.iloc[0]['Entity'] == 'Entity A'
+        assert written.iloc[0]['Volume'] == 3
@@ -0,0 +1,171 @@
+"""
+Tests for configurable input grammars.
+Tests separators, volume placement, parser compilation and caching.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    process_data,
+    process_files,
+    compile_parser,
+    cli,
+    Grammar,
+    DEFAULT_GRAMMAR,
+    EntityFilter,
+    _PARSER_CACHE_SIZE,
+    _parse_row,
+)
+
+
+def _volumes(df):
+    """Entity to volume mapping of a result"""
+    return dict(zip(df['Entity'], df['Volume']))
+
+
+class TestCompileParser:
+    """Test parser compilation"""
+
+    def test_default_grammar_uses_reference_parser(self):
+        """Test that the default grammar keeps the process_data parser"""
+        assert compile_parser(DEFAULT_GRAMMAR) is _parse_row
+
+    def test_parsers_are_cached(self):
+        """Test that compiling an equal grammar twice reuses the parser"""
+        first = compile_parser(Grammar(entity_separator=';', volume_prefix='x'))
+        second = compile_parser(Grammar(entity_separator=';', volume_prefix='x'))
+
+        assert first is second
+
+    def test_parser_cache_bounded(self):
+        """Test that grammars with ever new filter rules do not grow the cache without bound"""
+        for i in range(_PARSER_CACHE_SIZE * 2):
+            compile_parser(Grammar(filters=EntityFilter((f'Entity {i}',), ())))
+
+        assert compile_parser.cache_info().currsize <= _PARSER_CACHE_SIZE
+
+    def test_unknown_volume_position(self):
+        """Test that an unknown volume position is rejected"""
+        with pytest.raises(ValueError):
+            compile_parser(Grammar(volume='middle'))
+
+    def test_empty_separator(self):
+        """Test that empty separators are rejected"""
+        with pytest.raises(ValueError):
+            compile_parser(Grammar(entity_separator=''))
+
+
+class TestSeparators:
+    """Test row and entity separators"""
+
+    def test_semicolon_entities(self):
+        """Test entities separated by semicolons"""
+        result = process_data("Entity A;Entity B 5", Grammar(entity_separator=';'))
+
+        assert _volumes(result) == {'Entity A': 5, 'Entity B': 5}
+
+    def test_comma_entities_keep_pipes(self):
+        """Test that pipes are ordinary characters with another separator"""
+        result = process_data("A|B,C", Grammar(entity_separator=','))
+
+        assert _volumes(result) == {'A|B': 1, 'C': 1}
+
+    def test_custom_row_separator(self):
+        """Test rows separated by semicolons"""
+        result = process_data("Entity A 2;Entity A|Entity B", Grammar(row_separator=';'))
+
+        assert _volumes(result) == {'Entity A': 3, 'Entity B': 1}
+
+    def test_multi_character_separator(self):
+        """Test a separator longer than one character"""
+        result = process_data("A :: B 3", Grammar(entity_separator='::'))
+
+        assert _volumes(result) == {'A': 3, 'B': 3}
+
+
+class TestVolumePlacement:
+    """Test where volumes are read from"""
+
+    def test_leading_volume(self):
+        """Test a volume at the start of the row"""
+        result = process_data("5 Entity A|Entity B\nEntity A", Grammar(volume='first'))
+
+        assert _volumes(result) == {'Entity A': 6, 'Entity B': 5}
+
+    def test_leading_number_alone_is_entity(self):
+        """Test that a number with nothing after it is an entity name"""
+        result = process_data("5", Grammar(volume='first'))
+
+        assert _volumes(result) == {'5': 1}
+
+    def test_trailing_number_ignored_with_leading_volume(self):
+        """Test that trailing numbers stay in the name when volumes lead"""
+        result = process_data("Entity 5", Grammar(volume='first'))
+
+        assert _volumes(result) == {'Entity 5': 1}
+
+    def test_suffix_marker(self):
+        """Test an x-prefixed volume suffix"""
+        result = process_data("Entity A|Entity B x5\nEntity A 3", Grammar(volume_prefix='x'))
+
+        assert _volumes(result) == {'Entity A': 5, 'Entity B': 5, 'Entity A 3': 1}
+
+    def test_leading_marker(self):
+        """Test an x-prefixed leading volume"""
+        result = process_data("x4 Entity A", Grammar(volume='first', volume_prefix='x'))
+
+        assert _volumes(result) == {'Entity A': 4}
+
+    def test_no_volume(self):
+        """Test that every row counts once without volumes"""
+        result = process_data("Entity 5\nEntity 5", Grammar(volume='none'))
+
+        assert _volumes(result) == {'Entity 5': 2}
+
+    def test_marker_is_regex_safe(self):
+        """Test that markers with regex characters are matched literally"""
+        result = process_data("Entity A *3\nEntity B 33", Grammar(volume_prefix='*'))
+
+        assert _volumes(result) == {'Entity A': 3, 'Entity B 33': 1}
+
+
+class TestEquivalence:
+    """Test that compiled parsers follow the reference rules"""
+
+    @pytest.mark.parametrize('data', [
+        "Entity A|Entity B 5\nEntity A",
+        "|Entity A||Entity B|\n\n   \nEntity C 0",
+        "Entity   Name\t5\nEntity -5\nEntity 1.5",
+        "5\nEntity 5 10\nEntité|实体 3",
+    ])
+    def test_comma_grammar_matches_reference(self, data):
+        """Test that only the separator changes with a comma grammar"""
+        result = process_data(data.replace('|', ','), Grammar(entity_separator=','))
+
+        pd.testing.assert_frame_equal(result, process_data(data))
+
+
+class TestFileInputs:
+    """Test grammars with file-based processing"""
+
+    def test_batch_cli_grammar(self, tmp_path):
+        """Test that the batch command accepts grammar options"""
+        path = tmp_path / 'input.txt'
+        path.write_text("3 Entity A;Entity B\n", encoding='utf-8')
+        output = tmp_path / 'out.csv'
+
+        cli(['batch', str(path), '-o', str(output), '--entity-separator', ';', '--volume', 'first'])
+
+        assert _volumes(pd.read_csv(output)) == {'Entity A': 3, 'Entity B': 3}
+
+    def test_file_inputs_require_newline_rows(self, tmp_path):
+        """Test that line-based readers reject other row separators"""
+        path = tmp_path / 'input.txt'
+        path.write_text("Entity A", encoding='utf-8')
+
+        with pytest.raises(ValueError):
+            process_files([str(path)], grammar=Grammar(row_separator=';'))
@@ -0,0 +1,192 @@
+"""
+Tests for the JSON Lines, CSV/TSV and Excel input adapters.
+Tests record parsing, format detection and equivalence with process_data.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+import io
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    process_data,
+    process_file,
+    iter_ndjson_records,
+    iter_csv_records,
+)
+
+
+def _volumes(df):
+    """Entity to volume mapping of a result"""
+    return dict(zip(df['Entity'], df['Volume']))
+
+
+class TestNDJSON:
+    """Test JSON Lines parsing"""
+
+    def test_list_and_string_entities(self):
+        """Test that entity lists and pipe-separated strings are both accepted"""
+        data = b'{"Entity": ["A", "B"], "Volume": 3}\n{"Entity": "A| C |", "Volume": 2}\n'
+
+        records = list(iter_ndjson_records(io.BytesIO(data)))
+
+        assert records == [(['A', 'B'], 3), (['A', 'C'], 2)]
+
+    def test_missing_volume_defaults_to_one(self):
+        """Test that records without a volume count once"""
+        records = list(iter_ndjson_records(io.BytesIO(b'{"Entity": "A"}\n')))
+
+        assert records == [(['A'], 1)]
+
+    def test_invalid_volume_defaults_to_one(self):
+        """Test that non-integer volumes count once, like process_data"""
+        data = b'{"Entity": "A", "Volume": "lots"}\n{"Entity": "B", "Volume": true}\n'
+
+        assert [volume for _, volume in iter_ndjson_records(io.BytesIO(data))] == [1, 1]
+
+    def test_integral_float_volume(self):
+        """Test that floats with an integral value are used as the volume"""
+        data = b'{"Entity": "A", "Volume": 5.0}\n{"Entity": "B", "Volume": 2.5}\n'
+
+        assert [volume for _, volume in iter_ndjson_records(io.BytesIO(data))] == [5, 1]
+
+    def test_negative_volume_defaults_to_one(self):
+        """Test that negative volumes count once, like a trailing "-3" in process_data"""
+        data = b'{"Entity": "A", "Volume": -3}\n{"Entity": "B", "Volume": -2.0}\n'
+
+        assert [volume for _, volume in iter_ndjson_records(io.BytesIO(data))] == [1, 1]
+        assert _volumes(process_data("A -3")) == {'A -3': 1}
+
+    def test_blank_lines_skipped(self):
+        """Test that blank lines are ignored"""
+        data = b'\n{"Entity": "A"}\n\n'
+
+        assert len(list(iter_ndjson_records(io.BytesIO(data)))) == 1
+
+    def test_non_object_rejected(self):
+        """Test that lines that are not JSON objects raise an error"""
+        with pytest.raises(ValueError):
+            list(iter_ndjson_records(io.BytesIO(b'["A"]\n')))
+
+    def test_custom_fields(self):
+        """Test that field names are configurable"""
+        data = b'{"names": ["A"], "hits": 7}\n'
+
+        assert list(iter_ndjson_records(io.BytesIO(data), 'names', 'hits')) == [(['A'], 7)]
+
+
+class TestCSV:
+    """Test CSV and TSV parsing"""
+
+    def test_quoted_fields(self):
+        """Test that quoted names with commas are preserved"""
+        data = b'Entity,Volume\n"Acme, Inc|Beta",4\n'
+
+        assert list(iter_csv_records(io.BytesIO(data))) == [(['Acme, Inc', 'Beta'], 4)]
+
+    def test_missing_volume_column(self):
+        """Test that every row counts once without a volume column"""
+        data = b'Entity\nA\nB\n'
+
+        assert list(iter_csv_records(io.BytesIO(data))) == [(['A'], 1), (['B'], 1)]
+
+    def test_missing_entity_column(self):
+        """Test that a missing entity column raises an error"""
+        with pytest.raises(ValueError):
+            list(iter_csv_records(io.BytesIO(b'Name,Volume\nA,1\n')))
+
+    def test_tsv(self):
+        """Test tab-delimited input"""
+        data = b'Volume\tEntity\n3\tA|B\n'
+
+        assert list(iter_csv_records(io.BytesIO(data), delimiter='\t')) == [(['A', 'B'], 3)]
+
+    def test_utf8_bom(self):
+        """Test that a byte order mark does not hide the first column"""
+        data = 'Entity,Volume\nEntité,2\n'.encode('utf-8-sig')
+
+        assert list(iter_csv_records(io.BytesIO(data))) == [(['Entité'], 2)]
+
+    def test_caller_file_left_open(self):
+        """Test that the caller's file object is not closed"""
+        f = io.BytesIO(b'Entity\nA\n')
+        list(iter_csv_records(f))
+
+        assert not f.closed
+
+
+class TestExcel:
+    """Test Excel parsing"""
+
+    def test_excel_workbook(self, tmp_path):
+        """Test that worksheet rows are aggregated"""
+        openpyxl = pytest.importorskip('openpyxl')
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = 'Export'
+        sheet.append(['Entity', 'Volume'])
+        sheet.append(['Entity A|Entity B', 5])
+        sheet.append(['Entity A', None])
+        sheet.append([None, 3])
+        path = tmp_path / 'export.xlsx'
+        workbook.save(path)
+
+        result = process_file(str(path), sheet='Export')
+
+        assert _volumes(result) == {'Entity A': 6, 'Entity B': 5}
+        assert result['Volume'].dtype == 'int64'
+
+    def test_excel_volumes(self, tmp_path):
+        """Test that whole-number floats count as volumes and negative ones once"""
+        openpyxl = pytest.importorskip('openpyxl')
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['Entity', 'Volume'])
+        sheet.append(['Entity A', 4.0])
+        sheet.append(['Entity B', -4])
+        sheet.append(['Entity C', 1.5])
+        path = tmp_path / 'export.xlsx'
+        workbook.save(path)
+
+        assert _volumes(process_file(str(path))) == {'Entity A': 4, 'Entity B': 1, 'Entity C': 1}
+
+
+class TestProcessFile:
+    """Test format detection and equivalence"""
+
+    def test_text_file_matches_process_data(self, tmp_path):
+        """Test that text files follow the process_data rules"""
+        data = "Entity A|Entity B 5\nEntity A\r\n\n|Entity C|\nEntité 3"
+        path = tmp_path / 'export.txt'
+        path.write_bytes(data.encode('utf-8'))
+
+        pd.testing.assert_frame_equal(process_file(str(path)), process_data(data))
+
+    def test_unknown_extension_is_text(self, tmp_path):
+        """Test that unrecognised extensions are read as text"""
+        path = tmp_path / 'export.log'
+        path.write_text("Entity A 2\n", encoding='utf-8')
+
+        assert _volumes(process_file(str(path))) == {'Entity A': 2}
+
+    def test_format_from_upload_name(self):
+        """Test that file objects are detected by their name attribute"""
+        f = io.BytesIO(b'{"Entity": "A", "Volume": 2}\n')
+        f.name = 'upload.ndjson'
+
+        assert _volumes(process_file(f)) == {'A': 2}
+
+    def test_csv_export_round_trip(self, tmp_path):
+        """Test that the app's own CSV export can be processed again"""
+        expected = process_data("Entity A 10\nEntity B|Entity A 5")
+        path = tmp_path / 'metric_entity_volume.csv'
+        expected.to_csv(path, index=False)
+
+        pd.testing.assert_frame_equal(process_file(str(path)), expected)
+
+    def test_unknown_format_rejected(self):
+        """Test that an unknown explicit format raises an error"""
+        with pytest.raises(ValueError):
+            process_file(io.BytesIO(b''), file_format='parquet')
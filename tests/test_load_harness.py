@@ -0,0 +1,56 @@
+"""
+Smoke tests for the concurrent-session load test harness.
+Runs the harness at a tiny scale so it stays working as the app changes.
+"""
+import sys
+import os
+from unittest.mock import patch
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import process_data
+from tests.load_test import make_input, percentile, run_load_test, format_report
+
+
+class TestHarnessHelpers:
+    """Test input generation and statistics"""
+
+    def test_make_input_is_reproducible(self):
+        """Test that the same seed gives the same paste"""
+        assert make_input(100, 10, seed=3) == make_input(100, 10, seed=3)
+
+    def test_make_input_is_valid(self):
+        """Test that generated input parses into the requested entities"""
+        result = process_data(make_input(500, 20))
+
+        assert 0 < len(result) <= 20
+        assert result['Entity'].str.startswith('Entity-').all()
+
+    def test_percentile(self):
+        """Test percentile interpolation"""
+        values = [1, 2, 3, 4, 5]
+
+        assert percentile(values, 50) == 3
+        assert percentile(values, 100) == 5
+        assert percentile(values, 25) == 2
+
+
+class TestLoadRun:
+    """Test a small end-to-end load run through AppTest"""
+
+    def test_small_run(self):
+        """Test that concurrent sessions process data without errors"""
+        report = run_load_test(sessions=2, lines=50, entities=5, rounds=1, timeout=60)
+
+        assert report['runs'] == 2
+        assert report['errors'] == 0
+        assert report['p50'] <= report['p95'] <= report['p99'] <= report['max']
+        assert 'latency p50' in format_report(report)
+
+    def test_rejected_runs_are_errors(self):
+        """Test that runs rejected by admission control count as errors, not fast runs"""
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_MEMORY_BUDGET': '0'}):
+            report = run_load_test(sessions=2, lines=50, entities=5, rounds=1, timeout=60)
+
+        assert report['runs'] == 2
+        assert report['errors'] == 2
@@ -0,0 +1,259 @@
+"""
+Tests for enrichment from entity mapping tables.
+Tests building and reusing the memory-mapped index, lookups, enrichment and
+re-aggregation by mapped attributes.
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import io
+import random
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Metric_multi_entity_analysis as app
+from Metric_multi_entity_analysis import MappingIndex, cli, open_mapping, process_data
+
+
+MAPPING = (
+    "Entity,Owner,Team\n"
+    "Entity A,alice,core\n"
+    "Entity B,bob,core\n"
+    "Entity C,carol,edge\n"
+)
+
+
+def _write(tmp_path, text, name='mapping.csv'):
+    """Write a mapping table and return its path"""
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def _reference_hash(key):
+    """FNV-1a with the MurmurHash3 finalizer, one key at a time"""
+    value = 0xcbf29ce484222325
+    for byte in key:
+        value = ((value ^ byte) * 0x100000001b3) & 0xffffffffffffffff
+    for shift, multiplier in ((33, 0xff51afd7ed558ccd), (33, 0xc4ceb9fe1a85ec53), (33, 1)):
+        value ^= value >> shift
+        value = (value * multiplier) & 0xffffffffffffffff
+    return value
+
+
+class TestKeyHashes:
+    """Test the vectorized key hashing"""
+
+    def test_matches_reference(self):
+        """Test hashes of keys of mixed lengths, including empty and non-ASCII keys"""
+        keys = [b'', b'a', b'Entity A', 'Entité ✓'.encode('utf-8'), b'x' * 100, b'a']
+        hashes, blob, starts, lengths = app._key_hashes(keys)
+
+        assert hashes.tolist() == [_reference_hash(key) for key in keys]
+        assert [blob[start:start + length].tobytes()
+                for start, length in zip(starts, lengths)] == keys
+
+    def test_no_keys(self):
+        """Test hashing an empty list"""
+        hashes, blob, starts, lengths = app._key_hashes([])
+        assert len(hashes) == len(blob) == len(starts) == len(lengths) == 0
+
+
+class TestMappingIndex:
+    """Test building, opening and querying a mapping index"""
+
+    def test_build_and_lookup(self, tmp_path):
+        """Test that every mapped name is found and others are not"""
+        mapping = MappingIndex.build(_write(tmp_path, MAPPING), str(tmp_path / 'index'))
+
+        assert len(mapping) == 3
+        assert mapping.attributes == ['Owner', 'Team']
+        assert mapping.lookup(['Entity C', 'Entity X', 'Entity A', '']).tolist() == [2, -1, 0, -1]
+
+    def test_many_keys(self, tmp_path):
+        """Test lookups of a table large enough for probe chains"""
+        names = [f'entity-{i}' for i in range(20000)]
+        text = "Entity,Bucket\n" + "".join(f"{name},{i % 7}\n" for i, name in enumerate(names))
+        mapping = MappingIndex.build(_write(tmp_path, text), str(tmp_path / 'index'))
+
+        queries = names[::-1] + [f'other-{i}' for i in range(1000)]
+        found = mapping.lookup(queries)
+        assert found.tolist() == list(range(19999, -1, -1)) + [-1] * 1000
+
+    def test_unicode_and_empty_keys(self, tmp_path):
+        """Test that non-ASCII and empty entity names are mapped"""
+        text = "Entity,Owner\nEntité,élise\n,nobody\n数据,li\n"
+        mapping = MappingIndex.build(_write(tmp_path, text), str(tmp_path / 'index'))
+
+        assert mapping.lookup(['数据', 'Entité', '', 'Entite']).tolist() == [2, 0, 1, -1]
+
+    def test_last_duplicate_wins(self, tmp_path):
+        """Test that a repeated entity takes the values of its last row"""
+        text = MAPPING + "Entity A,dave,edge\n"
+        mapping = MappingIndex.build(_write(tmp_path, text), str(tmp_path / 'index'))
+
+        df = mapping.enrich(pd.DataFrame({'Entity': ['Entity A'], 'Volume': [1]}))
+        assert df.iloc[0].tolist() == ['Entity A', 1, 'dave', 'edge']
+        assert len(mapping) == 3
+
+    def test_tsv_and_selected_attributes(self, tmp_path):
+        """Test tab-separated tables and indexing only some columns"""
+        text = MAPPING.replace(',', '\t')
+        mapping = MappingIndex.build(_write(tmp_path, text, 'mapping.tsv'), str(tmp_path / 'index'),
+                                     attributes=['Team'])
+
+        assert mapping.attributes == ['Team']
+        assert mapping.enrich(pd.DataFrame({'Entity': ['Entity C']}))['Team'].tolist() == ['edge']
+
+    def test_build_from_file_object(self, tmp_path):
+        """Test building from an uploaded binary file"""
+        mapping = MappingIndex.build(io.BytesIO(MAPPING.encode('utf-8')), str(tmp_path / 'index'))
+        assert mapping.lookup(['Entity B']).tolist() == [1]
+
+    def test_empty_table(self, tmp_path):
+        """Test that a table without rows maps nothing"""
+        mapping = MappingIndex.build(_write(tmp_path, "Entity,Owner\n"), str(tmp_path / 'index'))
+
+        assert len(mapping) == 0
+        assert mapping.lookup(['Entity A']).tolist() == [-1]
+
+    def test_missing_columns(self, tmp_path):
+        """Test that missing and reserved columns are rejected"""
+        path = _write(tmp_path, MAPPING)
+        with pytest.raises(ValueError, match='Name'):
+            MappingIndex.build(path, str(tmp_path / 'index'), entity_column='Name')
+        with pytest.raises(ValueError, match='Region'):
+            MappingIndex.build(path, str(tmp_path / 'index'), attributes=['Region'])
+        with pytest.raises(ValueError, match='Volume'):
+            MappingIndex.build(_write(tmp_path, "Name,Volume\nEntity A,3\n"),
+                               str(tmp_path / 'index'), entity_column='Name')
+
+    def test_not_an_index(self, tmp_path):
+        """Test that other files are rejected when opened"""
+        for content in (b'', b'not an index at all, just some bytes here and there'):
+            path = tmp_path / 'other'
+            path.write_bytes(content)
+            with pytest.raises(ValueError):
+                MappingIndex(str(path))
+
+
+class TestEnrichment:
+    """Test adding attributes to results and re-aggregating by them"""
+
+    def test_enrich_matches_merge(self, tmp_path):
+        """Test that enrichment equals a left merge with the mapping table"""
+        path = _write(tmp_path, MAPPING)
+        mapping = MappingIndex.build(path, str(tmp_path / 'index'))
+        df = process_data("Entity A|Entity D 5\nEntity C 2\nEntity B")
+
+        expected = df.merge(pd.read_csv(path), on='Entity', how='left').set_axis(df.index)
+        expected = expected.astype({'Owner': object, 'Team': object})
+        expected = expected.where(expected.notna(), None)
+        pd.testing.assert_frame_equal(mapping.enrich(df), expected)
+
+    def test_enrich_keeps_input(self, tmp_path):
+        """Test that the input result is not modified"""
+        mapping = MappingIndex.build(_write(tmp_path, MAPPING), str(tmp_path / 'index'))
+        df = process_data("Entity A 5")
+
+        mapping.enrich(df)
+        assert df.columns.tolist() == ['Entity', 'Volume']
+
+    def test_reaggregate(self, tmp_path):
+        """Test summing volumes by an attribute, with unmapped entities grouped"""
+        mapping = MappingIndex.build(_write(tmp_path, MAPPING), str(tmp_path / 'index'))
+        df = process_data("Entity A|Entity D 5\nEntity C 2\nEntity B 4\nEntity E 1")
+
+        result = mapping.reaggregate(df, 'Team')
+        assert result.columns.tolist() == ['Team', 'Volume']
+        assert result.values.tolist() == [['core', 9], ['(unmapped)', 6], ['edge', 2]]
+
+    def test_reaggregate_matches_groupby(self, tmp_path):
+        """Test re-aggregation against a pandas merge and groupby"""
+        rng = random.Random(5)
+        text = "Entity,Group\n" + "".join(f"entity-{i},g{rng.randrange(40)}\n" for i in range(3000))
+        path = _write(tmp_path, text)
+        mapping = MappingIndex.build(path, str(tmp_path / 'index'))
+        df = pd.DataFrame({'Entity': [f'entity-{i}' for i in range(0, 4000, 3)],
+                           'Volume': [rng.randrange(1000) for _ in range(0, 4000, 3)]})
+
+        merged = df.merge(pd.read_csv(path), on='Entity', how='left').fillna({'Group': '(unmapped)'})
+        expected = merged.groupby('Group', as_index=False)['Volume'].sum()
+        expected = expected.sort_values(['Volume', 'Group'], ascending=[False, True])
+        pd.testing.assert_frame_equal(mapping.reaggregate(df, 'Group'),
+                                      expected.reset_index(drop=True), check_dtype=False)
+
+    def test_reaggregate_exact_volumes(self, tmp_path):
+        """Test that object volumes beyond int64 are summed exactly"""
+        mapping = MappingIndex.build(_write(tmp_path, MAPPING), str(tmp_path / 'index'))
+        df = pd.DataFrame({'Entity': ['Entity A', 'Entity B'],
+                           'Volume': np.array([2 ** 63, 2 ** 63], dtype=object)})
+
+        assert mapping.reaggregate(df, 'Team')['Volume'].tolist() == [2 ** 64]
+
+    def test_reaggregate_unknown_attribute(self, tmp_path):
+        """Test that grouping by an unmapped column is rejected"""
+        mapping = MappingIndex.build(_write(tmp_path, MAPPING), str(tmp_path / 'index'))
+        with pytest.raises(ValueError, match='Region'):
+            mapping.reaggregate(process_data("Entity A 1"), 'Region')
+
+
+class TestOpenMapping:
+    """Test reusing index files across runs"""
+
+    def test_index_reused(self, tmp_path):
+        """Test that a second open reuses the index file instead of rebuilding"""
+        path = _write(tmp_path, MAPPING)
+        directory = str(tmp_path / 'indexes')
+        first = open_mapping(path, directory=directory)
+        index_path = first.path
+        modified = os.stat(index_path).st_mtime_ns
+        first.close()
+
+        second = open_mapping(path, directory=directory)
+        assert second.path == index_path
+        assert os.stat(index_path).st_mtime_ns == modified
+        assert second.lookup(['Entity B']).tolist() == [1]
+
+    def test_changed_table_rebuilt(self, tmp_path):
+        """Test that a changed table gets a new index"""
+        path = _write(tmp_path, MAPPING)
+        directory = str(tmp_path / 'indexes')
+        first = open_mapping(path, directory=directory)
+
+        _write(tmp_path, MAPPING + "Entity D,dave,edge\n")
+        second = open_mapping(path, directory=directory)
+        assert second.path != first.path
+        assert len(second) == 4
+
+    def test_corrupt_index_rebuilt(self, tmp_path):
+        """Test that a damaged index file is replaced"""
+        path = _write(tmp_path, MAPPING)
+        directory = str(tmp_path / 'indexes')
+        mapping = open_mapping(path, directory=directory)
+        index_path = mapping.path
+        mapping.close()
+
+        with open(index_path, 'r+b') as f:
+            f.truncate(40)
+        assert len(open_mapping(path, directory=directory)) == 3
+
+    def test_cli_mapping(self, tmp_path):
+        """Test enriching and re-aggregating a batch result"""
+        inputs = tmp_path / 'input.txt'
+        inputs.write_text("Entity A|Entity C 5\nEntity B 2\n", encoding='utf-8')
+        path = _write(tmp_path, MAPPING)
+        output = tmp_path / 'out.csv'
+
+        assert cli(['batch', str(inputs), '-o', str(output), '--mapping', path,
+                    '--cache-dir', str(tmp_path / 'cache')]) == 0
+        assert pd.read_csv(output).columns.tolist() == ['Entity', 'Volume', 'Owner', 'Team']
+
+        assert cli(['batch', str(inputs), '-o', str(output), '--mapping', path,
+                    '--group-by', 'Team']) == 0
+        assert pd.read_csv(output).values.tolist() == [['core', 7], ['edge', 5]]
+
+        with pytest.raises(SystemExit):
+            cli(['batch', str(inputs), '-o', str(output), '--group-by', 'Team'])
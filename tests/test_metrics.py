@@ -0,0 +1,216 @@
+"""
+Tests for the processing metrics and their OpenMetrics export.
+Tests the registry, the recorded runs, cache lookups, the endpoint and the CLI.
+"""
+import pytest
+import sys
+import os
+import tracemalloc
+import urllib.request
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Metric_multi_entity_analysis as app
+from Metric_multi_entity_analysis import (
+    MetricsRegistry, METRICS, OPENMETRICS_CONTENT_TYPE, ResultCache, cli, process_batch,
+    process_data, process_file, process_files, serve_metrics
+)
+
+
+def _sample(name, labels):
+    """Return the value of one sample line in the global exposition"""
+    prefix = f'{name}{{{labels}}} '
+    for line in METRICS.render().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+class TestMetricsRegistry:
+    """Test the registry and the OpenMetrics text format"""
+
+    def test_render(self):
+        """Test counters and histograms in the exposition format"""
+        registry = MetricsRegistry()
+        jobs = registry.counter('jobs', 'Jobs run.', ['source'])
+        seconds = registry.histogram('job_seconds', 'Job duration.', [0.1, 1])
+        jobs.inc(source='cli')
+        jobs.inc(2, source='cli')
+        seconds.observe(0.05)
+        seconds.observe(1)
+        seconds.observe(7)
+
+        assert registry.render().splitlines() == [
+            '# TYPE jobs counter',
+            '# HELP jobs Jobs run.',
+            'jobs_total{source="cli"} 3',
+            '# TYPE job_seconds histogram',
+            '# HELP job_seconds Job duration.',
+            'job_seconds_bucket{le="0.1"} 1',
+            'job_seconds_bucket{le="1.0"} 2',
+            'job_seconds_bucket{le="+Inf"} 3',
+            'job_seconds_count 3',
+            'job_seconds_sum 8.05',
+            '# EOF',
+        ]
+
+    def test_label_escaping(self):
+        """Test that quotes, backslashes and newlines in label values are escaped"""
+        registry = MetricsRegistry()
+        registry.counter('files', 'Files.', ['path']).inc(path='a"b\\c\nd')
+
+        assert 'files_total{path="a\\"b\\\\c\\nd"} 1' in registry.render()
+
+    def test_invalid_use(self):
+        """Test that wrong labels, decreasing counters and duplicates are rejected"""
+        registry = MetricsRegistry()
+        jobs = registry.counter('jobs', 'Jobs run.', ['source'])
+
+        with pytest.raises(ValueError):
+            jobs.inc(kind='cli')
+        with pytest.raises(ValueError):
+            jobs.inc(-1, source='cli')
+        with pytest.raises(ValueError):
+            registry.counter('jobs', 'Again.')
+
+    def test_write(self, tmp_path):
+        """Test that the exposition is written to a file"""
+        registry = MetricsRegistry()
+        registry.counter('jobs', 'Jobs run.').inc()
+        path = tmp_path / 'metrics.prom'
+
+        registry.write(str(path))
+
+        assert path.read_text(encoding='utf-8') == registry.render()
+        assert not os.path.exists(f'{path}.tmp')
+
+
+class TestRecordedRuns:
+    """Test the metrics recorded by the processing paths"""
+
+    def test_process_data(self):
+        """Test that a run records its lines, bytes, entities and duration"""
+        runs = _sample('metric_analysis_runs_total', 'source="process_data"')
+        lines = _sample('metric_analysis_lines_total', 'source="process_data"')
+        nbytes = _sample('metric_analysis_bytes_total', 'source="process_data"')
+        entities = _sample('metric_analysis_entities_total', 'source="process_data"')
+        count = app._RUN_SECONDS.count(source='process_data')
+
+        process_data("Entity A|Entity B 5\nEntité 3")
+
+        assert _sample('metric_analysis_runs_total', 'source="process_data"') == runs + 1
+        assert _sample('metric_analysis_lines_total', 'source="process_data"') == lines + 2
+        assert _sample('metric_analysis_bytes_total', 'source="process_data"') == nbytes + 29
+        assert _sample('metric_analysis_entities_total', 'source="process_data"') == entities + 3
+        assert app._RUN_SECONDS.count(source='process_data') == count + 1
+
+    @pytest.mark.parametrize('block_chars', [1, 3, 1 << 16])
+    def test_text_bytes(self, monkeypatch, block_chars):
+        """Test that byte counts measured block by block match the encoded size"""
+        monkeypatch.setattr(app, '_BYTES_BLOCK_CHARS', block_chars)
+        for data in ['', 'Entity A', 'Entité 3', '名前|😀 5\n' * 7, 'a' * 10 + 'é']:
+            assert app._text_bytes(data) == len(data.encode('utf-8'))
+
+    def test_text_bytes_memory(self):
+        """Test that measuring non-ASCII text does not allocate an encoded copy"""
+        data = 'Entité 3\n' * 500000
+        tracemalloc.start()
+        try:
+            app._text_bytes(data)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        # One block's slice and bytes at most, far below the 5 MB encoded copy
+        assert peak < len(data.encode('utf-8')) / 10
+
+    def test_process_batch(self):
+        """Test that a batch records every document's lines"""
+        lines = app._LINES.value(source='process_batch')
+
+        process_batch(["Entity A 5\nEntity B", "Entity C"])
+
+        assert app._LINES.value(source='process_batch') == lines + 3
+
+    def test_process_files(self, tmp_path):
+        """Test that batch file processing records lines and bytes"""
+        path = tmp_path / 'input.txt'
+        path.write_text("Entity A 5\nEntity B\n", encoding='utf-8')
+        lines = app._LINES.value(source='process_files')
+        nbytes = app._BYTES.value(source='process_files')
+
+        process_files([str(path)])
+
+        assert app._LINES.value(source='process_files') == lines + 2
+        assert app._BYTES.value(source='process_files') == nbytes + 20
+
+    def test_process_file(self, tmp_path):
+        """Test that structured uploads record runs and entities"""
+        path = tmp_path / 'input.jsonl'
+        path.write_text('{"Entity": "A", "Volume": 2}\n{"Entity": "B"}\n', encoding='utf-8')
+        entities = app._ENTITIES.value(source='process_file')
+        lines = app._LINES.value(source='process_file')
+        nbytes = app._BYTES.value(source='process_file')
+
+        process_file(str(path))
+
+        assert app._ENTITIES.value(source='process_file') == entities + 2
+        assert app._LINES.value(source='process_file') == lines + 2
+        assert app._BYTES.value(source='process_file') == nbytes + path.stat().st_size
+
+    def test_process_file_text(self, tmp_path):
+        """Test that free-text uploads record rows and bytes, including an unterminated last row"""
+        path = tmp_path / 'input.txt'
+        path.write_bytes(b'A 2\nB 3\nC 4')
+        lines = app._LINES.value(source='process_file')
+        nbytes = app._BYTES.value(source='process_file')
+
+        process_file(str(path), file_format='text')
+
+        assert app._LINES.value(source='process_file') == lines + 3
+        assert app._BYTES.value(source='process_file') == nbytes + 11
+
+    def test_cache_lookups(self, tmp_path):
+        """Test that cache hits and misses are counted"""
+        cache = ResultCache(str(tmp_path))
+        key = cache.key(['digest'], ('text',))
+        hits = app._CACHE_LOOKUPS.value(result='hit')
+        misses = app._CACHE_LOOKUPS.value(result='miss')
+
+        cache.get(key)
+        cache.put(key, process_data("Entity A 5"))
+        cache.get(key)
+
+        assert app._CACHE_LOOKUPS.value(result='miss') == misses + 1
+        assert app._CACHE_LOOKUPS.value(result='hit') == hits + 1
+
+
+class TestExport:
+    """Test the HTTP endpoint and the CLI metrics file"""
+
+    def test_endpoint(self):
+        """Test that the endpoint serves the current exposition"""
+        registry = MetricsRegistry()
+        registry.counter('jobs', 'Jobs run.').inc()
+        server = serve_metrics(0, registry=registry)
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+            with urllib.request.urlopen(url, timeout=5) as response:
+                assert response.headers['Content-Type'] == OPENMETRICS_CONTENT_TYPE
+                assert response.read().decode('utf-8') == registry.render()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_cli_metrics_file(self, tmp_path):
+        """Test that the batch command writes the metrics when done"""
+        path = tmp_path / 'input.txt'
+        path.write_text("Entity A 5\n", encoding='utf-8')
+        metrics = tmp_path / 'metrics.prom'
+
+        assert cli(['batch', str(path), '-o', str(tmp_path / 'out.csv'),
+                    '--metrics-file', str(metrics)]) == 0
+
+        text = metrics.read_text(encoding='utf-8')
+        assert 'metric_analysis_runs_total{source="process_files"}' in text
+        assert text.endswith('# EOF\n')
@@ -0,0 +1,192 @@
+"""
+Tests for the opt-in decimal volume mode.
+Tests decimal parsing, the int64 fast path, overflow escalation and reporting.
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import io
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    process_data, process_file, process_files, compile_parser, write_partial, Grammar, cli
+)
+
+
+DECIMAL = Grammar(numbers='decimal')
+INT64_MAX = np.iinfo(np.int64).max
+
+
+class TestDecimalParsing:
+    """Test which volumes the decimal mode recognises"""
+
+    def test_decimal_volume(self):
+        """Test that fractional volumes are summed as floats"""
+        result = process_data("Entity A 2.5\nEntity A 1\nEntity B 0.25", DECIMAL)
+
+        assert result['Volume'].dtype == np.float64
+        assert dict(zip(result['Entity'], result['Volume'])) == {'Entity A': 3.5, 'Entity B': 0.25}
+
+    def test_exponent_volume(self):
+        """Test that exponent notation is a volume"""
+        result = process_data("Entity A|Entity B 1e3", DECIMAL)
+
+        assert result['Volume'].tolist() == [1000.0, 1000.0]
+
+    def test_integer_volumes_stay_int64(self):
+        """Test that integer-only input keeps the native int64 column"""
+        result = process_data("Entity A 2\nEntity B 3\nEntity A", DECIMAL)
+
+        assert result['Volume'].dtype == np.int64
+        pd.testing.assert_frame_equal(result, process_data("Entity A 2\nEntity B 3\nEntity A"))
+
+    @pytest.mark.parametrize('row', ['Entity 1.', 'Entity .5', 'Entity -2.5', 'Entity 1e999',
+                                     'Entity 1,5', 'Entity 2.5.1'])
+    def test_malformed_numbers_are_names(self, row):
+        """Test that tokens that are not finite decimals stay part of the name"""
+        result = process_data(row, DECIMAL)
+
+        assert result['Entity'].tolist() == [row]
+        assert result['Volume'].tolist() == [1]
+
+    def test_first_position_and_prefix(self):
+        """Test that decimals work with the other grammar options"""
+        grammar = Grammar(volume='first', volume_prefix='x', numbers='decimal')
+
+        result = process_data("x1.5 Entity A\nx2 Entity A", grammar)
+
+        assert result['Volume'].tolist() == [3.5]
+
+    def test_default_mode_unchanged(self):
+        """Test that decimals are still names without opting in"""
+        result = process_data("Entity 2.5")
+
+        assert result['Entity'].tolist() == ['Entity 2.5']
+
+    def test_unknown_number_format(self):
+        """Test that invalid number formats are rejected"""
+        with pytest.raises(ValueError, match='number format'):
+            compile_parser(Grammar(numbers='roman'))
+
+
+class TestStructuredDecimals:
+    """Test decimal volumes in JSON Lines, CSV and Excel uploads"""
+
+    def test_ndjson_decimal_volumes(self):
+        """Test that JSON floats and decimal strings are volumes in decimal mode"""
+        f = io.BytesIO(b'{"Entity": "A", "Volume": 2.5}\n{"Entity": "A", "Volume": "1e1"}\n'
+                       b'{"Entity": "B", "Volume": -0.5}\n')
+        f.name = 'export.jsonl'
+
+        result = process_file(f, grammar=DECIMAL)
+
+        assert result['Volume'].dtype == np.float64
+        assert dict(zip(result['Entity'], result['Volume'])) == {'A': 12.5, 'B': 1.0}
+
+    @pytest.mark.parametrize('value', ['1.', '.5', '-2.5', '1e999', '1,5', 'nan'])
+    def test_csv_malformed_numbers_count_once(self, value):
+        """Test that CSV values the text grammar would not accept count once"""
+        f = io.BytesIO(f'Entity,Volume\nA,"{value}"\n'.encode('utf-8'))
+        f.name = 'export.csv'
+
+        assert process_file(f, grammar=DECIMAL)['Volume'].tolist() == [1]
+
+    def test_csv_matches_text(self):
+        """Test that a CSV upload sums like the same rows pasted as text"""
+        f = io.BytesIO(b'Entity,Volume\nEntity A,1.5\nEntity A,2\nEntity B,3e2\n')
+        f.name = 'export.csv'
+
+        expected = process_data("Entity A 1.5\nEntity A 2\nEntity B 3e2", DECIMAL)
+        pd.testing.assert_frame_equal(process_file(f, grammar=DECIMAL), expected)
+
+    def test_excel_decimal_volumes(self, tmp_path):
+        """Test that fractional cells are volumes in decimal mode only"""
+        openpyxl = pytest.importorskip('openpyxl')
+        workbook = openpyxl.Workbook()
+        workbook.active.append(['Entity', 'Volume'])
+        workbook.active.append(['Entity A', 0.75])
+        path = tmp_path / 'export.xlsx'
+        workbook.save(path)
+
+        assert process_file(str(path), grammar=DECIMAL)['Volume'].tolist() == [0.75]
+        assert process_file(str(path))['Volume'].tolist() == [1]
+
+    def test_structured_overflow_escalates(self):
+        """Test that structured uploads escalate to exact integers like text"""
+        f = io.BytesIO(f'{{"Entity": "A", "Volume": {INT64_MAX}}}\n{{"Entity": "A", "Volume": 1}}\n'
+                       .encode('utf-8'))
+        f.name = 'export.jsonl'
+
+        result = process_file(f, grammar=DECIMAL)
+
+        assert result['Volume'].tolist() == [INT64_MAX + 1]
+
+
+class TestOverflowEscalation:
+    """Test exact integer sums beyond the int64 range"""
+
+    def test_overflowing_sum_is_exact(self):
+        """Test that sums beyond int64 are exact and reported"""
+        data = f"Entity A {INT64_MAX}\nEntity A {INT64_MAX}\nEntity B 3"
+
+        result = process_data(data, DECIMAL)
+
+        assert result['Volume'].tolist() == [2 * INT64_MAX, 3]
+        assert result.attrs['volume_overflow'] is True
+
+    def test_huge_single_volume(self):
+        """Test that a single volume beyond int64 is kept exactly"""
+        result = process_data("Entity A 99999999999999999999", DECIMAL)
+
+        assert result['Volume'].tolist() == [99999999999999999999]
+        assert result.attrs['volume_overflow'] is True
+
+    def test_large_but_fitting_sums_stay_int64(self):
+        """Test that the exact check avoids escalating sums that still fit"""
+        data = f"Entity A {INT64_MAX - 10}\nEntity B 4\nEntity B 6"
+
+        result = process_data(data, DECIMAL)
+
+        assert result['Volume'].dtype == np.int64
+        assert 'volume_overflow' not in result.attrs
+
+    def test_engines_agree_on_overflow(self, tmp_path):
+        """Test that the file and batch paths match process_data exactly"""
+        data = f"Entity A {INT64_MAX}\nEntity A {INT64_MAX}\nEntity B 3 "
+        path = tmp_path / 'input.txt'
+        path.write_text(data, encoding='utf-8')
+        expected = process_data(data, DECIMAL)
+
+        pd.testing.assert_frame_equal(process_file(str(path), grammar=DECIMAL), expected)
+        pd.testing.assert_frame_equal(process_files([str(path)], grammar=DECIMAL), expected)
+
+    def test_fractional_partials_rejected(self, tmp_path):
+        """Test that partial files refuse volumes they cannot hold exactly"""
+        with pytest.raises(ValueError, match='whole volumes'):
+            write_partial(process_data("Entity A 2.5", DECIMAL), str(tmp_path / 'out.part'))
+
+
+class TestDecimalCli:
+    """Test the --decimal-volumes option"""
+
+    def test_batch_decimal_volumes(self, tmp_path):
+        """Test that the batch command sums decimal volumes"""
+        path = tmp_path / 'input.txt'
+        path.write_text("Entity A 1.5\nEntity A 2\n", encoding='utf-8')
+        output = tmp_path / 'ranking.csv'
+
+        assert cli(['batch', str(path), '-o', str(output), '--decimal-volumes']) == 0
+        assert pd.read_csv(output)['Volume'].tolist() == [3.5]
+
+    def test_batch_reports_overflow(self, tmp_path, capsys):
+        """Test that escalating to exact integers is reported"""
+        path = tmp_path / 'input.txt'
+        path.write_text(f"Entity A {INT64_MAX}\nEntity A 1\n", encoding='utf-8')
+        output = tmp_path / 'ranking.csv'
+
+        assert cli(['batch', str(path), '-o', str(output), '--decimal-volumes']) == 0
+        assert '64-bit' in capsys.readouterr().err
+        assert output.read_text(encoding='utf-8').splitlines()[1] == f'Entity A,{INT64_MAX + 1}'
@@ -0,0 +1,183 @@
+"""
+Tests for the partial aggregate file format and the k-way merge.
+Tests round trips, equivalence with process_data, integrity checks and the CLI.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    process_data, write_partial, iter_partial, merge_partials, cli
+)
+
+
+SHARDS = [
+    "Entity A|Entity B 5\nEntity A\n\n|Entity C|\nEntité 3",
+    "Entity B 2\nEntity D|Entity A 7\nZürich 1",
+    "Entity C 4\n\nEntity A 1.5\nentity a 9",
+]
+
+
+@pytest.fixture
+def partial_files(tmp_path):
+    """Write one partial file per shard"""
+    paths = []
+    for i, shard in enumerate(SHARDS):
+        path = str(tmp_path / f'shard_{i}.part')
+        write_partial(process_data(shard), path)
+        paths.append(path)
+    return paths
+
+
+class TestPartialFormat:
+    """Test writing and reading partial files"""
+
+    def test_round_trip_sorted_by_entity(self, tmp_path):
+        """Test that a partial reads back the same sums in entity order"""
+        path = str(tmp_path / 'result.part')
+        df = process_data(SHARDS[0])
+        write_partial(df, path)
+
+        entries = list(iter_partial(path))
+        assert entries == sorted(zip(df['Entity'], df['Volume'].astype(int)))
+
+    def test_accepts_totals_dict(self, tmp_path):
+        """Test that a dict of totals can be written directly"""
+        path = str(tmp_path / 'totals.part')
+        write_partial({'b': 2, 'a': 10 ** 30, '': 1}, path)
+
+        assert list(iter_partial(path)) == [('', 1), ('a', 10 ** 30), ('b', 2)]
+
+    def test_small_read_blocks(self, tmp_path):
+        """Test that entries spanning block boundaries are read correctly"""
+        path = str(tmp_path / 'blocks.part')
+        totals = {f'Entité {i}': i * 1000 for i in range(200)}
+        write_partial(totals, path)
+
+        assert dict(iter_partial(path, block_size=3)) == totals
+
+    def test_not_a_partial_file(self, tmp_path):
+        """Test that other files are rejected"""
+        path = tmp_path / 'input.txt'
+        path.write_text("Entity A 5\n", encoding='utf-8')
+
+        with pytest.raises(ValueError, match='not a partial'):
+            list(iter_partial(str(path)))
+
+    def test_unsupported_version(self, tmp_path):
+        """Test that a newer layout version is rejected"""
+        path = tmp_path / 'future.part'
+        write_partial({'a': 1}, str(path))
+        data = bytearray(path.read_bytes())
+        data[7] = 99
+        path.write_bytes(bytes(data))
+
+        with pytest.raises(ValueError, match='version'):
+            list(iter_partial(str(path)))
+
+    def test_corruption_detected(self, tmp_path):
+        """Test that a flipped volume byte fails the integrity check"""
+        path = tmp_path / 'damaged.part'
+        write_partial({'a': 1, 'b': 2}, str(path))
+        data = bytearray(path.read_bytes())
+        data[10] ^= 0x01
+        path.write_bytes(bytes(data))
+
+        with pytest.raises(ValueError, match='corrupt'):
+            list(iter_partial(str(path)))
+
+    def test_truncation_detected(self, tmp_path):
+        """Test that a partially transferred file is rejected"""
+        path = tmp_path / 'truncated.part'
+        write_partial({f'Entity {i}': i for i in range(50)}, str(path))
+        path.write_bytes(path.read_bytes()[:-6])
+
+        with pytest.raises(ValueError, match='truncated|corrupt'):
+            list(iter_partial(str(path)))
+
+    def test_negative_volume_rejected(self, tmp_path):
+        """Test that volumes outside the format are refused"""
+        with pytest.raises(ValueError, match='Negative'):
+            write_partial({'a': -1}, str(tmp_path / 'negative.part'))
+
+
+class TestMergePartials:
+    """Test merging partial files into the final ranking"""
+
+    def test_matches_process_data(self, partial_files):
+        """Test that merging shards equals processing all the input at once"""
+        result = merge_partials(partial_files)
+        expected = process_data("\n".join(SHARDS))
+
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_merge_order_irrelevant(self, partial_files):
+        """Test that the ranking does not depend on the order of the partials"""
+        pd.testing.assert_frame_equal(merge_partials(partial_files),
+                                      merge_partials(partial_files[::-1]))
+
+    def test_tree_merge(self, partial_files, tmp_path):
+        """Test that merged partials can themselves be merged"""
+        intermediate = str(tmp_path / 'intermediate.part')
+        merge_partials(partial_files[:2], intermediate)
+        result = merge_partials([intermediate, partial_files[2]])
+
+        pd.testing.assert_frame_equal(result, process_data("\n".join(SHARDS)))
+
+    def test_no_partials(self):
+        """Test that merging nothing gives an empty ranking"""
+        result = merge_partials([])
+
+        assert list(result.columns) == ['Entity', 'Volume']
+        assert len(result) == 0
+
+
+class TestPartialCli:
+    """Test the partial and merge commands"""
+
+    def test_partial_then_merge(self, tmp_path):
+        """Test producing partials on each node and merging them"""
+        partials = []
+        for i, shard in enumerate(SHARDS):
+            source = tmp_path / f'node_{i}.txt'
+            source.write_text(shard, encoding='utf-8')
+            partials.append(str(tmp_path / f'node_{i}.part'))
+            assert cli(['partial', str(source), '-o', partials[-1]]) == 0
+
+        output = tmp_path / 'ranking.csv'
+        assert cli(['merge', *partials, '-o', str(output)]) == 0
+
+        result = pd.read_csv(output)
+        expected = process_data("\n".join(SHARDS))
+        assert result['Entity'].tolist() == expected['Entity'].tolist()
+        assert result['Volume'].tolist() == expected['Volume'].tolist()
+
+    def test_partial_decimal_volumes(self, tmp_path, capsys):
+        """Test that fractional sums are reported cleanly and whole decimal sums written"""
+        source = tmp_path / 'input.txt'
+        path = tmp_path / 'out.part'
+        source.write_text("Entity A 1.5\nEntity B 2\n", encoding='utf-8')
+
+        with pytest.raises(SystemExit) as exc:
+            cli(['partial', str(source), '-o', str(path), '--decimal-volumes'])
+
+        assert exc.value.code == 2
+        assert 'whole volumes only' in capsys.readouterr().err
+        assert not os.path.exists(path) and not os.path.exists(f'{path}.tmp')
+
+        source.write_text("Entity A 1.5\nEntity A 0.5\nEntity B 2\n", encoding='utf-8')
+        assert cli(['partial', str(source), '-o', str(path), '--decimal-volumes']) == 0
+        assert list(iter_partial(str(path))) == [('Entity A', 2), ('Entity B', 2)]
+
+    def test_partial_from_structured_input(self, tmp_path):
+        """Test that partials can be produced from any supported format"""
+        source = tmp_path / 'export.jsonl'
+        source.write_text('{"Entity": "A", "Volume": 2}\n{"Entity": "B", "Volume": 3}\n',
+                          encoding='utf-8')
+        path = str(tmp_path / 'export.part')
+
+        assert cli(['partial', str(source), '-o', path]) == 0
+        assert list(iter_partial(path)) == [('A', 2), ('B', 3)]
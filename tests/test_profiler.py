@@ -0,0 +1,134 @@
+"""
+Tests for on-demand profiling.
+Tests the sampling and deterministic profilers, their summaries and raw
+profiles, and the batch command line option.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+import pstats
+import time
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import Profiler, cli, process_data
+
+
+DATA = "\n".join(f"Entity {i % 50}|Other {i % 7} {i % 9}" for i in range(20000))
+
+
+def _busy_loop(seconds):
+    """Keep the interpreter busy in this function for a while"""
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += 1
+    return total
+
+
+class TestSamplingProfiler:
+    """Test the sampling profiler"""
+
+    def test_hot_function_and_line(self):
+        """Test that a busy function dominates the samples"""
+        with Profiler(interval=0.001) as profiler:
+            _busy_loop(0.3)
+
+        assert profiler.samples > 10
+        assert profiler.elapsed >= 0.3
+        functions = profiler.functions()
+        assert functions.columns.tolist() == ['Function', 'Location', 'Calls',
+                                              'Self seconds', 'Total seconds']
+        assert functions['Function'].iloc[0] == '_busy_loop'
+        assert functions['Calls'].isna().all()
+        lines = profiler.lines()
+        assert lines['Function'].iloc[0] == '_busy_loop'
+        assert lines['Location'].iloc[0].startswith('test_profiler.py:')
+        assert lines['Share'].sum() <= 1
+
+    def test_folded_stacks(self):
+        """Test that the raw profile is in the folded stack format"""
+        with Profiler(interval=0.001) as profiler:
+            _busy_loop(0.1)
+
+        lines = profiler.dump().decode('utf-8').splitlines()
+        counts = [int(line.rsplit(' ', 1)[1]) for line in lines]
+        assert sum(counts) == profiler.samples
+        assert any('test_folded_stacks' in line and '_busy_loop' in line for line in lines)
+        assert profiler.file_name.endswith('.folded')
+
+    def test_nothing_sampled(self):
+        """Test the summaries of a profile too short to be sampled"""
+        with Profiler(interval=10) as profiler:
+            pass
+
+        assert profiler.samples == 0
+        assert profiler.functions().empty
+        assert profiler.lines().empty
+        assert profiler.dump() == b''
+
+
+class TestDeterministicProfiler:
+    """Test the deterministic profiler"""
+
+    def test_call_counts(self):
+        """Test exact call counts of the row parser"""
+        with Profiler('deterministic') as profiler:
+            process_data(DATA)
+
+        functions = profiler.functions(top=100).set_index('Function')
+        assert functions.loc['_parse_row', 'Calls'] == 20000
+        assert functions.loc['process_data', 'Total seconds'] <= profiler.elapsed
+        assert profiler.lines().empty
+
+    def test_pstats_dump(self, tmp_path):
+        """Test that the raw profile loads with pstats"""
+        with Profiler('deterministic') as profiler:
+            process_data(DATA)
+
+        path = tmp_path / profiler.file_name
+        path.write_bytes(profiler.dump())
+        stats = pstats.Stats(str(path))
+        assert any(name == '_parse_row' for _, _, name in stats.stats)
+
+    def test_summary(self):
+        """Test the plain text summary"""
+        with Profiler('deterministic') as profiler:
+            process_data(DATA)
+
+        text = profiler.summary()
+        assert text.startswith('Profile (deterministic')
+        assert '_parse_row' in text
+        assert 'Hot lines' not in text
+
+    def test_unknown_mode(self):
+        """Test that an unknown mode is rejected"""
+        with pytest.raises(ValueError):
+            Profiler('tracing')
+
+
+class TestProfilerCLI:
+    """Test profiling the batch command"""
+
+    def test_batch_profile(self, tmp_path, capsys):
+        """Test that the summary is printed and the raw profile written"""
+        path = tmp_path / 'input.txt'
+        path.write_text(DATA, encoding='utf-8')
+        output = tmp_path / 'profile.prof'
+
+        assert cli(['batch', str(path), '-o', str(tmp_path / 'out.csv'),
+                    '--profile', 'deterministic', '--profile-output', str(output)]) == 0
+
+        assert 'Hot functions' in capsys.readouterr().err
+        assert any(name == 'process_files' for _, _, name in pstats.Stats(str(output)).stats)
+        assert len(pd.read_csv(tmp_path / 'out.csv')) == 57
+
+    def test_profile_output_requires_profile(self, tmp_path):
+        """Test that a profile output without profiling is rejected"""
+        path = tmp_path / 'input.txt'
+        path.write_text(DATA, encoding='utf-8')
+
+        with pytest.raises(SystemExit):
+            cli(['batch', str(path), '-o', str(tmp_path / 'out.csv'),
+                 '--profile-output', str(tmp_path / 'profile.folded')])
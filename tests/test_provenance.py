@@ -0,0 +1,141 @@
+"""
+Tests for the per-entity provenance index.
+Tests recorded line numbers, varint encoding edge cases and memory use.
+"""
+import pytest
+import numpy as np
+import random
+import sys
+import os
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    ProvenanceIndex, iter_process_chunks, compile_parser, Grammar, _aggregate_rows, _parse_row,
+    _source_lines
+)
+
+
+SAMPLE = "Entity A|Entity B 5\nEntity A\n\n|Entity C|\nEntity B 2\nEntity A|Entity A 3"
+
+
+def _expected_lines(rows, parse_row=_parse_row):
+    """Build the reference mapping of entity to line numbers with plain lists"""
+    expected = {}
+    for line_number, row in enumerate(rows):
+        for name in dict.fromkeys(parse_row(row)[0]):
+            expected.setdefault(name, []).append(line_number)
+    return expected
+
+
+class TestProvenanceIndex:
+    """Test recording and looking up source lines"""
+
+    def test_lines_per_entity(self):
+        """Test that each entity maps to the lines that mention it"""
+        provenance = ProvenanceIndex()
+        provenance.aggregate(SAMPLE.split('\n'), 0, {})
+
+        assert provenance.lines('Entity A').tolist() == [0, 1, 5]
+        assert provenance.lines('Entity B').tolist() == [0, 4]
+        assert provenance.lines('Entity C').tolist() == [3]
+
+    def test_repeated_entity_on_one_line_counted_once(self):
+        """Test that a line listing an entity twice appears once"""
+        provenance = ProvenanceIndex()
+        provenance.aggregate(["Entity A|Entity A 3"], 0, {})
+
+        assert provenance.count('Entity A') == 1
+
+    def test_totals_match_aggregation(self):
+        """Test that indexing does not change the aggregated totals"""
+        rows = SAMPLE.split('\n')
+
+        totals = ProvenanceIndex().aggregate(rows, 0, {})
+
+        assert totals == _aggregate_rows(rows, {})
+
+    def test_unknown_entity(self):
+        """Test that unknown entities have no lines"""
+        provenance = ProvenanceIndex()
+        provenance.aggregate(SAMPLE.split('\n'), 0, {})
+
+        assert 'Entity Z' not in provenance
+        assert provenance.count('Entity Z') == 0
+        assert len(provenance.lines('Entity Z')) == 0
+
+    def test_limit(self):
+        """Test that a lookup can return only the first lines"""
+        provenance = ProvenanceIndex()
+        provenance.aggregate(['Entity A'] * 50, 0, {})
+
+        assert provenance.lines('Entity A', limit=3).tolist() == [0, 1, 2]
+        assert len(provenance.lines('Entity A', limit=0)) == 0
+        assert provenance.count('Entity A') == 50
+
+    def test_large_line_gaps(self):
+        """Test multi-byte varints for line numbers far apart"""
+        numbers = [0, 127, 128, 16383, 16384, 2 ** 21, 2 ** 28 + 5, 2 ** 32 - 1]
+        provenance = ProvenanceIndex()
+        for number in numbers:
+            provenance.aggregate(['Entity A'], number, {})
+
+        assert provenance.lines('Entity A').tolist() == numbers
+
+    def test_random_input_matches_reference(self):
+        """Test the index against plain per-entity lists on random input"""
+        rng = random.Random(0)
+        rows = ['|'.join(f'E{rng.randrange(300)}' for _ in range(rng.randint(0, 3)))
+                + f' {rng.randrange(9)}' for _ in range(5000)]
+        provenance = ProvenanceIndex()
+        provenance.aggregate(rows, 0, {})
+
+        expected = _expected_lines(rows)
+        assert len(provenance) == len(expected)
+        assert all(provenance.lines(name).tolist() == lines for name, lines in expected.items())
+
+    def test_chunked_processing_records_row_numbers(self):
+        """Test that iter_process_chunks records absolute row numbers"""
+        grammar = Grammar(entity_separator=',')
+        rows = [f'E{i % 7},F{i % 3} {i}' for i in range(100)]
+        provenance = ProvenanceIndex()
+        totals = {}
+        for _ in iter_process_chunks(rows, totals, chunk_lines=9, grammar=grammar,
+                                     provenance=provenance):
+            pass
+
+        expected = _expected_lines(rows, compile_parser(grammar))
+        assert provenance.lines('F2').tolist() == expected['F2']
+        assert totals == _aggregate_rows(rows, {}, compile_parser(grammar))
+
+    def test_no_rows_after_lookup(self):
+        """Test that the index is read-only once built"""
+        provenance = ProvenanceIndex()
+        provenance.aggregate(['Entity A'], 0, {})
+        provenance.lines('Entity A')
+
+        with pytest.raises(ValueError, match='after a lookup'):
+            provenance.aggregate(['Entity B'], 1, {})
+
+    def test_memory_is_small_fraction_of_input(self):
+        """Test that the encoded index is much smaller than the input text"""
+        rng = random.Random(1)
+        rows = [f'Customer {rng.randrange(2000)}|Region {rng.randrange(20)} {rng.randrange(1000)}'
+                for _ in range(50000)]
+        provenance = ProvenanceIndex()
+        provenance.aggregate(rows, 0, {})
+
+        assert provenance.nbytes < 0.15 * len('\n'.join(rows).encode('utf-8'))
+
+
+class TestSourceLines:
+    """Test fetching line text for the drill-down view"""
+
+    def test_selected_lines(self):
+        """Test that the requested lines are returned in order"""
+        assert _source_lines(SAMPLE, '\n', np.array([0, 5])) == ['Entity A|Entity B 5',
+                                                                 'Entity A|Entity A 3']
+
+    def test_no_lines(self):
+        """Test that no lines gives an empty list"""
+        assert _source_lines(SAMPLE, '\n', np.array([], dtype=np.int64)) == []
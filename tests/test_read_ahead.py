@@ -0,0 +1,172 @@
+"""
+Tests for the read-ahead file ingestion pipeline.
+Tests newline-aligned blocks, the bounded queue, error handling, the
+overlap instrumentation and block-based batch processing with checkpoints.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+import io
+import time
+from unittest.mock import patch
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Metric_multi_entity_analysis as app
+from Metric_multi_entity_analysis import ReadAhead, cli, process_data, process_files
+
+
+LINES = [f"Entity {i % 13}|Entité {i % 7} {i % 5}" for i in range(300)]
+DATA = "\n".join(LINES)
+
+
+class _SlowReader(io.BytesIO):
+    """In-memory file whose reads take a while and are counted"""
+
+    def __init__(self, data, delay=0.0, fail_after=None):
+        super().__init__(data)
+        self.delay = delay
+        self.fail_after = fail_after
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        if self.fail_after is not None and self.reads > self.fail_after:
+            raise OSError('connection to the file server lost')
+        time.sleep(self.delay)
+        return super().read(size)
+
+
+class TestReadAhead:
+    """Test reading newline-aligned blocks in a background thread"""
+
+    @pytest.mark.parametrize('queue_depth', [0, 1, 4])
+    @pytest.mark.parametrize('block_size', [5, 64, 1 << 20])
+    def test_blocks_end_at_newlines(self, block_size, queue_depth):
+        """Test that blocks split the input at newlines and add up to it"""
+        data = (DATA + "\n" + "x" * 100 + "\n").encode('utf-8')
+        with ReadAhead(io.BytesIO(data), block_size, queue_depth) as blocks:
+            result = list(blocks)
+
+        assert b''.join(result) == data
+        assert all(block.endswith(b'\n') for block in result)
+        # Every block decodes on its own even though it contains multi-byte characters
+        assert list(app._iter_block_rows(result)) == data.decode('utf-8').split('\n')[:-1]
+
+    def test_unterminated_last_line(self):
+        """Test that a last line without a newline becomes the last block"""
+        with ReadAhead(io.BytesIO(b"a\nb\nlast"), 3) as blocks:
+            result = list(blocks)
+
+        assert result[-1] == b'last'
+        assert list(app._iter_block_rows(result)) == ['a', 'b', 'last']
+
+    def test_empty_input(self):
+        """Test that an empty stream yields no blocks"""
+        with ReadAhead(io.BytesIO(b'')) as blocks:
+            assert list(blocks) == []
+
+    def test_queue_is_bounded(self):
+        """Test that the reader stops reading while the queue is full"""
+        f = _SlowReader(b"line\n" * 1000)
+        with ReadAhead(f, block_size=5, queue_depth=2) as blocks:
+            next(iter(blocks))
+            time.sleep(0.3)
+            # Two queued blocks, the one handed out and the one waiting to be queued
+            assert f.reads <= 4
+
+    def test_close_stops_reader(self):
+        """Test that closing early stops the reader thread"""
+        blocks = ReadAhead(_SlowReader(b"line\n" * 1000), block_size=5, queue_depth=2)
+        next(iter(blocks))
+        blocks.close()
+        assert not blocks._thread.is_alive()
+
+    @pytest.mark.parametrize('queue_depth', [0, 2])
+    def test_read_error_raised(self, queue_depth):
+        """Test that a failed read is raised in the consuming thread"""
+        f = _SlowReader(b"line\n" * 100, fail_after=2)
+        with ReadAhead(f, block_size=50, queue_depth=queue_depth) as blocks:
+            with pytest.raises(OSError, match='file server'):
+                list(blocks)
+
+    def test_overlap(self):
+        """Test that reads overlap with parsing only when reading ahead"""
+        for queue_depth in (0, 4):
+            with ReadAhead(_SlowReader(b"line\n" * 40, delay=0.01), 20, queue_depth) as blocks:
+                for _ in blocks:
+                    time.sleep(0.02)
+            assert blocks.read_seconds >= 0.1
+            if queue_depth:
+                assert blocks.overlap > 0.5
+            else:
+                assert blocks.overlap == 0
+
+    def test_invalid_settings(self):
+        """Test that invalid block sizes and queue depths are rejected"""
+        with pytest.raises(ValueError):
+            ReadAhead(io.BytesIO(b''), block_size=0)
+        with pytest.raises(ValueError):
+            ReadAhead(io.BytesIO(b''), queue_depth=-1)
+
+
+class TestBlockProcessing:
+    """Test batch processing through the read-ahead pipeline"""
+
+    @pytest.mark.parametrize('queue_depth', [0, 3])
+    def test_small_blocks_match_process_data(self, tmp_path, queue_depth):
+        """Test that results do not depend on block boundaries"""
+        path = tmp_path / 'input.txt'
+        path.write_text(DATA, encoding='utf-8')
+
+        result = process_files([str(path)], block_size=17, queue_depth=queue_depth)
+        pd.testing.assert_frame_equal(result, process_data(DATA))
+
+    def test_resume_with_small_blocks(self, tmp_path):
+        """Test that checkpoint offsets inside blocks resume correctly"""
+        path = tmp_path / 'input.txt'
+        path.write_text(DATA + "\n", encoding='utf-8')
+        checkpoint = str(tmp_path / 'job.ckpt')
+        real_save = app._save_checkpoint
+        saves = []
+
+        def crashing_save(checkpoint_path, state):
+            real_save(checkpoint_path, state)
+            saves.append(state['offset'])
+            if len(saves) == 4:
+                raise KeyboardInterrupt
+
+        with patch.object(app, '_save_checkpoint', crashing_save):
+            with pytest.raises(KeyboardInterrupt):
+                process_files([str(path)], checkpoint, checkpoint_every=7, block_size=200)
+
+        # Offsets are the byte positions after every seventh line
+        encoded = [len(line.encode('utf-8')) + 1 for line in LINES]
+        assert saves == [sum(encoded[:7 * n]) for n in range(1, 5)]
+        result = process_files([str(path)], checkpoint, checkpoint_every=7, block_size=200)
+        pd.testing.assert_frame_equal(result, process_data(DATA))
+
+    def test_overlap_recorded(self, tmp_path):
+        """Test that the read times and overlap of a run are recorded"""
+        path = tmp_path / 'input.txt'
+        path.write_text(DATA, encoding='utf-8')
+        runs = app._READ_OVERLAP.count(source='process_files')
+
+        process_files([str(path)])
+
+        assert app._READ_OVERLAP.count(source='process_files') == runs + 1
+        assert 'metric_analysis_read_wait_seconds_total{source="process_files"}' in app.METRICS.render()
+
+    def test_cli_settings(self, tmp_path):
+        """Test the block size and queue depth options of the batch command"""
+        path = tmp_path / 'input.txt'
+        path.write_text(DATA, encoding='utf-8')
+        output = tmp_path / 'out.csv'
+
+        assert cli(['batch', str(path), '-o', str(output),
+                    '--read-block-size', '0.001', '--read-queue-depth', '0']) == 0
+        assert len(pd.read_csv(output)) == len(process_data(DATA))
+
+        with pytest.raises(SystemExit):
+            cli(['batch', str(path), '-o', str(output), '--read-queue-depth', '-1'])
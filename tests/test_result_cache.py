@@ -0,0 +1,150 @@
+"""
+Tests for the persistent content-addressed result cache.
+Tests round trips, keys, integrity checks, eviction and the batch path.
+"""
+import pytest
+import pandas as pd
+import io
+import sys
+import os
+import time
+from unittest.mock import patch
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Metric_multi_entity_analysis as app
+from Metric_multi_entity_analysis import (
+    process_data, process_files, ResultCache, digest_source, Grammar, DEFAULT_GRAMMAR, cli
+)
+
+
+SAMPLE = "Entity A|Entity B 5\nEntity A\n\n|Entity C|\nEntity B 2\nEntité 3\n实体 7\nEntity A 1.5"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Create an empty cache in a temporary directory"""
+    return ResultCache(str(tmp_path / 'cache'))
+
+
+class TestResultCache:
+    """Test storing and loading results"""
+
+    @pytest.mark.parametrize('data', ['', 'Entity A', SAMPLE])
+    def test_round_trip(self, cache, data):
+        """Test that a cached result is identical to the original, index included"""
+        df = process_data(data)
+        cache.put('key', df)
+
+        pd.testing.assert_frame_equal(cache.get('key'), df)
+
+    def test_miss(self, cache):
+        """Test that unknown keys are misses"""
+        assert cache.get('missing') is None
+
+    def test_persists_across_instances(self, cache):
+        """Test that entries survive a restart"""
+        df = process_data(SAMPLE)
+        cache.put('key', df)
+
+        reopened = ResultCache(cache.directory)
+
+        pd.testing.assert_frame_equal(reopened.get('key'), df)
+
+    def test_key_depends_on_content_and_options(self):
+        """Test that keys change with the input content and the parsing options"""
+        digest = digest_source(SAMPLE.encode('utf-8'))
+        key = ResultCache.key([digest], ('text', DEFAULT_GRAMMAR))
+
+        assert key == ResultCache.key([digest], ('text', DEFAULT_GRAMMAR))
+        assert key != ResultCache.key([digest_source(b'other')], ('text', DEFAULT_GRAMMAR))
+        assert key != ResultCache.key([digest], ('text', Grammar(entity_separator=',')))
+        assert key != ResultCache.key([digest, digest], ('text', DEFAULT_GRAMMAR))
+
+    def test_digest_of_path_and_file_object(self, tmp_path):
+        """Test that paths, file objects and bytes with the same content agree"""
+        path = tmp_path / 'input.txt'
+        path.write_bytes(SAMPLE.encode('utf-8'))
+        f = io.BytesIO(SAMPLE.encode('utf-8'))
+        f.read(3)
+
+        assert digest_source(str(path)) == digest_source(SAMPLE.encode('utf-8'))
+        assert digest_source(f) != digest_source(SAMPLE.encode('utf-8'))
+        assert f.tell() == 3
+
+    def test_corrupt_entry_discarded(self, cache):
+        """Test that a damaged entry is a miss and is removed"""
+        cache.put('key', process_data(SAMPLE))
+        path = os.path.join(cache.directory, 'key.result')
+        data = bytearray(open(path, 'rb').read())
+        data[-10] ^= 0xFF
+        with open(path, 'wb') as f:
+            f.write(bytes(data))
+
+        assert cache.get('key') is None
+        assert not os.path.exists(path)
+
+    def test_truncated_entry_discarded(self, cache):
+        """Test that a partially written entry is a miss"""
+        cache.put('key', process_data(SAMPLE))
+        path = os.path.join(cache.directory, 'key.result')
+        with open(path, 'r+b') as f:
+            f.truncate(12)
+
+        assert cache.get('key') is None
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """Test that the oldest unused entries are evicted first"""
+        df = process_data("\n".join(f"Entity {i} {i}" for i in range(200)))
+        entry_size = len(app._encode_result(df))
+        cache = ResultCache(str(tmp_path / 'cache'), max_bytes=int(entry_size * 2.5))
+
+        cache.put('first', df)
+        cache.put('second', df)
+        # Make 'first' the most recently used one
+        old = time.time() - 100
+        os.utime(os.path.join(cache.directory, 'second.result'), (old, old))
+        cache.get('first')
+        cache.put('third', df)
+
+        assert cache.get('first') is not None
+        assert cache.get('second') is None
+        assert cache.get('third') is not None
+
+
+class TestCachedBatch:
+    """Test the cache on the batch path"""
+
+    def test_second_run_skips_parsing(self, cache, tmp_path):
+        """Test that a repeated batch run is served from the cache"""
+        path = tmp_path / 'input.txt'
+        path.write_text(SAMPLE, encoding='utf-8')
+
+        first = process_files([str(path)], cache=cache)
+        with patch.object(app, '_aggregate_rows', side_effect=AssertionError('parsed again')):
+            second = process_files([str(path)], cache=cache)
+
+        pd.testing.assert_frame_equal(first, second)
+        pd.testing.assert_frame_equal(second, process_data(SAMPLE))
+
+    def test_changed_input_not_served_from_cache(self, cache, tmp_path):
+        """Test that editing an input invalidates its cached result"""
+        path = tmp_path / 'input.txt'
+        path.write_text(SAMPLE, encoding='utf-8')
+        process_files([str(path)], cache=cache)
+
+        path.write_text(SAMPLE + "\nEntity Z 100", encoding='utf-8')
+
+        assert process_files([str(path)], cache=cache)['Entity'].iloc[0] == 'Entity Z'
+
+    def test_cli_cache_dir(self, tmp_path):
+        """Test that the batch command fills and uses the cache directory"""
+        path = tmp_path / 'input.txt'
+        path.write_text(SAMPLE, encoding='utf-8')
+        cache_dir = tmp_path / 'cache'
+        output = tmp_path / 'ranking.csv'
+
+        assert cli(['batch', str(path), '-o', str(output), '--cache-dir', str(cache_dir)]) == 0
+        assert len(os.listdir(cache_dir)) == 1
+        assert cli(['batch', str(path), '-o', str(output), '--cache-dir', str(cache_dir)]) == 0
+        assert pd.read_csv(output)['Volume'].tolist() == process_data(SAMPLE)['Volume'].tolist()
@@ -0,0 +1,111 @@
+"""
+Tests for the sampled preview of the ranking.
+Tests reservoir sampling and the estimated volumes and rank intervals.
+"""
+import pytest
+import random
+import sys
+import os
+from collections import Counter
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import (
+    Grammar, process_data, reservoir_sample, preview_rows
+)
+
+
+@pytest.fixture
+def skewed_rows():
+    """Rows with a few large entities and a long tail of small ones"""
+    rng = random.Random(0)
+    return [f"Entity {int(rng.paretovariate(1.2))}|Entity {rng.randrange(1000)} {rng.randrange(1, 100)}"
+            for _ in range(100000)]
+
+
+class TestReservoirSample:
+    """Test single-pass uniform sampling"""
+
+    def test_counts_population(self):
+        """Test that every item is counted and the sample has k distinct items"""
+        sample, count = reservoir_sample(range(100000), 100, random.Random(1))
+
+        assert count == 100000
+        assert len(set(sample)) == 100
+
+    def test_small_population(self):
+        """Test that a population smaller than k is returned whole"""
+        assert reservoir_sample(iter('abc'), 10) == (['a', 'b', 'c'], 3)
+        assert reservoir_sample([], 10) == ([], 0)
+
+    def test_uniform(self):
+        """Test that every item is about equally likely to be sampled"""
+        counts = Counter()
+        for seed in range(2000):
+            counts.update(reservoir_sample(range(50), 5, random.Random(seed))[0])
+
+        # Each item is expected 200 times
+        assert all(140 < counts[i] < 260 for i in range(50))
+
+    def test_reproducible(self):
+        """Test that a seeded generator gives the same sample"""
+        first = reservoir_sample(range(10000), 10, random.Random(7))
+        second = reservoir_sample(range(10000), 10, random.Random(7))
+
+        assert first == second
+
+
+class TestPreviewRows:
+    """Test the estimated ranking"""
+
+    def test_exact_when_fully_sampled(self):
+        """Test that sampling every row gives the exact result with no uncertainty"""
+        data = "Entity A|Entity B 5\nEntity A 3\nEntity C"
+
+        preview = preview_rows(data.split('\n'), sample_size=10)
+        expected = process_data(data)
+
+        assert preview['Entity'].tolist() == expected['Entity'].tolist()
+        assert preview['Volume'].tolist() == expected['Volume'].tolist()
+        assert (preview['Low'] == preview['High']).all()
+        assert preview['Best rank'].tolist() == [1, 2, 3]
+        assert preview['Worst rank'].tolist() == [1, 2, 3]
+        assert preview.attrs == {'sampled': 3, 'total': 3}
+
+    def test_top_entities_covered(self, skewed_rows):
+        """Test that the intervals of the top entities contain the true volumes"""
+        preview = preview_rows(skewed_rows, sample_size=5000, seed=3)
+        truth = process_data('\n'.join(skewed_rows)).set_index('Entity')['Volume']
+        true_rank = {name: rank for rank, name in enumerate(truth.index, start=1)}
+
+        assert preview.attrs == {'sampled': 5000, 'total': 100000}
+        top = preview.head(5)
+        assert top['Entity'].tolist() == truth.index[:5].tolist()
+        for row in top.itertuples():
+            assert row.Low <= truth[row.Entity] <= row.High
+            assert row._5 <= true_rank[row.Entity] <= row._6
+
+    def test_intervals_ordered(self, skewed_rows):
+        """Test that low <= estimate <= high and best rank <= worst rank"""
+        preview = preview_rows(skewed_rows, sample_size=2000, seed=4)
+
+        assert (preview['Low'] <= preview['Volume']).all()
+        assert (preview['Volume'] <= preview['High']).all()
+        assert (preview['Best rank'] <= preview['Worst rank']).all()
+        assert preview['Best rank'].min() == 1
+        assert preview['Worst rank'].max() <= len(preview)
+
+    def test_grammar(self):
+        """Test that sampled rows are parsed with the given grammar"""
+        rows = ["5 Entity A,Entity B", "2 Entity A"]
+
+        preview = preview_rows(rows, grammar=Grammar(';', ',', 'first'))
+
+        assert dict(zip(preview['Entity'], preview['Volume'])) == {'Entity A': 7, 'Entity B': 5}
+
+    def test_empty(self):
+        """Test that no rows give an empty preview"""
+        preview = preview_rows([])
+
+        assert preview.empty
+        assert preview.attrs == {'sampled': 0, 'total': 0}
@@ -0,0 +1,129 @@
+"""
+Tests for the entity search index.
+Tests prefix and n-gram substring search over processed results.
+"""
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import random
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import process_data, EntitySearchIndex
+
+
+@pytest.fixture
+def index():
+    """Search index over a small mixed result"""
+    data = "Apple|Pineapple 10\nBanana 5\nApricot|Grape 2\nEntité"
+    return EntitySearchIndex(process_data(data))
+
+
+class TestPrefixSearch:
+    """Test prefix search"""
+
+    def test_prefix_matches(self, index):
+        """Test that all names with the prefix are found"""
+        result = index.filter('ap', prefix=True)
+
+        assert set(result['Entity']) == {'Apple', 'Apricot'}
+
+    def test_prefix_is_case_insensitive(self, index):
+        """Test that prefix search ignores case"""
+        result = index.filter('APP', prefix=True)
+
+        assert result['Entity'].tolist() == ['Apple']
+
+    def test_prefix_without_matches(self, index):
+        """Test that an unknown prefix returns no rows"""
+        assert len(index.filter('zz', prefix=True)) == 0
+
+
+class TestSubstringSearch:
+    """Test n-gram substring search"""
+
+    def test_substring_matches(self, index):
+        """Test that names containing the query are found"""
+        result = index.filter('apple')
+
+        assert set(result['Entity']) == {'Apple', 'Pineapple'}
+
+    def test_substring_in_middle(self, index):
+        """Test that matches are found away from the name start"""
+        assert index.filter('nan')['Entity'].tolist() == ['Banana']
+
+    def test_ngram_candidates_are_verified(self):
+        """Test that sharing all n-grams is not enough to match"""
+        index = EntitySearchIndex(process_data("abcXbcd"))
+
+        assert len(index.filter('abcd')) == 0
+
+    def test_short_query_matches_anywhere(self, index):
+        """Test that queries shorter than the n-gram length match substrings"""
+        assert index.filter('gr')['Entity'].tolist() == ['Grape']
+        assert index.filter('PL')['Entity'].tolist() == ['Apple', 'Pineapple']
+        assert index.filter('é')['Entity'].tolist() == ['Entité']
+
+    def test_unicode_query(self, index):
+        """Test that non-ASCII names can be searched"""
+        assert index.filter('tité')['Entity'].tolist() == ['Entité']
+
+    def test_blank_query_returns_all(self, index):
+        """Test that a blank query returns the full result"""
+        assert len(index.filter('  ')) == len(index.df)
+
+    def test_ranking_order_preserved(self, index):
+        """Test that matches keep the descending volume order"""
+        result = index.filter('a')
+
+        assert result['Volume'].is_monotonic_decreasing
+
+    def test_matches_pandas_contains(self):
+        """Test agreement with a plain case-insensitive scan"""
+        data = "\n".join(f"Entity {i} {'alpha' if i % 3 else 'beta'}" for i in range(500))
+        df = process_data(data)
+        index = EntitySearchIndex(df)
+
+        expected = df[df['Entity'].str.casefold().str.contains('y 1', regex=False)]
+        pd.testing.assert_frame_equal(index.filter('y 1'), expected)
+
+    @pytest.mark.parametrize('ngram', [2, 3, 4])
+    def test_random_queries(self, ngram):
+        """Test queries of every length against a plain scan, with hashed n-grams for ngram=4"""
+        rng = random.Random(ngram)
+        names = {''.join(rng.choice('abAßc ') for _ in range(rng.randint(0, 9))) for _ in range(400)}
+        df = pd.DataFrame({'Entity': sorted(names), 'Volume': range(len(names))})
+        index = EntitySearchIndex(df, ngram=ngram)
+        folded = df['Entity'].str.casefold()
+
+        for _ in range(300):
+            query = ''.join(rng.choice('abAßcd ') for _ in range(rng.randint(1, 6)))
+            expected = np.flatnonzero(folded.str.contains(query.casefold(), regex=False))
+            assert index.substring_positions(query).tolist() == expected.tolist(), query
+
+    def test_matches_do_not_span_names(self):
+        """Test that a query is not found across the end of one name and the start of the next"""
+        index = EntitySearchIndex(pd.DataFrame({'Entity': ['xab', 'cdy'], 'Volume': [2, 1]}))
+        assert len(index.filter('abcd')) == 0
+        assert len(index.filter('bc')) == 0
+
+
+class TestIndexBuild:
+    """Test when the index is built"""
+
+    def test_built_on_first_query(self, index):
+        """Test that creating the index and blank queries do not build it"""
+        assert index._codes is None
+        index.filter('   ')
+        assert index._codes is None
+        index.filter('app')
+        assert index._codes is not None
+
+    def test_empty_result(self):
+        """Test searching a result without entities"""
+        index = EntitySearchIndex(process_data(""))
+        assert len(index.filter('a')) == 0
+        assert len(index.filter('abc')) == 0
+        assert len(index.filter('a', prefix=True)) == 0
@@ -0,0 +1,226 @@
+"""
+Tests for the shared aggregate with sharded locking.
+Tests contributions, snapshot consistency and concurrent use.
+"""
+import pytest
+import pandas as pd
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path to import the module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import process_data, SharedAggregate
+
+
+class TestContributions:
+    """Test combining contributions"""
+
+    def test_empty_aggregate(self):
+        """Test that a new aggregate has no entities"""
+        view = SharedAggregate().view()
+
+        assert len(view) == 0
+        assert list(view.to_frame().columns) == ['Entity', 'Volume']
+
+    def test_contributions_summed(self):
+        """Test that contributions are summed like one process_data call"""
+        shared = SharedAggregate(num_shards=4)
+        shared.contribute(process_data("Entity A|Entity B 5"))
+        shared.contribute(process_data("Entity A 2\nEntity C"))
+
+        expected = process_data("Entity A|Entity B 5\nEntity A 2\nEntity C")
+        pd.testing.assert_frame_equal(shared.view().to_frame(), expected)
+
+    def test_view_lookup(self):
+        """Test looking up a single entity in a view"""
+        shared = SharedAggregate()
+        shared.contribute(process_data("Entity A 4"))
+        view = shared.view()
+
+        assert view.get('Entity A') == 4
+        assert view.get('Entity Z') == 0
+        assert view.contributions == 1
+
+
+class TestSnapshots:
+    """Test snapshot isolation"""
+
+    def test_view_unaffected_by_later_contributions(self):
+        """Test that a view keeps the totals from when it was taken"""
+        shared = SharedAggregate(num_shards=2)
+        shared.contribute(process_data("Entity A 1"))
+        view = shared.view()
+
+        shared.contribute(process_data("Entity A 1\nEntity B"))
+
+        assert view.get('Entity A') == 1
+        assert len(view) == 1
+        assert shared.view().get('Entity A') == 2
+
+    def test_views_share_storage_until_written(self):
+        """Test that taking views does not copy the shards"""
+        shared = SharedAggregate(num_shards=1)
+        shared.contribute(process_data("Entity A"))
+
+        first, second = shared.view(), shared.view()
+
+        assert first._shards[0] is second._shards[0]
+
+    def test_view_reused_while_unchanged(self):
+        """Test that a view is reused until something is contributed"""
+        shared = SharedAggregate(num_shards=2)
+        shared.contribute(process_data("Entity A"))
+        first = shared.view()
+
+        assert shared.view() is first
+        shared.contribute(process_data("Entity A"))
+        assert shared.view() is not first
+
+    def test_only_changed_shards_copied(self):
+        """Test that a contribution after a view copies only the shards it changes"""
+        shared = SharedAggregate(num_shards=8)
+        shared.contribute(process_data("\n".join(f"Entity {i}-x" for i in range(100))))
+        view = shared.view()
+        index = shared._shard_index('Entity 0-x')
+
+        shared.contribute(process_data("Entity 0-x 5"))
+
+        for i, shard in enumerate(shared._shards):
+            assert (shard.totals is view._shards[i]) == (i != index)
+        assert view.get('Entity 0-x') == 1
+        assert shared.view().get('Entity 0-x') == 6
+
+
+class TestConcurrency:
+    """Test concurrent contributors and readers"""
+
+    @staticmethod
+    def _entity_in_shard(shared, index, taken=()):
+        """Return an entity name stored in the given shard"""
+        return next(f"Entity {i}" for i in range(10000)
+                    if shared._shard_index(f"Entity {i}") == index and f"Entity {i}" not in taken)
+
+    @staticmethod
+    def _wait_for(condition):
+        """Wait until another thread made condition true"""
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+
+    def test_contribution_locks_one_shard_at_a_time(self):
+        """Test that a contribution updates other shards while one of its shards is locked"""
+        shared = SharedAggregate(num_shards=4)
+        blocked = self._entity_in_shard(shared, 0)
+        free = self._entity_in_shard(shared, 1)
+        # Results are sorted by volume, so the free shard is updated first
+        df = process_data(f"{free} 5\n{blocked} 3")
+
+        with shared._shards[0].lock:
+            thread = threading.Thread(target=shared.contribute, args=(df,))
+            thread.start()
+            self._wait_for(lambda: shared._shards[1].totals.get(free) == 5)
+            # The free shard's lock is not held while waiting for the blocked one
+            assert shared._shards[1].lock.acquire(timeout=1)
+            shared._shards[1].lock.release()
+        thread.join()
+
+        assert shared.view().get(blocked) == 3
+
+    def test_older_contribution_completes_view(self):
+        """Test that a view includes an in-flight contribution but not newer ones"""
+        shared = SharedAggregate(num_shards=4)
+        first = self._entity_in_shard(shared, 1)
+        forked = self._entity_in_shard(shared, 2)
+        newer = self._entity_in_shard(shared, 2, taken={forked})
+        views = []
+
+        # The older contribution stops at shard 1 before reaching shard 2 (rows
+        # are sorted by volume)
+        with shared._shards[1].lock:
+            older = threading.Thread(target=shared.contribute,
+                                     args=(process_data(f"{first} 3\n{forked} 2"),))
+            older.start()
+            self._wait_for(lambda: shared._active[0] == 1)
+            reader = threading.Thread(target=lambda: views.append(shared.view()))
+            reader.start()
+            self._wait_for(lambda: shared._epoch == 1)
+            # A newer contribution forks shard 2 while the view waits
+            shared.contribute(process_data(f"{forked}|{newer} 7"))
+        older.join()
+        reader.join()
+
+        view = views[0]
+        assert view.contributions == 1
+        assert (view.get(first), view.get(forked), view.get(newer)) == (3, 2, 0)
+        latest = shared.view()
+        assert (latest.get(first), latest.get(forked), latest.get(newer)) == (3, 9, 7)
+        assert latest.contributions == 2
+
+    def test_concurrent_contributors_and_readers(self):
+        """Test that views stay whole while several threads contribute"""
+        shared = SharedAggregate(num_shards=16)
+        df = process_data("|".join(f"Entity {i}-x" for i in range(64)))
+        done = threading.Event()
+        inconsistent = []
+
+        def reader():
+            while not done.is_set():
+                view = shared.view()
+                volumes = set(view.to_frame()['Volume'])
+                if view.contributions and volumes != {view.contributions}:
+                    inconsistent.append((view.contributions, volumes))
+
+        readers = [threading.Thread(target=reader) for _ in range(2)]
+        writers = [threading.Thread(target=lambda: [shared.contribute(df) for _ in range(100)])
+                   for _ in range(4)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        assert not inconsistent
+        assert shared.view().contributions == 400
+
+    def test_concurrent_contributions(self):
+        """Test that no contribution is lost under concurrency"""
+        shared = SharedAggregate(num_shards=8)
+        df = process_data("\n".join(f"Entity {i} 2" for i in range(200)))
+
+        threads = [threading.Thread(target=lambda: [shared.contribute(df) for _ in range(20)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        view = shared.view()
+        assert view.contributions == 160
+        assert all(volume == 320 for volume in view.to_frame()['Volume'])
+
+    def test_readers_see_whole_contributions(self):
+        """Test that views never observe a partially applied contribution"""
+        shared = SharedAggregate(num_shards=8)
+        df = process_data("|".join(f"Entity {i}" for i in range(100)))
+        done = threading.Event()
+        inconsistent = []
+
+        def reader():
+            while not done.is_set():
+                volumes = set(shared.view().to_frame()['Volume'])
+                if len(volumes) > 1:
+                    inconsistent.append(volumes)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        for _ in range(200):
+            shared.contribute(df)
+        done.set()
+        thread.join()
+
+        assert not inconsistent
@@ -11,12 +11,28 @@ from unittest.mock import Mock, patch, MagicMock
 
 # Add parent directory to path to import the module
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Metric_multi_entity_analysis import DEFAULT_GRAMMAR
+
+
+def _streamlit_mock():
+    """Create a mocked st module whose optional widgets default to off"""
+    mock_st = MagicMock()
+    mock_st.sidebar.checkbox.return_value = False
+    mock_st.sidebar.text_input.return_value = ''
+    mock_st.sidebar.text_area.return_value = ''
+    mock_st.sidebar.selectbox.side_effect = lambda label, options, **kwargs: options[0]
+    mock_st.text_input.return_value = ''
+    mock_st.file_uploader.return_value = None
+    mock_st.container.return_value.button.return_value = False
+    mock_st.sidebar.button.return_value = False
+    mock_st.session_state = {}
+    return mock_st
 
 
 class TestStreamlitUI:
     """Test Streamlit UI components and main function"""
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_displays_title(self, mock_st):
         """Test that main() displays the correct title"""
         from Metric_multi_entity_analysis import main
@@ -30,7 +46,7 @@ class TestStreamlitUI:
         # Check that title was called with correct text
         mock_st.title.assert_called_once_with('Metric Entity Volume Analyser')
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_creates_text_area(self, mock_st):
         """Test that main() creates text area for input"""
         from Metric_multi_entity_analysis import main
@@ -43,7 +59,7 @@ class TestStreamlitUI:
         # Check that text_area was called with correct parameters
         mock_st.text_area.assert_called_once_with('Enter the data:', height=200)
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_creates_process_button(self, mock_st):
         """Test that main() creates process button"""
         from Metric_multi_entity_analysis import main
@@ -56,7 +72,7 @@ class TestStreamlitUI:
         # Check that button was called
         mock_st.button.assert_called_once_with('Process Data')
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_processes_data_when_button_clicked(self, mock_st):
         """Test that data is processed when button is clicked"""
         from Metric_multi_entity_analysis import main
@@ -72,7 +88,7 @@ class TestStreamlitUI:
         mock_st.subheader.assert_called_once_with('Preview of CSV file:')
         assert mock_st.write.called
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_displays_dataframe(self, mock_st):
         """Test that processed DataFrame is displayed"""
         from Metric_multi_entity_analysis import main
@@ -94,7 +110,7 @@ class TestStreamlitUI:
         assert 'Entity' in df_displayed.columns
         assert 'Volume' in df_displayed.columns
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_creates_download_button(self, mock_st):
         """Test that download button is created with correct CSV"""
         from Metric_multi_entity_analysis import main
@@ -121,7 +137,7 @@ class TestStreamlitUI:
         assert 'Entity,Volume' in csv_data
         assert 'Entity A,10' in csv_data
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_csv_format_correct(self, mock_st):
         """Test that CSV output has correct format"""
         from Metric_multi_entity_analysis import main
@@ -144,7 +160,7 @@ class TestStreamlitUI:
         # Check no index column
         assert not any(line.startswith(',') for line in lines)
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_no_processing_without_button_click(self, mock_st):
         """Test that data is not processed if button is not clicked"""
         from Metric_multi_entity_analysis import main
@@ -159,7 +175,7 @@ class TestStreamlitUI:
         mock_st.write.assert_not_called()
         mock_st.download_button.assert_not_called()
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_handles_empty_input(self, mock_st):
         """Test that main handles empty input gracefully"""
         from Metric_multi_entity_analysis import main
@@ -176,7 +192,7 @@ class TestStreamlitUI:
         df_displayed = mock_st.write.call_args[0][0]
         assert len(df_displayed) == 0
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_main_handles_complex_input(self, mock_st):
         """Test that main handles complex realistic input"""
         from Metric_multi_entity_analysis import main
@@ -204,7 +220,7 @@ Entity E"""
 class TestCSVExport:
     """Test CSV export functionality"""
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_csv_can_be_reimported(self, mock_st):
         """Test that exported CSV can be re-imported without data loss"""
         from Metric_multi_entity_analysis import main
@@ -230,7 +246,7 @@ class TestCSVExport:
         assert 'Entity A' in df_imported['Entity'].values
         assert 'Entity B' in df_imported['Entity'].values
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_csv_handles_special_characters(self, mock_st):
         """Test that CSV properly escapes special characters"""
         from Metric_multi_entity_analysis import main
@@ -252,7 +268,7 @@ class TestCSVExport:
         # Entity name with comma should be preserved
         assert 'Entity A, Inc' in df_imported['Entity'].values
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_csv_includes_all_rows(self, mock_st):
         """Test that CSV includes all processed rows"""
         from Metric_multi_entity_analysis import main
@@ -277,7 +293,7 @@ class TestCSVExport:
 class TestUIFlow:
     """Test complete user interaction flows"""
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_complete_user_flow(self, mock_st):
         """Test complete user flow from input to download"""
         from Metric_multi_entity_analysis import main
@@ -307,7 +323,7 @@ class TestUIFlow:
         # 5. Download button created
         assert mock_st.download_button.called
 
-    @patch('Metric_multi_entity_analysis.st')
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
     def test_multiple_button_clicks(self, mock_st):
         """Test behavior with multiple button clicks (re-processing)"""
         from Metric_multi_entity_analysis import main
@@ -329,3 +345,970 @@ class TestUIFlow:
 
         # Should process again
         assert mock_st.write.called
+
+
+class TestNearDuplicateMerging:
+    """Test the optional near-duplicate merging step in the UI"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_merging_disabled_by_default(self, mock_st):
+        """Test that variants stay separate when the option is off"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 3\nentity  a"
+        mock_st.button.return_value = True
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert len(df_displayed) == 2
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_merging_enabled(self, mock_st):
+        """Test that variants are merged when the option is on"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 3\nentity  a"
+        mock_st.button.return_value = True
+        mock_st.sidebar.checkbox.side_effect = (
+            lambda label, **kwargs: label == 'Merge near-duplicate entities'
+        )
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert len(df_displayed) == 1
+        assert df_displayed.iloc[0]['Entity'] == 'Entity A'
+        assert df_displayed.iloc[0]['Volume'] == 4
+        mock_st.caption.assert_called_once_with('Merged 1 near-duplicate entities.')
+
+
+class TestEntitySearch:
+    """Test the search box over the processed result"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_search_filters_preview(self, mock_st):
+        """Test that the preview only shows matching entities"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Apple|Banana 3\nPineapple 2"
+        mock_st.button.return_value = True
+        mock_st.text_input.return_value = 'apple'
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert set(df_displayed['Entity']) == {'Apple', 'Pineapple'}
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_search_does_not_filter_download(self, mock_st):
+        """Test that the CSV download contains the full result"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Apple|Banana"
+        mock_st.button.return_value = True
+        mock_st.text_input.return_value = 'apple'
+
+        main()
+
+        csv_data = mock_st.download_button.call_args[1]['data']
+        assert 'Banana' in csv_data
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_result_kept_across_reruns(self, mock_st):
+        """Test that typing a search after processing keeps the result"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Apple|Banana"
+        mock_st.button.return_value = True
+        main()
+
+        # Rerun caused by the search box: button is no longer pressed
+        mock_st.button.return_value = False
+        mock_st.text_input.return_value = 'ban'
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert df_displayed['Entity'].tolist() == ['Banana']
+
+
+class TestFollowDirectory:
+    """Test the live aggregate of a followed directory"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_live_aggregate_shown(self, mock_st, tmp_path):
+        """Test that the followed directory aggregate is displayed"""
+        from Metric_multi_entity_analysis import main
+
+        (tmp_path / 'feed.log').write_bytes(b"Entity A|Entity B 5\nEntit\xe9 C\n")
+        mock_st.text_area.return_value = ""
+        mock_st.button.return_value = False
+        mock_st.sidebar.selectbox.side_effect = lambda label, options, **kwargs: (
+            str(tmp_path) if label == 'Follow directory:' else options[0]
+        )
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_FOLLOW_DIRS': str(tmp_path)}):
+            main()
+
+        df_displayed = mock_st.dataframe.call_args[0][0]
+        assert set(df_displayed['Entity']) == {'Entity A', 'Entity B', 'Entit\ufffd C'}
+        mock_st.write.assert_not_called()
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_no_follow_without_directory(self, mock_st):
+        """Test that nothing is followed by default"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = ""
+        mock_st.button.return_value = False
+
+        main()
+
+        mock_st.dataframe.assert_not_called()
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_only_configured_directories(self, mock_st, tmp_path):
+        """Test that users choose among the operator's directories instead of typing a path"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = ""
+        mock_st.button.return_value = False
+        mock_st.sidebar.text_input.return_value = str(tmp_path)
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_FOLLOW_DIRS': ''}):
+            main()
+        labels = [c[0][0] for c in mock_st.sidebar.selectbox.call_args_list]
+        assert 'Follow directory:' not in labels
+        mock_st.dataframe.assert_not_called()
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_FOLLOW_DIRS': os.pathsep.join(['/a', '/b'])}):
+            main()
+        options = [c[0][1] for c in mock_st.sidebar.selectbox.call_args_list
+                   if c[0][0] == 'Follow directory:']
+        assert options == [['(none)', '/a', '/b']]
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_unreadable_directory_reported(self, mock_st, tmp_path):
+        """Test that a directory that cannot be read is shown as an error"""
+        from Metric_multi_entity_analysis import main
+
+        missing = str(tmp_path / 'missing')
+        mock_st.text_area.return_value = ""
+        mock_st.button.return_value = False
+        mock_st.sidebar.selectbox.side_effect = lambda label, options, **kwargs: (
+            missing if label == 'Follow directory:' else options[0]
+        )
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_FOLLOW_DIRS': missing}):
+            main()
+
+        assert 'Could not read the followed directory' in mock_st.error.call_args[0][0]
+        mock_st.dataframe.assert_not_called()
+
+
+class TestSharedAggregate:
+    """Test contributing to the server-wide shared aggregate"""
+
+    def setup_method(self):
+        from Metric_multi_entity_analysis import _shared_aggregate
+        _shared_aggregate.clear()
+
+    teardown_method = setup_method
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_sessions_contribute_to_shared_aggregate(self, mock_st):
+        """Test that results from separate sessions are combined"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.button.return_value = True
+        mock_st.sidebar.checkbox.side_effect = (
+            lambda label, **kwargs: label == 'Contribute to shared aggregate'
+        )
+
+        # Two sessions, each with its own session state
+        mock_st.text_area.return_value = "Entity A 3"
+        main()
+        mock_st.session_state = {}
+        mock_st.text_area.return_value = "Entity A|Entity B 2"
+        main()
+
+        shared_df = mock_st.dataframe.call_args[0][0]
+        volumes = dict(zip(shared_df['Entity'], shared_df['Volume']))
+        assert volumes == {'Entity A': 5, 'Entity B': 2}
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_snapshot_taken_on_request(self, mock_st):
+        """Test that contributing again does not take a new snapshot until refreshed"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 3"
+        mock_st.sidebar.checkbox.side_effect = (
+            lambda label, **kwargs: label == 'Contribute to shared aggregate'
+        )
+        mock_st.button.side_effect = lambda label, **kwargs: label == 'Process Data'
+
+        main()
+        main()
+        assert mock_st.session_state['shared_view'].contributions == 1
+
+        mock_st.button.side_effect = lambda label, **kwargs: label == 'Refresh shared aggregate'
+        main()
+        assert mock_st.session_state['shared_view'].contributions == 2
+        shared_df = mock_st.dataframe.call_args[0][0]
+        assert shared_df['Volume'].tolist() == [6]
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_no_contribution_by_default(self, mock_st):
+        """Test that results stay private unless the option is on"""
+        from Metric_multi_entity_analysis import main, _shared_aggregate
+
+        mock_st.text_area.return_value = "Entity A 3"
+        mock_st.button.return_value = True
+
+        main()
+
+        assert len(_shared_aggregate().view()) == 0
+        mock_st.dataframe.assert_not_called()
+
+
+class TestProgressiveProcessing:
+    """Test chunked processing with progress, cancel and duplicate suppression"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_progress_and_preview_shown(self, mock_st):
+        """Test that a progress bar and live preview are updated"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A|Entity B 5"
+        mock_st.button.return_value = True
+
+        main()
+
+        status = mock_st.container.return_value
+        assert status.progress.return_value.progress.called
+        preview_df = status.empty.return_value.dataframe.call_args[0][0]
+        assert set(preview_df['Entity']) == {'Entity A', 'Entity B'}
+        assert 'job' not in mock_st.session_state
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_cancel_discards_job(self, mock_st):
+        """Test that cancelling a running job shows no result"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A"
+        mock_st.button.return_value = False
+        mock_st.session_state['job'] = {'data': "Entity A", 'grammar': DEFAULT_GRAMMAR, 'position': 0, 'totals': {}}
+        mock_st.container.return_value.button.return_value = True
+
+        main()
+
+        mock_st.caption.assert_called_once_with('Processing cancelled.')
+        mock_st.write.assert_not_called()
+        assert 'job' not in mock_st.session_state
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_duplicate_click_resumes_job(self, mock_st):
+        """Test that clicking again on the same input continues the running job"""
+        from Metric_multi_entity_analysis import main
+
+        data = "Entity A 5\nEntity B 2"
+        mock_st.text_area.return_value = data
+        mock_st.button.return_value = True
+        # First row already aggregated by the interrupted run
+        mock_st.session_state['job'] = {'data': data, 'grammar': DEFAULT_GRAMMAR, 'position': 1, 'totals': {'Entity A': 5}}
+
+        main()
+
+        mock_st.caption.assert_called_once_with('This input is already being processed.')
+        df_displayed = mock_st.write.call_args[0][0]
+        assert dict(zip(df_displayed['Entity'], df_displayed['Volume'])) == {'Entity A': 5, 'Entity B': 2}
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_new_input_restarts_job(self, mock_st):
+        """Test that clicking with different input starts a fresh job"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity B"
+        mock_st.button.return_value = True
+        mock_st.session_state['job'] = {'data': "Entity A", 'grammar': DEFAULT_GRAMMAR, 'position': 1, 'totals': {'Entity A': 1}}
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert df_displayed['Entity'].tolist() == ['Entity B']
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_interrupted_job_resumes_on_rerun(self, mock_st):
+        """Test that a job interrupted by another widget finishes on the next rerun"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A"
+        mock_st.button.return_value = False
+        mock_st.session_state['job'] = {'data': "Entity A", 'grammar': DEFAULT_GRAMMAR, 'position': 0, 'totals': {}}
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert df_displayed['Entity'].tolist() == ['Entity A']
+
+
+class TestFileUpload:
+    """Test processing uploaded files"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_uploaded_csv_processed(self, mock_st):
+        """Test that an uploaded CSV is processed instead of the text area"""
+        from Metric_multi_entity_analysis import main
+        import io
+
+        upload = io.BytesIO(b"Entity,Volume\nEntity A,3\nEntity B|Entity A,2\n")
+        upload.name = 'export.csv'
+        mock_st.text_area.return_value = "Ignored"
+        mock_st.file_uploader.return_value = upload
+        mock_st.sidebar.text_input.return_value = ''
+        mock_st.button.return_value = True
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert dict(zip(df_displayed['Entity'], df_displayed['Volume'])) == {'Entity A': 5, 'Entity B': 2}
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_uploaded_ndjson_custom_fields(self, mock_st):
+        """Test that the sidebar column names are used for uploads"""
+        from Metric_multi_entity_analysis import main
+        import io
+
+        upload = io.BytesIO(b'{"names": ["Entity A", "Entity B"], "hits": 4}\n')
+        upload.name = 'export.jsonl'
+        mock_st.file_uploader.return_value = upload
+        mock_st.sidebar.text_input.side_effect = lambda label, **kwargs: {
+            'Entity column of uploaded files:': 'names',
+            'Volume column of uploaded files:': 'hits',
+        }.get(label, '')
+        mock_st.button.return_value = True
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert df_displayed['Volume'].tolist() == [4, 4]
+
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_uploaded_compressed_file(self, mock_st):
+        """Test that a gzip-compressed upload is decompressed while processing"""
+        from Metric_multi_entity_analysis import main
+        import gzip
+        import io
+
+        upload = io.BytesIO(gzip.compress(b"Entity,Volume\nEntity A,3\nEntity B,2\n"))
+        upload.name = 'export.csv.gz'
+        mock_st.file_uploader.return_value = upload
+        mock_st.button.return_value = True
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert dict(zip(df_displayed['Entity'], df_displayed['Volume'])) == {'Entity A': 3, 'Entity B': 2}
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_missing_decompressor_reported(self, mock_st):
+        """Test that a zstd upload without zstandard installed is reported, not raised"""
+        from Metric_multi_entity_analysis import main
+        import io
+
+        upload = io.BytesIO(b'\x28\xb5\x2f\xfd\x00\x00')
+        upload.name = 'export.csv.zst'
+        mock_st.file_uploader.return_value = upload
+        mock_st.button.return_value = True
+
+        with patch.dict(sys.modules, {'zstandard': None}):
+            main()
+
+        message = mock_st.error.call_args[0][0]
+        assert 'Could not process export.csv.zst' in message and 'zstandard' in message
+        mock_st.write.assert_not_called()
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_corrupt_workbook_reported(self, mock_st):
+        """Test that an upload that is not a valid workbook is reported, not raised"""
+        from Metric_multi_entity_analysis import main
+        import io
+
+        upload = io.BytesIO(b"not a workbook")
+        upload.name = 'export.xlsx'
+        mock_st.file_uploader.return_value = upload
+        mock_st.button.return_value = True
+
+        main()
+
+        assert 'Could not process export.xlsx' in mock_st.error.call_args[0][0]
+        mock_st.write.assert_not_called()
+
+class TestInputGrammar:
+    """Test the sidebar input grammar settings"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_custom_grammar_used(self, mock_st):
+        """Test that the sidebar separators and volume placement are applied"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "5 Entity A,Entity B;2 Entity A"
+        mock_st.button.return_value = True
+        mock_st.sidebar.selectbox.side_effect = lambda label, options, **kwargs: {
+            'Row separator:': 'Semicolon (;)',
+            'Volume position:': 'First number on the line',
+        }[label]
+        mock_st.sidebar.text_input.side_effect = lambda label, **kwargs: {
+            'Entity separator:': ',',
+        }.get(label, '')
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert dict(zip(df_displayed['Entity'], df_displayed['Volume'])) == {'Entity A': 7, 'Entity B': 5}
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_changed_grammar_restarts_job(self, mock_st):
+        """Test that a running job is restarted when the grammar changes"""
+        from Metric_multi_entity_analysis import main, Grammar
+
+        mock_st.text_area.return_value = "Entity A x3"
+        mock_st.button.return_value = True
+        mock_st.session_state['job'] = {
+            'data': "Entity A x3", 'grammar': Grammar(volume_prefix='x'),
+            'position': 1, 'totals': {'Entity A': 3},
+        }
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert df_displayed['Entity'].tolist() == ['Entity A x3']
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_invalid_upload_grammar_reported(self, mock_st):
+        """Test that uploads reject a row separator other than newline"""
+        from Metric_multi_entity_analysis import main
+        import io
+
+        upload = io.BytesIO(b"Entity A;Entity B")
+        upload.name = 'export.txt'
+        mock_st.file_uploader.return_value = upload
+        mock_st.button.return_value = True
+        mock_st.sidebar.selectbox.side_effect = lambda label, options, **kwargs: (
+            'Semicolon (;)' if label == 'Row separator:' else options[0]
+        )
+
+        main()
+
+        assert mock_st.error.called
+        mock_st.write.assert_not_called()
+
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_decimal_volumes_option(self, mock_st):
+        """Test that the decimal volumes checkbox enables decimal parsing"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 2.5\nEntity A 1"
+        mock_st.button.return_value = True
+        mock_st.sidebar.checkbox.side_effect = lambda label, **kwargs: label == 'Decimal volumes'
+
+        main()
+
+        df_displayed = mock_st.write.call_args[0][0]
+        assert df_displayed['Volume'].tolist() == [3.5]
+        mock_st.warning.assert_not_called()
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_overflow_reported(self, mock_st):
+        """Test that exact integer escalation is shown to the user"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 9223372036854775807\nEntity A 1"
+        mock_st.button.return_value = True
+        mock_st.sidebar.checkbox.side_effect = lambda label, **kwargs: label == 'Decimal volumes'
+
+        main()
+
+        assert '64-bit' in mock_st.warning.call_args[0][0]
+        assert mock_st.write.call_args[0][0]['Volume'].tolist() == [9223372036854775808]
+
+class TestResultCache:
+    """Test the on-disk result cache in the web interface"""
+
+    def setup_method(self):
+        from Metric_multi_entity_analysis import _result_cache
+        _result_cache.clear()
+
+    teardown_method = setup_method
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_repeated_input_loaded_from_cache(self, mock_st, tmp_path):
+        """Test that a new session reuses the result of an earlier one"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A|Entity B 5\nEntity A 2"
+        mock_st.button.return_value = True
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_CACHE_DIR': str(tmp_path)}):
+            main()
+            first = mock_st.write.call_args[0][0]
+            assert len(os.listdir(tmp_path)) == 1
+
+            mock_st.session_state = {}
+            main()
+
+        mock_st.caption.assert_called_with('Loaded cached result.')
+        pd.testing.assert_frame_equal(mock_st.write.call_args[0][0], first)
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_cached_upload(self, mock_st, tmp_path):
+        """Test that uploads are cached by content and column settings"""
+        from Metric_multi_entity_analysis import main
+        import io
+
+        mock_st.button.return_value = True
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_CACHE_DIR': str(tmp_path)}):
+            for _ in range(2):
+                upload = io.BytesIO(b"Entity,Volume\nEntity A,3\n")
+                upload.name = 'export.csv'
+                mock_st.file_uploader.return_value = upload
+                main()
+
+        mock_st.caption.assert_called_with('Loaded cached result.')
+        assert mock_st.write.call_args[0][0]['Volume'].tolist() == [3]
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_no_cache_by_default(self, mock_st):
+        """Test that nothing is cached unless a cache directory is configured"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 3"
+        mock_st.button.return_value = True
+
+        with patch.dict(os.environ, clear=False) as env:
+            env.pop('METRIC_ANALYSIS_CACHE_DIR', None)
+            main()
+            mock_st.session_state = {}
+            main()
+
+        assert all(call[0][0] != 'Loaded cached result.' for call in mock_st.caption.call_args_list)
+
+
+class TestSourceLineDrillDown:
+    """Test drilling down from an entity to its source lines"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_source_lines_shown(self, mock_st):
+        """Test that the lines mentioning an entity are listed"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A|Entity B 5\nEntity B\nEntity A 2"
+        mock_st.button.return_value = True
+        mock_st.sidebar.checkbox.side_effect = lambda label, **kwargs: label == 'Index source lines'
+        mock_st.text_input.side_effect = lambda label, **kwargs: (
+            'Entity A' if label == 'Show source lines of entity:' else ''
+        )
+
+        main()
+
+        lines = mock_st.dataframe.call_args[0][0]
+        assert lines['Line'].tolist() == [1, 3]
+        assert lines['Text'].tolist() == ['Entity A|Entity B 5', 'Entity A 2']
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_unknown_entity(self, mock_st):
+        """Test that an unknown entity name is reported"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 5"
+        mock_st.button.return_value = True
+        mock_st.sidebar.checkbox.side_effect = lambda label, **kwargs: label == 'Index source lines'
+        mock_st.text_input.side_effect = lambda label, **kwargs: (
+            'Entity Z' if label == 'Show source lines of entity:' else ''
+        )
+
+        main()
+
+        mock_st.caption.assert_called_with("No entity named 'Entity Z'.")
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_no_drill_down_by_default(self, mock_st):
+        """Test that no index is built unless the option is on"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 5"
+        mock_st.button.return_value = True
+
+        main()
+
+        labels = [call[0][0] for call in mock_st.text_input.call_args_list]
+        assert 'Show source lines of entity:' not in labels
+        assert 'provenance' not in mock_st.session_state
+
+
+class TestCharts:
+    """Test the built-in charts"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_chart_payload_bounded(self, mock_st):
+        """Test that the charts only carry downsampled data"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "\n".join(f"Entity {i}-x {i}" for i in range(1, 5001))
+        mock_st.button.return_value = True
+
+        main()
+
+        charts = [call[0][0] for call in mock_st.altair_chart.call_args_list]
+        assert len(charts) == 3
+        top, share, histogram = (chart.data for chart in charts)
+        assert len(top) == 21
+        assert top['Entity'].iloc[-1] == 'Other (4980 entities)'
+        assert len(share) <= 200
+        assert histogram['Entities'].sum() == 5000
+        assert all(call.kwargs == {'use_container_width': True} for call in mock_st.altair_chart.call_args_list)
+
+
+class TestSampledPreview:
+    """Test the sampled preview and the follow-up full run"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_preview_then_full_run(self, mock_st):
+        """Test that the preview is shown and the full run replaces it"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A|Entity B 5\nEntity A 3"
+        mock_st.button.return_value = False
+        mock_st.sidebar.button.return_value = True
+
+        main()
+
+        preview = mock_st.dataframe.call_args[0][0]
+        assert preview['Entity'].tolist() == ['Entity A', 'Entity B']
+        assert preview['Volume'].tolist() == [8, 5]
+        mock_st.caption.assert_any_call(
+            'Estimated from 2 of 2 lines, with 95% confidence intervals on volumes and ranks.')
+        assert 'result' not in mock_st.session_state
+
+        # The next rerun launches the exact processing from the preview
+        mock_st.sidebar.button.return_value = False
+        mock_st.container.return_value.button.side_effect = (
+            lambda label, **kwargs: label == 'Run full processing')
+
+        main()
+
+        assert 'preview' not in mock_st.session_state
+        df, _ = mock_st.session_state['result']
+        assert df['Volume'].tolist() == [8, 5]
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_preview_rows_not_split_up_front(self, mock_st):
+        """Test that the preview samples lazily split rows instead of a list of all rows"""
+        import Metric_multi_entity_analysis as app
+
+        mock_st.text_area.return_value = "Entity A 5\nEntity B 3"
+        mock_st.button.return_value = False
+        mock_st.sidebar.button.return_value = True
+
+        with patch.object(app, 'preview_rows', wraps=app.preview_rows) as preview_rows:
+            app.main()
+
+        rows = preview_rows.call_args[0][0]
+        assert not isinstance(rows, list)
+        assert list(rows) == ['Entity A 5', 'Entity B 3']
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_preview_hidden_when_input_changes(self, mock_st):
+        """Test that a preview of other input is not shown"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 5"
+        mock_st.button.return_value = False
+        mock_st.sidebar.button.return_value = True
+        main()
+
+        mock_st.dataframe.reset_mock()
+        mock_st.text_area.return_value = "Entity B 5"
+        mock_st.sidebar.button.return_value = False
+        main()
+
+        mock_st.dataframe.assert_not_called()
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_no_preview_of_uploads(self, mock_st):
+        """Test that previews of uploaded files are declined"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = ''
+        mock_st.file_uploader.return_value = MagicMock(name='upload')
+        mock_st.button.return_value = False
+        mock_st.sidebar.button.return_value = True
+
+        main()
+
+        mock_st.caption.assert_any_call('Sampled previews are available for pasted text only.')
+        assert 'preview' not in mock_st.session_state
+
+
+class TestProcessingMetrics:
+    """Test the metrics recorded by the web interface"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_web_run_recorded(self, mock_st):
+        """Test that a completed web run records its lines and entities"""
+        import Metric_multi_entity_analysis as app
+
+        mock_st.text_area.return_value = "Entity A|Entity B 5\nEntity A 3"
+        mock_st.button.return_value = True
+        runs = app._RUNS.value(source='web')
+        lines = app._LINES.value(source='web')
+
+        app.main()
+
+        assert app._RUNS.value(source='web') == runs + 1
+        assert app._LINES.value(source='web') == lines + 2
+
+
+class TestAdmissionControl:
+    """Test the pre-flight estimate and admission control of pasted text"""
+
+    def setup_method(self):
+        from Metric_multi_entity_analysis import _admission_controller
+        _admission_controller.clear()
+
+    teardown_method = setup_method
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_large_input_bounded(self, mock_st):
+        """Test that a heavy input runs in bounded-memory mode with the same result"""
+        from Metric_multi_entity_analysis import main, process_data
+
+        data = "\n".join(f"Entity {i % 300} 5" for i in range(2000))
+        mock_st.text_area.return_value = data
+        mock_st.button.return_value = True
+        mock_st.sidebar.checkbox.side_effect = lambda label, **kwargs: label == 'Index source lines'
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_MEMORY_BUDGET': '1'}):
+            main()
+
+        assert 'bounded-memory mode' in mock_st.caption.call_args_list[0][0][0]
+        df, _ = mock_st.session_state['result']
+        pd.testing.assert_frame_equal(df, process_data(data))
+        assert 'provenance' not in mock_st.session_state
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_oversized_input_rejected(self, mock_st):
+        """Test that an input beyond the budget is rejected before processing"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "\n".join(f"Entity {i} 5" for i in range(10000))
+        mock_st.button.return_value = True
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_MEMORY_BUDGET': '1'}):
+            main()
+
+        assert 'more than the server allows (1 MiB)' in mock_st.error.call_args[0][0]
+        assert 'job' not in mock_st.session_state
+        assert 'result' not in mock_st.session_state
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    @patch('Metric_multi_entity_analysis._ADMISSION_WAIT', 0)
+    def test_busy_server_queues_job(self, mock_st):
+        """Test that a job waits while other jobs hold the heavy-job slots"""
+        from Metric_multi_entity_analysis import main, _admission_controller, WorkloadEstimate
+
+        mock_st.text_area.return_value = "\n".join(f"Entity {i % 300} 5" for i in range(2000))
+        mock_st.button.return_value = True
+        controller = _admission_controller(1 << 20, 1)
+        other = controller.admit(WorkloadEstimate(0, 0, 0, 1 << 30, 1000, 0.0))
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_MEMORY_BUDGET': '1',
+                                     'METRIC_ANALYSIS_MAX_HEAVY_JOBS': '1'}):
+            main()
+            mock_st.warning.assert_called_once()
+            assert 'queued' in mock_st.warning.call_args[0][0]
+            assert 'job' in mock_st.session_state
+
+            # Once the other job finishes, the next rerun processes the input
+            other.release()
+            mock_st.button.return_value = False
+            main()
+
+        assert 'job' not in mock_st.session_state
+        assert 'result' in mock_st.session_state
+
+
+class TestEntityMapping:
+    """Test enrichment from a mapping table in the web interface"""
+
+    def setup_method(self):
+        from Metric_multi_entity_analysis import _mapping_index
+        _mapping_index.clear()
+
+    teardown_method = setup_method
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_enrich_and_group_by(self, mock_st, tmp_path):
+        """Test that results get mapped columns and a table by the chosen attribute"""
+        from Metric_multi_entity_analysis import main
+
+        path = tmp_path / 'owners.csv'
+        path.write_text("Entity,Team\nEntity A,core\nEntity B,edge\n", encoding='utf-8')
+        mock_st.text_area.return_value = "Entity A|Entity B 5\nEntity A 3"
+        mock_st.button.return_value = True
+        mock_st.sidebar.selectbox.side_effect = lambda label, options, **kwargs: {
+            'Mapping file:': str(path),
+            'Aggregate by:': 'Team',
+        }.get(label, options[0])
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_CACHE_DIR': str(tmp_path / 'cache'),
+                                     'METRIC_ANALYSIS_MAPPING_FILES': str(path)}):
+            main()
+
+        df, _ = mock_st.session_state['result']
+        assert df.values.tolist() == [['Entity A', 8, 'core'], ['Entity B', 5, 'edge']]
+        mock_st.subheader.assert_any_call('Volume by Team:')
+        by_team = mock_st.dataframe.call_args_list[0][0][0]
+        assert by_team.values.tolist() == [['core', 8], ['edge', 5]]
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_missing_mapping_file(self, mock_st, tmp_path):
+        """Test that an unreadable mapping file is reported and ignored"""
+        from Metric_multi_entity_analysis import main
+
+        missing = str(tmp_path / 'missing.csv')
+        mock_st.text_area.return_value = "Entity A 3"
+        mock_st.button.return_value = True
+        mock_st.sidebar.selectbox.side_effect = lambda label, options, **kwargs: (
+            missing if label == 'Mapping file:' else options[0]
+        )
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_MAPPING_FILES': missing}):
+            main()
+
+        assert 'Could not load the mapping file' in mock_st.sidebar.error.call_args[0][0]
+        df, _ = mock_st.session_state['result']
+        assert df.columns.tolist() == ['Entity', 'Volume']
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_entity_column_selected(self, mock_st, tmp_path):
+        """Test that the entity column is chosen from the mapping file's header"""
+        from Metric_multi_entity_analysis import main
+
+        path = tmp_path / 'owners.tsv'
+        path.write_text("Team\tAccount\ncore\tEntity A\n", encoding='utf-8')
+        mock_st.text_area.return_value = "Entity A 3"
+        mock_st.button.return_value = True
+        mock_st.sidebar.selectbox.side_effect = lambda label, options, **kwargs: {
+            'Mapping file:': str(path),
+            'Entity column of the mapping file:': 'Account',
+        }.get(label, options[0])
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_CACHE_DIR': str(tmp_path / 'cache'),
+                                     'METRIC_ANALYSIS_MAPPING_FILES': str(path)}):
+            main()
+
+        options = [c[0][1] for c in mock_st.sidebar.selectbox.call_args_list
+                   if c[0][0] == 'Entity column of the mapping file:']
+        assert options == [['Team', 'Account']]
+        df, _ = mock_st.session_state['result']
+        assert df.values.tolist() == [['Entity A', 3, 'core']]
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_only_configured_mapping_files(self, mock_st, tmp_path):
+        """Test that users choose among the operator's mapping files instead of typing a path"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 3"
+        mock_st.button.return_value = True
+        mock_st.sidebar.text_input.return_value = str(tmp_path / 'owners.csv')
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_MAPPING_FILES': ''}):
+            main()
+        labels = [c[0][0] for c in mock_st.sidebar.selectbox.call_args_list]
+        assert 'Mapping file:' not in labels
+        mock_st.sidebar.error.assert_not_called()
+
+        with patch.dict(os.environ, {'METRIC_ANALYSIS_MAPPING_FILES': os.pathsep.join(['/a.csv', '/b.tsv'])}):
+            main()
+        options = [c[0][1] for c in mock_st.sidebar.selectbox.call_args_list
+                   if c[0][0] == 'Mapping file:']
+        assert options == [['(none)', '/a.csv', '/b.tsv']]
+        df, _ = mock_st.session_state['result']
+        assert df.columns.tolist() == ['Entity', 'Volume']
+
+
+class TestEntityFilters:
+    """Test the sidebar include/exclude rules"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_rules_applied(self, mock_st):
+        """Test that excluded entities never reach the result"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A|test-1 5\nthe|Entity B 2"
+        mock_st.button.return_value = True
+        mock_st.sidebar.text_area.side_effect = \
+            lambda label, **kwargs: 'the\ncontains:test' if label.startswith('Exclude') else ''
+
+        main()
+
+        df, _ = mock_st.session_state['result']
+        assert df['Entity'].tolist() == ['Entity A', 'Entity B']
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_invalid_rule_reported(self, mock_st):
+        """Test that an invalid rule is reported and the rules are ignored"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A|test-1 5"
+        mock_st.button.return_value = True
+        mock_st.sidebar.text_area.side_effect = \
+            lambda label, **kwargs: 're:(' if label.startswith('Include') else ''
+
+        main()
+
+        assert 'Filter rules ignored' in mock_st.sidebar.error.call_args[0][0]
+        df, _ = mock_st.session_state['result']
+        assert len(df) == 2
+
+
+class TestProfiling:
+    """Test profiling processing runs from the web interface"""
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_profile_shown_and_offered(self, mock_st):
+        """Test that a profiled run shows its hot functions and offers the raw profile"""
+        from Metric_multi_entity_analysis import main, Profiler
+
+        mock_st.text_area.return_value = "Entity A|Entity B 5\nEntity A 3"
+        mock_st.button.return_value = True
+        mock_st.sidebar.checkbox.side_effect = lambda label, **kwargs: label == 'Profile processing'
+        mock_st.sidebar.selectbox.side_effect = \
+            lambda label, options, **kwargs: options[-1] if label == 'Profiler:' else options[0]
+
+        main()
+
+        profiler = mock_st.session_state['profile']
+        assert isinstance(profiler, Profiler)
+        assert profiler.mode == 'deterministic'
+        pd.testing.assert_frame_equal(mock_st.dataframe.call_args_list[0][0][0], profiler.functions())
+        assert 'iter_process_chunks' in profiler.functions(top=1000)['Function'].tolist()
+        download = mock_st.download_button.call_args[1]
+        assert download['file_name'] == 'metric_analysis.prof'
+        assert download['data'] == profiler.dump()
+
+    @patch('Metric_multi_entity_analysis.st', new_callable=_streamlit_mock)
+    def test_no_profile_by_default(self, mock_st):
+        """Test that runs are not profiled unless asked to"""
+        from Metric_multi_entity_analysis import main
+
+        mock_st.text_area.return_value = "Entity A 3"
+        mock_st.button.return_value = True
+
+        main()
+
+        assert 'profile' not in mock_st.session_state
+        assert all(call[0][0] != 'Profiler:' for call in mock_st.sidebar.selectbox.call_args_list)